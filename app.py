@@ -4,45 +4,213 @@ from dotenv import load_dotenv
 import os
 from fastlite import database
 from dataclasses import dataclass
-from routes import auth, products, cart
-from models import db, load_sample_products
+from routes import admin, auth, products, cart, orders, reports
+from models import db, configure_database, ensure_bootstrapped
+from commands import (bootstrap_database, import_products, migrate_database, rebuild_reports, release_holds,
+                      requeue_jobs, reshard_database, run_worker)
+from hashing import HashingBusy
+from connection import PoolTimeout
+from tokens import load_token_user
+import metrics
+import threading
+from reservations import ReservationSweeper
+from ratelimit import ConcurrencyLimiter, MemoryBucketStore, RateLimit, RateLimiter
+from responses import FastJSONProvider, compress
+from sharding import route_request
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY') or 'your-secret-key-here'
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
 
-# Check if the products table is empty and load sample products if it is
-result = db.q(f'SELECT COUNT(*) AS enum FROM products')
-if result[0]['enum'] == 0:
-    load_sample_products()
+def _running(thread: threading.Thread | None) -> bool:
+    return thread is not None and thread.is_alive()
 
-@app.route("/", methods=['GET'])
-def home():
-    # Just for testing
-    return "API running"
+def default_config() -> dict:
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY') or 'your-secret-key-here',
+        'DATABASE_URL': os.getenv('DATABASE_URL', 'data/ecommerce.db'),
+        # Shard files for users, carts and orders; none keeps them in DATABASE_URL
+        'SHARD_URLS': [path.strip() for path in os.getenv('SHARD_URLS', '').split(',') if path.strip()],
+        # Migrate and seed on the first request of each process; turn off in
+        # production and run `flask bootstrap` once per deploy instead
+        'AUTO_BOOTSTRAP': _env_flag('AUTO_BOOTSTRAP', 'true'),
+        'RESERVATION_SWEEP_INTERVAL': float(os.getenv('RESERVATION_SWEEP_INTERVAL', 60)),
+        # Token-bucket limits by view function name, and for every other endpoint
+        'RATELIMITS': {
+            'login': RateLimit(rate=1, burst=10),
+            'register': RateLimit(rate=0.2, burst=5),
+            'get_products': RateLimit(rate=20, burst=100, by='user'),
+            'search_products': RateLimit(rate=10, burst=50, by='user'),
+            'export_products': RateLimit(rate=0.1, burst=2, by='user'),
+            'bulk_upsert_products': RateLimit(rate=0.1, burst=2, by='user'),
+            'place_order': RateLimit(rate=1, burst=5, by='user'),
+        },
+        'RATELIMIT_DEFAULT': RateLimit(rate=50, burst=200, by='user'),
+    }
 
-# Auth routes
-app.route('/v1/register', methods=['POST'])(auth.register)
-app.route('/v1/login', methods=['POST'])(auth.login)
-app.route('/v1/logout', methods=['POST'])(auth.logout)
-app.route('/v1/user/<str:username>', methods=['DELETE'])(auth.delete_user)
-app.route('/v1/user/<str:username>', methods=['GET'])(auth.get_user)  
+# db is module-wide, so every app of a process shares the database
+# configuration of the first one
+_database_config: tuple[str, list[str]] | None = None
 
-# Product routes
-app.route('/v1/products', methods=['GET'])(products.get_products)
-app.route('/v1/products', methods=['POST'])(products.add_product)  
-app.route('/v1/products/<int:product_id>', methods=['GET'])(products.get_product_by_id)
-app.route('/v1/products/<int:product_id>', methods=['PUT'])(products.update_product)
-app.route('/v1/products/<int:product_id>', methods=['DELETE'])(products.delete_product)
+def create_app(config: dict | None = None) -> Flask:
+    """Build the application without touching the database.
 
-# Cart routes
-app.route('/v1/cart', methods=['POST'])(cart.add_to_cart)
-app.route('/v1/cart/<int:user_id>', methods=['GET'])(cart.get_cart)
-app.route('/v1/cart/<int:user_id>', methods=['DELETE'])(cart.delete_cart)
-app.route('/v1/order/<int:user_id>', methods=['POST'])(cart.place_order)
+    Nothing here opens a SQLite connection or starts a thread, so a server
+    can import the app once and fork workers from it: each worker opens its
+    own connections, and starts the reservation sweeper, on its first request.
+    There is one database configuration per process, that of the first app
+    built: a ``DATABASE_URL`` or ``SHARD_URLS`` other than its own raises
+    RuntimeError. Importing this module builds none; ``app.app`` is built
+    from the environment on first access.
+    """
+    global _database_config
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    database_config = (app.config['DATABASE_URL'], list(app.config['SHARD_URLS']))
+    if _database_config is None:
+        configure_database(*database_config)
+        _database_config = database_config
+    elif database_config != _database_config:
+        raise RuntimeError('An app of this process already uses DATABASE_URL={!r} and SHARD_URLS={!r}'
+                           .format(*_database_config))
+    # orjson behind jsonify when installed, the standard library otherwise
+    app.json = FastJSONProvider(app)
 
+    app.cli.add_command(bootstrap_database)
+    app.cli.add_command(import_products)
+    app.cli.add_command(migrate_database)
+    app.cli.add_command(release_holds)
+    app.cli.add_command(reshard_database)
+    app.cli.add_command(run_worker)
+    app.cli.add_command(requeue_jobs)
+    app.cli.add_command(rebuild_reports)
+
+    # Latency, response size and SQL time of every request, including rejected ones
+    app.before_request(metrics.start_request)
+    app.after_request(metrics.record_response)
+    app.teardown_request(metrics.finish_request)
+    # Runs before record_response (after_request hooks run in reverse), so the
+    # size histogram sees the bytes actually sent
+    app.after_request(compress)
+
+    # Shed load beyond MAX_IN_FLIGHT concurrent requests with a 503
+    admission = app.extensions['admission'] = ConcurrencyLimiter.from_env()
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
+
+    # Per-process work deferred from startup to the first request
+    sweeper_lock = threading.Lock()
+
+    def start_process() -> None:
+        if app.config['AUTO_BOOTSTRAP']:
+            ensure_bootstrapped()
+        interval = app.config['RESERVATION_SWEEP_INTERVAL']
+        # Threads do not survive a fork, so check this process has one running
+        if interval > 0 and not _running(app.extensions.get('sweeper')):
+            with sweeper_lock:
+                if not _running(app.extensions.get('sweeper')):
+                    # Expired stock holds stop counting at once; this only deletes them
+                    app.extensions['sweeper'] = ReservationSweeper(interval)
+                    app.extensions['sweeper'].start()
+
+    app.before_request(start_process)
+
+    # Requests about one user run on that user's shard
+    app.before_request(route_request)
+
+    # Verify bearer tokens up front; authorization then needs no user lookup
+    app.before_request(load_token_user)
+
+    # Per-endpoint rate limits, by view function name; use a RedisBucketStore to
+    # share the buckets between workers
+    rate_limiter = app.extensions['rate_limiter'] = RateLimiter(
+        MemoryBucketStore(), app.config['RATELIMITS'], default=app.config['RATELIMIT_DEFAULT'])
+    app.before_request(rate_limiter.check)
+
+    @app.teardown_appcontext
+    def release_db_connection(exception: BaseException | None = None) -> None:
+        # Hand this thread's connections back to the pools at the end of each request
+        db.release()
+
+    @app.errorhandler(HashingBusy)
+    def hashing_busy(error: HashingBusy) -> tuple:
+        # Shed login/register load instead of letting it starve the other routes
+        return jsonify({'error': 'Too Many Requests: try again shortly'}), 429, {'Retry-After': '1'}
+
+    @app.errorhandler(PoolTimeout)
+    def pool_timeout(error: PoolTimeout) -> tuple:
+        # Every connection stayed busy for DB_POOL_TIMEOUT: overloaded, not broken
+        return jsonify({'error': 'Service Unavailable: try again shortly'}), 503, {'Retry-After': '1'}
+
+    @app.route("/", methods=['GET'])
+    def home():
+        # Just for testing
+        return "API running"
+
+    app.route('/metrics', methods=['GET'])(metrics.metrics_endpoint)
+
+    # Auth routes
+    app.route('/v1/register', methods=['POST'])(auth.register)
+    app.route('/v1/login', methods=['POST'])(auth.login)
+    app.route('/v1/logout', methods=['POST'])(auth.logout)
+    app.route('/v1/user/<string:username>', methods=['DELETE'])(auth.delete_user)
+    app.route('/v1/user/<string:username>', methods=['GET'])(auth.get_user)  
+
+    # Product routes
+    app.route('/v1/products', methods=['GET'])(products.get_products)
+    app.route('/v1/products', methods=['POST'])(products.add_product)  
+    app.route('/v1/products/search', methods=['GET'])(products.search_products)
+    app.route('/v1/products/bulk', methods=['POST'])(products.bulk_upsert_products)
+    app.route('/v1/products/export', methods=['GET'])(products.export_products)
+    app.route('/v1/products/<int:product_id>', methods=['GET'])(products.get_product_by_id)
+    app.route('/v1/products/<int:product_id>/availability', methods=['GET'])(products.get_product_availability)
+    app.route('/v1/products/<int:product_id>', methods=['PUT'])(products.update_product)
+    app.route('/v1/products/<int:product_id>', methods=['DELETE'])(products.delete_product)
+    app.route('/v1/admin/cache', methods=['GET'])(products.get_cache_stats)
+
+    # Admin routes, across all shards
+    app.route('/v1/admin/orders', methods=['GET'])(admin.list_orders)
+    app.route('/v1/admin/shards', methods=['GET'])(admin.get_shard_stats)
+    app.route('/v1/admin/jobs', methods=['GET'])(admin.get_job_stats)
+
+    # Report routes, read from the rollups
+    app.route('/v1/admin/reports/sales', methods=['GET'])(reports.sales_report)
+    app.route('/v1/admin/reports/products', methods=['GET'])(reports.top_products_report)
+    app.route('/v1/admin/reports/products/<int:product_id>', methods=['GET'])(reports.product_sales_report)
+    app.route('/v1/admin/reports/users', methods=['GET'])(reports.top_users_report)
+    app.route('/v1/admin/reports/users/<int:user_id>', methods=['GET'])(reports.user_sales_report)
+    app.route('/v1/admin/reports/low-stock', methods=['GET'])(reports.low_stock_report)
+
+    # Cart routes
+    app.route('/v1/cart', methods=['POST'])(cart.add_to_cart)
+    app.route('/v1/cart/batch', methods=['POST'])(cart.batch_update_cart)
+    app.route('/v1/cart/<int:user_id>', methods=['GET'])(cart.get_cart)
+    app.route('/v1/cart/<int:user_id>', methods=['DELETE'])(cart.delete_cart)
+    app.route('/v1/order/<int:user_id>', methods=['POST'])(cart.place_order)
+
+    # Order routes
+    app.route('/v1/orders/<int:user_id>', methods=['GET'])(orders.get_orders)
+    app.route('/v1/orders/<int:user_id>/<int:order_id>', methods=['GET'])(orders.get_order)
+
+    return app
+
+_default_app: Flask | None = None
+_default_app_lock = threading.Lock()
+
+def __getattr__(name: str):
+    # app:app, the instance built from the environment, is only created on
+    # first access, so importing this module configures no database and a
+    # create_app(config) called first gets the database of its config
+    global _default_app
+    if name not in ('app', 'admission'):
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+    return _default_app if name == 'app' else _default_app.extensions['admission']
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
@@ -0,0 +1,170 @@
+"""ASGI entry point serving the same Flask application.
+
+Run with any ASGI server, e.g. ``uvicorn asgi:app``. Connections, including
+idle keep-alive ones, live on the event loop and cost no thread; only requests
+in flight occupy one. Requests that write go through a single dedicated writer
+thread, so writes are queued in-process instead of contending for the SQLite
+write lock, while reads run on a pool of reader threads. Request bodies are
+read on the event loop before a thread is taken, so a slow client never holds
+one; bulk imports instead stream their body on a thread of their own, which
+keeps large uploads off the writer thread. With SHARD_URLS,
+each shard has a write lock of its own: set ASGI_WRITER_THREADS to the number
+of shards. Every request checks a connection out of the pool as usual, so the
+pools are grown to ``connections_needed`` at startup, whatever DB_POOL_SIZE
+says; a request that still finds none gets a 503.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from app import app as flask_app
+from models import db
+
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+# POST endpoints that only read (or write rarely) and are CPU-bound, so they
+# must not queue behind the writer thread
+READ_PATHS = {'/v1/login', '/v1/logout', '/v1/register'}
+# Endpoints that stream large bodies instead of having them buffered
+STREAM_PATHS = {'/v1/products/bulk'}
+
+class _RequestBody(io.RawIOBase):
+    """File-like request body fed from the ASGI ``receive`` channel on demand."""
+
+    def __init__(self, receive: Callable, loop: asyncio.AbstractEventLoop) -> None:
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self._more = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more = False
+                break
+            self._buffer = message.get('body', b'')
+            self._more = message.get('more_body', False)
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+async def _read_body(receive: Callable) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+def _environ(scope: dict, body: io.BufferedIOBase) -> dict:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body ends when the ASGI server says so, even without Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        if key in environ:
+            # Repeated Cookie headers are one list of pairs, not a comma list
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+class ASGIApp:
+    def __init__(self, wsgi_app: Callable, reader_threads: int = 7, writer_threads: int = 1) -> None:
+        self.wsgi_app = wsgi_app
+        self.readers = ThreadPoolExecutor(reader_threads, thread_name_prefix='db-reader')
+        self.writer = ThreadPoolExecutor(writer_threads, thread_name_prefix='db-writer')
+        self.streams = ThreadPoolExecutor(1, thread_name_prefix='db-stream')
+        # One per thread, the stream thread and the reservation sweeper
+        # included, and a second for a reader streaming an export's rows
+        self.connections_needed = 2 * reader_threads + writer_threads + 2
+
+    def executor_for(self, scope: dict) -> ThreadPoolExecutor:
+        if scope['path'] in STREAM_PATHS:
+            return self.streams
+        if scope['method'] in READ_METHODS or scope['path'] in READ_PATHS:
+            return self.readers
+        return self.writer
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            loop = asyncio.get_running_loop()
+            if scope['path'] in STREAM_PATHS:
+                body = io.BufferedReader(_RequestBody(receive, loop))
+            else:
+                body = io.BytesIO(await _read_body(receive))
+            await loop.run_in_executor(self.executor_for(scope), self.run_wsgi, scope, body, send, loop)
+
+    async def lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.readers.shutdown(wait=True)
+                self.writer.shutdown(wait=True)
+                self.streams.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run_wsgi(self, scope: dict, body: io.BufferedIOBase, send: Callable,
+                 loop: asyncio.AbstractEventLoop) -> None:
+        # Runs on a reader or writer thread; talks back to the loop for I/O
+        def call(message: dict) -> Any:
+            return asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = {}
+
+        def start_response(status: str, headers: list, exc_info=None) -> Callable:
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+            return lambda data: None
+
+        result = self.wsgi_app(_environ(scope, body), start_response)
+        try:
+            call({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            for chunk in result:
+                if chunk:
+                    call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            call({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+app = ASGIApp(flask_app, reader_threads=int(os.getenv('ASGI_READER_THREADS', 7)),
+              writer_threads=int(os.getenv('ASGI_WRITER_THREADS', 1)))
+for pool in [db.catalog.pool, *(shard.pool for shard in db.shards)]:
+    pool.grow(app.connections_needed)
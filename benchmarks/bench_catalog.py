@@ -0,0 +1,85 @@
+"""Microbenchmark: catalog listings from SQLite vs the columnar snapshot.
+
+Run with ``python benchmarks/bench_catalog.py --products 100000`` (needs
+numpy). Seeds a throwaway database, then times each listing query both ways,
+plus a full snapshot build and an incremental refresh after a few writes.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERIES = {
+    'first page by id': {},
+    'price band': {'min_price': 100.0, 'max_price': 200.0},
+    'in stock by price': {'in_stock': True, 'sort': 'price'},
+    'top by price, in band': {'min_price': 10.0, 'max_price': 900.0, 'sort': '-price'},
+    'name prefix': {'name_prefix': 'Blue'},
+}
+
+def timed(fn, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-catalog-')
+    os.environ['DATABASE_URL'] = os.path.join(tmpdir, 'bench.db')
+    from models import bootstrap, db, transaction
+    from catalog import Catalog
+    from etags import bump_versions, get_versions
+    from routes.products import PRODUCT_FIELDS, _query_listing
+
+    bootstrap()
+    rng = random.Random(22)
+    words = ['Blue', 'Red', 'Green', 'Smart', 'Classic', 'Pro', 'Mini']
+    with transaction():
+        db.conn.executemany(
+            'INSERT INTO products (name, description, price, stock) VALUES (?, ?, ?, ?)',
+            ((f'{rng.choice(words)} product {i}', 'For benchmarks', round(rng.uniform(1, 1000), 2),
+              rng.choice([0, 0, 5, 50])) for i in range(args.products)))
+    version, = get_versions('products')
+
+    catalog = Catalog(os.path.join(tmpdir, 'catalog'))
+    os.makedirs(catalog.directory)
+    start = time.perf_counter()
+    catalog.current(version)
+    print(f'full build of {args.products} products: {(time.perf_counter() - start) * 1e3:.1f} ms')
+
+    for name, overrides in QUERIES.items():
+        params = {'limit': 50, 'after': 0, 'after_price': None, 'min_price': None, 'max_price': None,
+                  'sort': 'id', 'in_stock': False, 'name_prefix': None, **overrides}
+        # The snapshot alone answers these columns; the default ones need SQLite for the page
+        for fields in (['id', 'name', 'price', 'stock'], list(PRODUCT_FIELDS)):
+            params['fields'] = fields if params['sort'] == 'id' else ['id', 'price'] + [
+                f for f in fields if f not in ('id', 'price')]
+            sql = timed(lambda: _query_listing(params), args.number)
+            snapshot = timed(lambda: catalog.list_products(params, version), args.number)
+            print(f'{name:<24} {len(fields)} fields  sqlite {sql * 1e6:9.1f} us  '
+                  f'snapshot {snapshot * 1e6:9.1f} us  x{sql / snapshot:5.1f}')
+
+    with transaction():
+        db.execute('UPDATE products SET price = price + 1 WHERE id IN (SELECT id FROM products LIMIT 100)')
+        bump_versions('products')
+    version, = get_versions('products')
+    start = time.perf_counter()
+    catalog.current(version)
+    print(f'refresh after 100 updates: {(time.perf_counter() - start) * 1e3:.1f} ms '
+          f'(builds {catalog.builds}, refreshes {catalog.refreshes})')
+
+    start = time.perf_counter()
+    Catalog(catalog.directory).current(version)
+    print(f'another worker mapping it: {(time.perf_counter() - start) * 1e3:.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Microbenchmark: CPU per response for JSON serialization and compression.
+
+Run with ``python benchmarks/bench_responses.py``. Serializes a full page of
+the product listing and a large cart with Flask's stdlib provider and with
+``FastJSONProvider``, then compresses the listing with each available
+encoding. CPU time is process time, so it excludes waiting; MB/s is body
+bytes in per CPU second.
+"""
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from responses import COMPRESS_LEVEL, FastJSONProvider, brotli, orjson
+
+def cpu_per_call(fn, number: int) -> float:
+    best = float('inf')
+    for _ in range(5):
+        start = time.process_time()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.process_time() - start) / number)
+    return best
+
+def report(name: str, fn, size: int, number: int) -> None:
+    seconds = cpu_per_call(fn, number)
+    print(f'{name:<36} {seconds * 1e6:9.1f} us/response {size / seconds / 1e6:9.1f} MB/s')
+
+def main() -> None:
+    listing = [{'id': i, 'name': f'Product {i}', 'description': f'Description of product number {i}.',
+                'price': round(i * 1.37, 2), 'stock': i % 50, 'updated_at': '2024-05-01 12:00:00'}
+               for i in range(1, 501)]
+    cart = {'items': [{'id': i, 'product_id': i, 'quantity': 2, 'product_name': f'Product {i}',
+                       'price': 9.99} for i in range(100)], 'item_count': 200, 'total_price': 1998.0}
+
+    stdlib, fast = Flask('stdlib'), Flask('fast')
+    stdlib.json, fast.json = DefaultJSONProvider(stdlib), FastJSONProvider(fast)
+    print(f'orjson: {"yes" if orjson else "no"}, brotli: {"yes" if brotli else "no"}')
+    for name, payload in (('listing (500 rows)', listing), ('cart (100 lines)', cart)):
+        for label, app in (('stdlib', stdlib), ('fast', fast)):
+            with app.app_context():
+                size = len(app.json.response(payload).get_data())
+                report(f'{name} {label}', lambda: app.json.response(payload).get_data(), size, 200)
+
+    with fast.app_context():
+        body = fast.json.response(listing).get_data()
+    encoders = {f'gzip {level}': (lambda level=level: gzip.compress(body, compresslevel=level, mtime=0))
+                for level in sorted({1, 4, COMPRESS_LEVEL, 6, 9})}
+    if brotli is not None:
+        encoders.update({f'br {quality}': (lambda quality=quality: brotli.compress(body, quality=quality))
+                         for quality in (4, 5, 11)})
+    print(f'\nlisting body: {len(body)} bytes')
+    for name, encode in encoders.items():
+        report(f'{name} -> {len(encode())} bytes', encode, len(body), 50)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark: concurrent cart writes and checkouts, unsharded vs sharded.
+
+Run with ``python benchmarks/bench_sharding.py --shards 4``. Seeds a
+throwaway catalog, then has one process per user add to their cart and check
+out in a loop through the test client, first with every user in the single
+database, then with the users resharded onto ``--shards`` files.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def shop(client, user_id: int, headers: dict, product_ids: list[int], seconds: float, counts) -> None:
+    carts = orders = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for product_id in product_ids:
+            client.post('/v1/cart', headers=headers, json={'user_id': user_id, 'product_id': product_id, 'quantity': 1})
+            carts += 1
+        if client.post(f'/v1/order/{user_id}', headers=headers).status_code == 201:
+            orders += 1
+    with counts.get_lock():
+        counts[0] += carts
+        counts[1] += orders
+
+def run(client, users: list[tuple[int, dict]], product_ids: list[int], seconds: float) -> tuple[int, int]:
+    # One process per user, as with that many single-threaded workers, so the
+    # GIL is out of the picture and only SQLite's write locks are shared
+    context = multiprocessing.get_context('fork')
+    counts = context.Array('l', 2)
+    processes = [context.Process(target=shop, args=(client, *user, product_ids, seconds, counts)) for user in users]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return counts[0], counts[1]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-sharding-')
+    os.environ.update(DATABASE_URL=os.path.join(tmpdir, 'catalog.db'), SHARD_URLS='', AUTO_BOOTSTRAP='false')
+    from app import app
+    from models import User, bootstrap, configure_database, create_user, db, transaction
+    from sharding import reshard
+    from tokens import token_signer
+
+    bootstrap()
+    app.config.update(TESTING=True, RESERVATION_SWEEP_INTERVAL=0)
+    with transaction():
+        product_ids = [db.execute('INSERT INTO products (name, description, price, stock) VALUES (?, ?, ?, ?)',
+                                  (f'Bench {i}', 'For benchmarks', 5.0, 10 ** 9)).lastrowid for i in range(3)]
+    users = []
+    for i in range(args.users):
+        user = create_user(User(username=f'bench{i}', password='-', email=f'bench{i}@example.com'))
+        users.append((user.id, {'Authorization': f'Bearer {token_signer.issue(user.id, user.username, "user")}'}))
+    db.release()
+
+    client = app.test_client(use_cookies=False)
+    for label, shards in (('single database', []),
+                          (f'{args.shards} shards', [os.path.join(tmpdir, f'shard{i}.db') for i in range(args.shards)])):
+        if shards:
+            reshard(shards)
+            configure_database(os.environ['DATABASE_URL'], shards)
+            bootstrap()
+            db.release()
+        carts, orders = run(client, users, product_ids, args.seconds)
+        print(f'{label:<16} {args.users} processes: {carts / args.seconds:8.1f} cart writes/s '
+              f'{orders / args.seconds:8.1f} checkouts/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Startup benchmark: process import time and a forked worker's first request.
+
+Run with ``python benchmarks/bench_startup.py``. The fork part mimics a
+preforking server such as ``gunicorn --preload``: the app is imported once,
+then each worker is forked from that process and serves its first request,
+which is when it opens its database connections.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def open_sqlite_files() -> list[str]:
+    # Linux only; elsewhere the check is skipped
+    fd_dir = '/proc/self/fd'
+    if not os.path.isdir(fd_dir):
+        return []
+    paths = []
+    for fd in os.listdir(fd_dir):
+        try:
+            path = os.readlink(os.path.join(fd_dir, fd))
+        except OSError:
+            continue
+        if path.endswith(('.db', '.db-wal', '.db-shm')):
+            paths.append(path)
+    return paths
+
+def import_times(runs: int) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def fork_times(runs: int) -> list[float]:
+    from app import app
+    # Bootstrapping is a deploy step, not part of a worker's start
+    app.config['AUTO_BOOTSTRAP'] = False
+    print(f'SQLite files open before forking: {len(open_sqlite_files())}')
+    times = []
+    for _ in range(runs):
+        read_fd, write_fd = os.pipe()
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = app.test_client().get('/v1/products/1').status_code
+            os.write(write_fd, str(status).encode())
+            os._exit(0)
+        os.close(write_fd)
+        status = os.read(read_fd, 16).decode()
+        os.waitpid(pid, 0)
+        times.append(time.perf_counter() - start)
+        os.close(read_fd)
+        assert status == '200', status
+    return times
+
+def report(name: str, times: list[float]) -> None:
+    print(f'{name:<32} median {statistics.median(times) * 1000:8.1f} ms   max {max(times) * 1000:8.1f} ms')
+
+def main() -> None:
+    report('interpreter start + import app', import_times(5))
+    report('fork + first request', fork_times(20))
+
+if __name__ == '__main__':
+    main()
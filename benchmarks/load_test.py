@@ -0,0 +1,260 @@
+"""Load test: seed a synthetic dataset and drive a mix of /v1 endpoints.
+
+Run with ``python benchmarks/load_test.py``. By default the app is served
+in-process on a free port, against its own database file, which is seeded
+first (``--reseed`` starts it over). Pass ``--url`` to load a server that is
+already running on a database seeded the same way. Each run prints req/s,
+latency percentiles and DB time per endpoint and saves them as JSON under
+``benchmarks/results``; ``--compare`` prints the change against an earlier run.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / 'benchmarks' / 'results'
+sys.path.insert(0, str(ROOT))
+
+# (name, weight, method, URL rule, build(state) -> (path, body))
+MIX = [
+    ('list products', 30, 'GET', '/v1/products',
+     lambda s: (f"/v1/products?limit=20&in_stock=true&min_price={s.rng.randint(1, 500)}", None)),
+    ('product detail', 25, 'GET', '/v1/products/<int:product_id>',
+     lambda s: (f'/v1/products/{s.product_id()}', None)),
+    ('search', 10, 'GET', '/v1/products/search',
+     lambda s: (f"/v1/products/search?q={s.rng.choice(s.words)}&limit=20", None)),
+    ('get cart', 15, 'GET', '/v1/cart/<int:user_id>',
+     lambda s: (f'/v1/cart/{s.user_id}', None)),
+    ('update cart', 10, 'POST', '/v1/cart/batch',
+     lambda s: ('/v1/cart/batch', {'user_id': s.user_id, 'items': [
+         {'product_id': s.product_id(), 'quantity': 1, 'op': 'add'} for _ in range(3)]})),
+    ('place order', 3, 'POST', '/v1/order/<int:user_id>',
+     lambda s: (f'/v1/order/{s.user_id}', None)),
+    ('order history', 7, 'GET', '/v1/orders/<int:user_id>',
+     lambda s: (f'/v1/orders/{s.user_id}?limit=10', None)),
+]
+
+# Outcomes the mix produces by design, e.g. checking out an empty cart
+EXPECTED_ERRORS = {'place order': {400}}
+
+WORDS = ['red', 'blue', 'steel', 'wooden', 'classic', 'smart', 'compact', 'deluxe', 'eco', 'travel']
+NOUNS = ['lamp', 'chair', 'kettle', 'backpack', 'watch', 'speaker', 'mug', 'desk', 'jacket', 'bottle']
+
+def seed(users: int, products: int, carts: int, orders: int, rng: random.Random) -> None:
+    """Fill the database DATABASE_URL points to, in a few large transactions."""
+    from models import db, transaction
+    from hashing import password_hasher
+
+    password = password_hasher.hash('benchpass')
+    with transaction():
+        db.conn.executemany(
+            "INSERT OR IGNORE INTO users (username, password, email, role) VALUES (?, ?, ?, 'user')",
+            ((f'bench{i}', password, f'bench{i}@example.com') for i in range(users)))
+        db.conn.executemany(
+            'INSERT INTO products (name, description, price, stock) VALUES (?, ?, ?, ?)',
+            ((f'{rng.choice(WORDS)} {rng.choice(NOUNS)} {i}', f'{rng.choice(WORDS)} {rng.choice(NOUNS)} for benchmarks',
+              round(rng.uniform(1, 1000), 2), 1_000_000) for i in range(products)))
+    user_ids = [row['id'] for row in db.q("SELECT id FROM users WHERE username LIKE 'bench%'")]
+    product_rows = db.q('SELECT id, name, price FROM products')
+    with transaction():
+        db.conn.executemany(
+            'INSERT OR IGNORE INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?)',
+            ((rng.choice(user_ids), rng.choice(product_rows)['id'], rng.randint(1, 3)) for _ in range(carts)))
+        for _ in range(orders):
+            items = rng.sample(product_rows, 3)
+            order_id = db.execute(
+                "INSERT INTO orders (user_id, order_date, status, total_price) VALUES (?, ?, 'Pending', ?)",
+                (rng.choice(user_ids), datetime.now(timezone.utc).isoformat(),
+                 sum(item['price'] for item in items))).lastrowid
+            db.conn.executemany(
+                'INSERT INTO order_items (order_id, product_id, product_name, quantity, price) VALUES (?, ?, ?, 1, ?)',
+                ((order_id, item['id'], item['name'], item['price']) for item in items))
+
+def serve_in_process() -> str:
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+    # One access log line per request would dominate the run
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    # Measure the app, not the per-user rate limits
+    app.config['RATELIMIT_ENABLED'] = False
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+class Worker:
+    """One simulated client: a user with a bearer token and a keep-alive connection."""
+
+    def __init__(self, url: str, user_id: int, token: str, product_ids: list[int], seed: int) -> None:
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        self.user_id = user_id
+        self.headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+        self.product_ids = product_ids
+        self.words = WORDS + NOUNS
+        self.rng = random.Random(seed)
+        self.samples = {name: [] for name, *_ in MIX}
+        self.errors = {name: 0 for name, *_ in MIX}
+
+    def product_id(self) -> int:
+        return self.rng.choice(self.product_ids)
+
+    def request(self, method: str, path: str, body: dict | None = None) -> int:
+        self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=self.headers)
+        response = self.conn.getresponse()
+        response.read()
+        return response.status
+
+    def run(self, deadline: float) -> None:
+        names = [name for name, *_ in MIX]
+        weights = [weight for _, weight, *_ in MIX]
+        actions = {name: (method, build) for name, _, method, _, build in MIX}
+        while time.monotonic() < deadline:
+            name = self.rng.choices(names, weights)[0]
+            method, build = actions[name]
+            path, body = build(self)
+            start = time.perf_counter()
+            try:
+                status = self.request(method, path, body)
+            except (OSError, http.client.HTTPException):
+                self.conn.close()
+                status = 599
+            elapsed = time.perf_counter() - start
+            self.samples[name].append(elapsed)
+            if status >= 400 and status not in EXPECTED_ERRORS.get(name, ()):
+                self.errors[name] += 1
+
+def scrape_db_time(url: str) -> dict[str, tuple[float, float]]:
+    """Cumulative (SQL seconds, requests) per URL rule from /metrics."""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    conn.request('GET', '/metrics')
+    text = conn.getresponse().read().decode()
+    totals = {}
+    for kind, rule, value in re.findall(r'^db_query_seconds_per_request_(sum|count)\{endpoint="([^"]*)"\} (\S+)$',
+                                        text, re.M):
+        seconds, count = totals.get(rule, (0.0, 0.0))
+        totals[rule] = (seconds + float(value), count) if kind == 'sum' else (seconds, count + float(value))
+    return totals
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+def summarize(workers: list[Worker], duration: float, db_before: dict, db_after: dict) -> dict:
+    endpoints = {}
+    for name, _, method, rule, _ in MIX:
+        samples = sorted(sample for worker in workers for sample in worker.samples[name])
+        seconds, count = (db_after.get(rule, (0, 0))[i] - db_before.get(rule, (0, 0))[i] for i in (0, 1))
+        endpoints[name] = {
+            'method': method,
+            'rule': rule,
+            'requests': len(samples),
+            'errors': sum(worker.errors[name] for worker in workers),
+            'rps': round(len(samples) / duration, 1),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+            # Per request, as measured by the server; 0 when it is not exposed
+            'db_ms': round(seconds / count * 1000, 3) if count else 0.0,
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {'total_rps': round(total / duration, 1), 'endpoints': endpoints}
+
+def print_report(result: dict, baseline: dict | None = None) -> None:
+    print(f"{'endpoint':<16}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db ms':>8}{'errors':>8}")
+    for name, stats in result['endpoints'].items():
+        line = (f"{name:<16}{stats['rps']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+                f"{stats['p99_ms']:>9}{stats['db_ms']:>8}{stats['errors']:>8}")
+        old = (baseline or {}).get('endpoints', {}).get(name)
+        if old and old['p95_ms']:
+            line += f"   p95 {(stats['p95_ms'] - old['p95_ms']) / old['p95_ms']:+.0%}"
+        print(line)
+    print(f"total {result['total_rps']} req/s")
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='Load an already running server instead of an in-process one')
+    parser.add_argument('--database', default='data/bench.db', help='SQLite file to seed and serve')
+    parser.add_argument('--reseed', action='store_true', help='Delete and seed the database again')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--carts', type=int, default=5000, help='Cart rows to seed')
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run the mix for')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    # Must be set before models is imported, which opens the database
+    os.environ['DATABASE_URL'] = args.database
+    if args.reseed:
+        for suffix in ('', '-wal', '-shm'):
+            Path(args.database + suffix).unlink(missing_ok=True)
+    rng = random.Random(args.seed)
+    from models import bootstrap, db
+    bootstrap()
+    if not db.q("SELECT 1 FROM users WHERE username = 'bench0'"):
+        started = time.perf_counter()
+        seed(args.users, args.products, args.carts, args.orders, rng)
+        print(f'seeded {args.database} in {time.perf_counter() - started:.1f}s')
+
+    from tokens import token_signer
+    users = db.q("SELECT id, username FROM users WHERE username LIKE 'bench%'")
+    product_ids = [row['id'] for row in db.q('SELECT id FROM products')]
+    db.release()
+
+    url = args.url or serve_in_process()
+    workers = []
+    for i in range(args.concurrency):
+        user = rng.choice(users)
+        token = token_signer.issue(user['id'], user['username'], 'user')
+        workers.append(Worker(url, user['id'], token, product_ids, args.seed + i))
+
+    db_before = scrape_db_time(url)
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker.run, args=(started + args.duration,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - started
+    result = summarize(workers, duration, db_before, scrape_db_time(url))
+
+    result = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        **result,
+    }
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(result, baseline)
+
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{result['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f'saved {output}')
+
+if __name__ == '__main__':
+    main()
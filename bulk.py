@@ -0,0 +1,140 @@
+import csv
+import json
+import math
+from itertools import groupby, islice
+from typing import IO, Iterable, Iterator
+from migrations import UTC_NOW
+from models import db, transaction
+from etags import bump_versions
+from sharding import sync_product_carts
+
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+# SQLite integers are signed 64-bit; larger ones make executemany raise OverflowError
+SQLITE_MIN_INT, SQLITE_MAX_INT = -2 ** 63, 2 ** 63 - 1
+
+# Setting updated_at here spares the touch triggers a second write per row
+UPSERT_PRODUCT = f'''
+    INSERT INTO products (id, name, description, price, stock, updated_at)
+    VALUES (:id, :name, :description, :price, :stock, {UTC_NOW})
+    ON CONFLICT (id) DO UPDATE SET
+        name = excluded.name,
+        description = excluded.description,
+        price = excluded.price,
+        stock = excluded.stock,
+        updated_at = excluded.updated_at
+'''
+
+def _decode_lines(stream: IO[bytes]) -> Iterator[str]:
+    # Line by line, so one line of invalid UTF-8 cannot abort the whole
+    # import; its bytes survive as surrogates for _invalid_text to find
+    for line in stream:
+        yield line.decode('utf-8', 'surrogateescape')
+
+def _invalid_text(values: Iterable) -> bool:
+    return any(isinstance(value, str) and not value.isascii() and
+               any('\udc80' <= char <= '\udcff' for char in value) for value in values)
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[tuple[int, dict | str]]:
+    """Yield ``(row number, record)`` pairs from an NDJSON or CSV byte stream.
+
+    Lines that cannot be decoded are yielded as an error message instead of a
+    record, so one bad line does not abort the whole import.
+    """
+    lines = _decode_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        row = 0
+        while True:
+            row += 1
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield row, f'Invalid CSV: {e}'
+                continue
+            if _invalid_text(record.values()) or _invalid_text(reader.fieldnames):
+                yield row, 'Invalid UTF-8'
+            else:
+                yield row, record
+        return
+    for row, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        if _invalid_text([line]):
+            yield row, 'Invalid UTF-8'
+            continue
+        try:
+            yield row, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row, f'Invalid JSON: {e.msg}'
+
+def validate_product(record: dict) -> dict:
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+    name = record.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('name is required')
+    try:
+        product_id = int(record['id']) if record.get('id') not in (None, '') else None
+        price = float(record['price'])
+        stock = int(record['stock'])
+    except KeyError as e:
+        raise ValueError(f'{e.args[0]} is required')
+    except (TypeError, ValueError):
+        raise ValueError('id, price and stock must be numeric')
+    if any(value is not None and not SQLITE_MIN_INT <= value <= SQLITE_MAX_INT for value in (product_id, stock)):
+        raise ValueError('id and stock must fit in a 64-bit integer')
+    if not math.isfinite(price):
+        raise ValueError('price must be finite')
+    if price < 0 or stock < 0:
+        raise ValueError('price and stock must not be negative')
+    if product_id is not None and product_id <= 0:
+        raise ValueError('id must be positive')
+    return {'id': product_id, 'name': name, 'description': record.get('description') or '',
+            'price': price, 'stock': stock}
+
+def _upsert_batch(products: list[dict]) -> None:
+    known_ids, new_ids = [], []
+    with transaction():
+        # Runs of rows with an id share one executemany; rows without one are
+        # inserted one by one for the id SQLite assigns, whose version must be
+        # bumped too, or a cached 404 for that id would outlive the import
+        for has_id, group in groupby(products, key=lambda product: product['id'] is not None):
+            group = list(group)
+            if has_id:
+                db.executemany(UPSERT_PRODUCT, group)
+                known_ids.extend(product['id'] for product in group)
+            else:
+                new_ids.extend(db.execute(UPSERT_PRODUCT, product).lastrowid for product in group)
+        bump_versions('products', *(f'product:{product_id}' for product_id in known_ids + new_ids))
+    sync_product_carts(known_ids)
+
+def upsert_products(records: Iterable[tuple[int, dict | str]],
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """Validate and upsert products in batches of ``batch_size`` rows.
+
+    Each batch is one transaction, with an ``executemany`` per run of rows
+    that have an ``id``, so memory is bounded by the batch size whatever the
+    size of the input. Rows with an ``id`` replace the existing product; rows
+    without one are inserted.
+    """
+    report = {'processed': 0, 'upserted': 0, 'failed': 0, 'errors': []}
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        products = []
+        for row, record in batch:
+            try:
+                if isinstance(record, str):
+                    raise ValueError(record)
+                products.append(validate_product(record))
+            except ValueError as e:
+                report['failed'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'row': row, 'error': str(e)})
+        if products:
+            _upsert_batch(products)
+        report['processed'] += len(batch)
+        report['upserted'] += len(products)
+    return report
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Protocol
+
+MISSING = object()
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Any: ...
+    def set(self, key: str, value: Any) -> None: ...
+    def delete(self, *keys: str) -> None: ...
+    def stats(self) -> dict[str, int]: ...
+
+class LRUCache:
+    """In-process cache with least-recently-used eviction and a per-entry TTL.
+
+    ``get`` returns ``MISSING`` (not ``None``) on a miss, so ``None`` and empty
+    results can be cached too.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+class RedisCache:
+    """Backend for any Redis-compatible client shared by several workers.
+
+    Values are stored as JSON with a TTL; eviction is left to the server's
+    ``maxmemory-policy``, so only hits and misses are counted here.
+    """
+
+    def __init__(self, client: Any, ttl: float = 60.0, prefix: str = 'ecommerce:') -> None:
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = self.misses = 0
+
+    def get(self, key: str) -> Any:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any) -> None:
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': 0}
+
+class ProductCache:
+    """Read-through cache for product rows and product listing pages.
+
+    Entries are keyed by the version the handler read for its ETag (the
+    ``products`` counter for listings, ``product:<id>`` for a row). The
+    counters live in the database and every write bumps them, so a write
+    made by any worker moves every worker on to new keys; entries of older
+    versions are never read again and age out of the backend.
+    """
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+
+    def _read_through(self, key: str, loader: Callable[[], Any]) -> Any:
+        value = self.backend.get(key)
+        if value is MISSING:
+            value = loader()
+            self.backend.set(key, value)
+        return value
+
+    def get_product(self, product_id: int, version: int, loader: Callable[[], Any]) -> Any:
+        return self._read_through(f'product:{product_id}:{version}', loader)
+
+    def get_listing(self, params: dict, version: int, loader: Callable[[], Any]) -> Any:
+        key = 'products:{}:{}'.format(version, json.dumps(params, sort_keys=True))
+        return self._read_through(key, loader)
+
+    def stats(self) -> dict[str, int]:
+        return self.backend.stats()
+
+product_cache = ProductCache(LRUCache(
+    maxsize=int(os.getenv('PRODUCT_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('PRODUCT_CACHE_TTL', 60)),
+))
@@ -0,0 +1,409 @@
+"""Columnar snapshot of the catalog for product listings without SQL.
+
+A ``CatalogSnapshot`` holds id, price and stock of every product as NumPy
+arrays sorted by id, plus names interned in one byte blob. A listing walks
+the rows in id or price order from its cursor, filtering with vectorized masks
+a chunk at a time until the page is full; a name prefix instead selects a
+range of rows sorted by name, whose top rows by price come from
+``argpartition``. Only the rows of the page are then read from SQLite, by
+primary key, for the columns the snapshot does not hold.
+
+Snapshots are immutable and tagged with the ``products`` version that every
+product write bumps. The first listing after a write replaces the snapshot
+with one updated from the rows whose ``updated_at`` moved on, so only the
+changed rows are read. With ``CATALOG_SNAPSHOT_DIR`` set each version is also
+written to disk once, and the other workers memory-map it instead of building
+their own copy.
+
+NumPy is optional: without it, or with ``CATALOG_ENGINE`` other than
+``snapshot``, listings are queried from SQLite.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from bisect import bisect_left
+from typing import Iterable
+
+from models import db
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FIELDS = ('id', 'name', 'price', 'stock')
+ARRAYS = ('ids', 'prices', 'stocks', 'name_starts', 'name_ends', 'name_order', 'names',
+          'price_order', 'price_desc_order', 'sorted_prices')
+SNAPSHOTS_KEPT = 2
+# Rows examined by the first step of a scan; every further step doubles it
+SCAN_CHUNK = 1024
+
+def prefix_upper_bound(prefix: str) -> str | None:
+    """The least string above every string starting with ``prefix``.
+
+    None when there is none, i.e. the prefix is all U+10FFFF. The surrogate
+    block is skipped: lone surrogates cannot be encoded, so U+D7FF goes to
+    U+E000.
+    """
+    stripped = prefix.rstrip('\U0010ffff')
+    if not stripped:
+        return None
+    last = ord(stripped[-1]) + 1
+    return stripped[:-1] + chr(0xe000 if 0xd800 <= last <= 0xdfff else last)
+
+class CatalogSnapshot:
+    """Immutable columns of the products table at one ``version``.
+
+    Row ``i`` is the product ``ids[i]``; its name is
+    ``names[name_starts[i]:name_ends[i]]`` (UTF-8). ``name_order`` lists the
+    rows sorted by name, for prefix searches, and ``price_order`` and
+    ``price_desc_order`` by price and then id, for the price sorts;
+    ``sorted_prices`` are the prices in ``price_order``.
+    """
+
+    def __init__(self, version: int, updated_at: str, ids, prices, stocks, name_starts, name_ends,
+                 name_order, names, price_order=None, price_desc_order=None, sorted_prices=None) -> None:
+        self.version = version
+        # The newest updated_at included, where the next refresh starts
+        self.updated_at = updated_at
+        self.ids = ids
+        self.prices = prices
+        self.stocks = stocks
+        self.name_starts = name_starts
+        self.name_ends = name_ends
+        self.name_order = name_order
+        self.names = names
+        if price_order is None:
+            # Rows are in id order, so a stable sort breaks price ties by id
+            price_order = np.argsort(prices, kind='stable')
+            price_desc_order = np.argsort(-prices, kind='stable')
+            sorted_prices = prices[price_order]
+        self.price_order = price_order
+        self.price_desc_order = price_desc_order
+        self.sorted_prices = sorted_prices
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def name(self, row: int) -> bytes:
+        return self.names[self.name_starts[row]:self.name_ends[row]].tobytes()
+
+    @classmethod
+    def build(cls, version: int, rows: Iterable[tuple]) -> 'CatalogSnapshot':
+        """From ``(id, name, price, stock, updated_at)`` rows sorted by id."""
+        ids, prices, stocks, names, updated_at = [], [], [], [], ''
+        for product_id, name, price, stock, updated in rows:
+            ids.append(product_id)
+            prices.append(price)
+            stocks.append(stock)
+            names.append((name or '').encode())
+            updated_at = max(updated_at, updated or '')
+        lengths = np.fromiter(map(len, names), dtype=np.int64, count=len(names))
+        name_ends = np.cumsum(lengths)
+        return cls(version, updated_at,
+                   np.array(ids, dtype=np.int64),
+                   np.array(prices, dtype=np.float64),
+                   np.array(stocks, dtype=np.int64),
+                   name_ends - lengths, name_ends,
+                   np.array(sorted(range(len(names)), key=names.__getitem__), dtype=np.int64),
+                   np.frombuffer(b''.join(names), dtype=np.uint8))
+
+    def updated(self, version: int, rows: list[tuple], count: int) -> 'CatalogSnapshot | None':
+        """A new snapshot with ``rows`` inserted or replaced.
+
+        Returns None when the result would not hold ``count`` products, i.e.
+        some were deleted, which only a full rebuild can tell.
+        """
+        if not rows:
+            return self._replace(version=version) if len(self) == count else None
+        delta = CatalogSnapshot.build(version, rows)
+        found = np.searchsorted(self.ids, delta.ids)
+        exists = found < len(self)
+        exists[exists] = self.ids[found[exists]] == delta.ids[exists]
+        keep = np.ones(len(self), dtype=bool)
+        keep[found[exists]] = False
+        kept = int(keep.sum())
+        if kept + len(delta) != count:
+            return None
+
+        # Both are sorted by id, so the new rows are merged in: position maps
+        # a kept row, then a new one, to its row in the new snapshot
+        at = np.searchsorted(self.ids[keep], delta.ids)
+        position = np.concatenate((np.arange(kept) + np.searchsorted(at, np.arange(kept), 'right'),
+                                   at + np.arange(len(delta))))
+
+        def merged(old, new):
+            column = np.empty(kept + len(delta), dtype=old.dtype)
+            column[position] = np.concatenate((old[keep], new))
+            return column
+
+        # New names are appended to the blob; the old bytes of replaced names
+        # stay until the blob is compacted
+        names = np.concatenate((self.names, delta.names))
+        name_starts = merged(self.name_starts, delta.name_starts + len(self.names))
+        name_ends = merged(self.name_ends, delta.name_ends + len(self.names))
+        prices = merged(self.prices, delta.prices)
+
+        # The kept rows stay in name and price order; each new row is inserted
+        # where it belongs
+        kept_rank = np.cumsum(keep) - 1
+
+        def kept_in(order):
+            return position[kept_rank[order[keep[order]]]]
+
+        price_order = _insert_sorted(kept_in(self.price_order), prices,
+                                     position[kept + delta.price_order])
+        price_desc_order = _insert_sorted(kept_in(self.price_desc_order), -prices,
+                                          position[kept + delta.price_desc_order])
+        snapshot = CatalogSnapshot(version, max(self.updated_at, delta.updated_at),
+                                   merged(self.ids, delta.ids), prices, merged(self.stocks, delta.stocks),
+                                   name_starts, name_ends, kept_in(self.name_order), names,
+                                   price_order, price_desc_order, prices[price_order])
+        new_rows = position[kept + delta.name_order]
+        at = [bisect_left(snapshot.name_order, snapshot.name(row), key=snapshot.name) for row in new_rows]
+        snapshot.name_order = np.insert(snapshot.name_order, at, new_rows)
+        if len(names) > 2 * int((name_ends - name_starts).sum()):
+            snapshot._compact()
+        return snapshot
+
+    def _replace(self, **changes) -> 'CatalogSnapshot':
+        return CatalogSnapshot(**{**{name: getattr(self, name) for name in ARRAYS},
+                                  'version': self.version, 'updated_at': self.updated_at, **changes})
+
+    def _compact(self) -> None:
+        # Gather the live names into a new blob, in row order
+        lengths = self.name_ends - self.name_starts
+        starts = np.cumsum(lengths) - lengths
+        gather = np.arange(int(lengths.sum())) - np.repeat(starts - self.name_starts, lengths)
+        self.names = self.names[gather]
+        self.name_starts, self.name_ends = starts, starts + lengths
+
+    def _filter(self, rows: 'np.ndarray', params: dict, named: 'np.ndarray | None' = None) -> 'np.ndarray':
+        keep = np.ones(len(rows), dtype=bool) if named is None else named[rows]
+        if params['min_price'] is not None:
+            keep &= self.prices[rows] >= params['min_price']
+        if params['max_price'] is not None:
+            keep &= self.prices[rows] <= params['max_price']
+        if params['in_stock']:
+            keep &= self.stocks[rows] > 0
+        return rows[keep]
+
+    def select(self, params: dict) -> 'np.ndarray':
+        """Rows of one listing page plus one, in the order of ``params['sort']``.
+
+        Applies the same filters, keyset cursor and order as the SQL listing.
+        """
+        named = None
+        if params['name_prefix']:
+            rows = self._named(params['name_prefix'])
+            if len(rows) <= SCAN_CHUNK:
+                return self._select_rows(np.sort(rows), params)
+            # Too many to sort whole: scan as below, with a mask of the matches
+            named = np.zeros(len(self), dtype=bool)
+            named[rows] = True
+        # Like an index range scan: walk the rows in the order of the sort from
+        # the cursor on, filtering a chunk at a time, until the page is full
+        sort, after, k = params['sort'], params['after'], params['limit'] + 1
+        if sort == 'id':
+            order, start, stop = None, int(np.searchsorted(self.ids, after, 'right')), len(self)
+        else:
+            order, start, stop = self._price_range(params)
+        pages, found, chunk = [], 0, max(SCAN_CHUNK, 2 * k)
+        while start < stop and found < k:
+            rows = np.arange(start, min(start + chunk, stop)) if order is None else order[start:start + chunk]
+            rows = self._filter(rows, params, named)
+            pages.append(rows)
+            found += len(rows)
+            start += chunk
+            # Selective filters match little per chunk, so take bigger steps
+            chunk *= 2
+        return np.concatenate(pages)[:k] if pages else np.empty(0, dtype=np.int64)
+
+    def _price_range(self, params: dict) -> tuple['np.ndarray', int, int]:
+        # Positions in price_order (or price_desc_order) of the price band,
+        # starting past the cursor
+        n, prices = len(self), self.sorted_prices
+        min_price, max_price = params['min_price'], params['max_price']
+        low = int(np.searchsorted(prices, min_price, 'left')) if min_price is not None else 0
+        high = int(np.searchsorted(prices, max_price, 'right')) if max_price is not None else n
+        if params['sort'] == 'price':
+            order, start, stop = self.price_order, low, high
+        else:
+            order, start, stop = self.price_desc_order, n - high, n - low
+        if params['after']:
+            price = params['after_price']
+            ties = int(np.searchsorted(prices, price, 'left')), int(np.searchsorted(prices, price, 'right'))
+            first_tie = ties[0] if params['sort'] == 'price' else n - ties[1]
+            # Equal prices are in id order, so the cursor's id splits them
+            tied_ids = self.ids[order[first_tie:first_tie + ties[1] - ties[0]]]
+            start = max(start, first_tie + int(np.searchsorted(tied_ids, params['after'], 'right')))
+        return order, start, stop
+
+    def _named(self, prefix: str) -> 'np.ndarray':
+        # The rows of a name prefix are a range of name_order
+        upper = prefix_upper_bound(prefix)
+        low = bisect_left(self.name_order, prefix.encode(), key=self.name)
+        high = (len(self.name_order) if upper is None
+                else bisect_left(self.name_order, upper.encode(), lo=low, key=self.name))
+        return self.name_order[low:high]
+
+    def _select_rows(self, rows: 'np.ndarray', params: dict) -> 'np.ndarray':
+        # Filters and sorts a small set of rows, given in id order, whole
+        rows = self._filter(rows, params)
+        sort, after, k = params['sort'], params['after'], params['limit'] + 1
+        if sort == 'id':
+            return rows[self.ids[rows] > after][:k]
+        prices = self.prices[rows]
+        if after:
+            price = params['after_price']
+            beyond = prices > price if sort == 'price' else prices < price
+            past = beyond | ((prices == price) & (self.ids[rows] > after))
+            rows, prices = rows[past], prices[past]
+        keys = prices if sort == 'price' else -prices
+        if len(rows) > k:
+            # Only the rows up to the k-th smallest key (and its ties) get sorted
+            kth = np.partition(keys, k - 1)[k - 1]
+            rows, keys = rows[keys <= kth], keys[keys <= kth]
+        # A stable sort keeps equal prices in id order
+        return rows[np.argsort(keys, kind='stable')[:k]]
+
+    def rows(self, selected: 'np.ndarray', fields: list[str]) -> list[dict]:
+        columns = {
+            'id': lambda: self.ids[selected].tolist(),
+            'name': lambda: [self.name(row).decode() for row in selected],
+            'price': lambda: self.prices[selected].tolist(),
+            'stock': lambda: self.stocks[selected].tolist(),
+        }
+        values = [columns[field]() for field in fields]
+        return [dict(zip(fields, row)) for row in zip(*values)]
+
+    def save(self, path: str) -> None:
+        # Written aside and renamed into place, so readers never see half a snapshot
+        directory = os.path.dirname(path) or '.'
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+        try:
+            for name in ARRAYS:
+                np.save(os.path.join(staging, name + '.npy'), getattr(self, name))
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({'version': self.version, 'updated_at': self.updated_at}, f)
+            os.rename(staging, path)
+        except OSError:
+            # Most likely another worker saved the same version first
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> 'CatalogSnapshot':
+        # Memory-mapped read-only: every worker shares the same page cache
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+        return cls(meta['version'], meta['updated_at'], **arrays)
+
+def _insert_sorted(order: 'np.ndarray', keys: 'np.ndarray', rows: 'np.ndarray') -> 'np.ndarray':
+    """Insert ``rows`` into ``order``, both sorted by ``keys[row]`` and then row."""
+    ordered_keys, new_keys = keys[order], keys[rows]
+    at = np.searchsorted(ordered_keys, new_keys, 'left')
+    ties = np.searchsorted(ordered_keys, new_keys, 'right')
+    for i in np.flatnonzero(ties > at):
+        at[i] += np.searchsorted(order[at[i]:ties[i]], rows[i])
+    return np.insert(order, at, rows)
+
+PRODUCT_COLUMNS = 'SELECT id, name, price, stock, updated_at FROM products'
+
+class Catalog:
+    """Keeps the latest snapshot of this worker and answers listings from it."""
+
+    def __init__(self, directory: str | None = None) -> None:
+        self.directory = directory
+        self.snapshot = None
+        self.builds = self.refreshes = self.loads = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'Catalog | None':
+        if os.getenv('CATALOG_ENGINE', 'sqlite') != 'snapshot':
+            return None
+        if np is None:
+            logger.warning('CATALOG_ENGINE=snapshot needs numpy; listings are served from SQLite')
+            return None
+        directory = os.getenv('CATALOG_SNAPSHOT_DIR') or None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(directory)
+
+    def _path(self, version: int) -> str:
+        return os.path.join(self.directory, f'catalog-{version:012d}')
+
+    def current(self, version: int) -> CatalogSnapshot:
+        """A snapshot at least as new as ``version``."""
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version >= version:
+            return snapshot
+        with self._lock:
+            if self.snapshot is not None and self.snapshot.version >= version:
+                return self.snapshot
+            if self.directory and os.path.isdir(self._path(version)):
+                try:
+                    self.snapshot = CatalogSnapshot.load(self._path(version))
+                    self.loads += 1
+                    return self.snapshot
+                except FileNotFoundError:
+                    # Pruned by a worker that has moved on to a newer version
+                    pass
+            self.snapshot = self._refresh(self.snapshot, version)
+            if self.directory:
+                self.snapshot.save(self._path(version))
+                self._prune()
+            return self.snapshot
+
+    def _refresh(self, snapshot: CatalogSnapshot | None, version: int) -> CatalogSnapshot:
+        # The version was read before these rows, so they are at least as new as it
+        if snapshot is not None:
+            # >= since rows written in the same millisecond may have been missed
+            changed = db.execute(f'{PRODUCT_COLUMNS} WHERE updated_at >= ? ORDER BY id',
+                                 (snapshot.updated_at,)).fetchall()
+            count = db.execute('SELECT count(*) FROM products').fetchone()[0]
+            updated = snapshot.updated(version, changed, count)
+            if updated is not None:
+                self.refreshes += 1
+                return updated
+        self.builds += 1
+        return CatalogSnapshot.build(version, db.execute(f'{PRODUCT_COLUMNS} ORDER BY id'))
+
+    def _prune(self) -> None:
+        # Workers that mapped an older snapshot keep reading it until they move on
+        snapshots = sorted(name for name in os.listdir(self.directory) if name.startswith('catalog-'))
+        for name in snapshots[:-SNAPSHOTS_KEPT]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def list_products(self, params: dict, version: int) -> list[dict]:
+        """The listing page of ``params`` (plus one row), as the SQL query returns it."""
+        snapshot = self.current(version)
+        selected = snapshot.select(params)
+        fields = params['fields']
+        if set(fields) <= set(SNAPSHOT_FIELDS):
+            return snapshot.rows(selected, fields)
+        # The other columns come from SQLite for just this page, by primary key
+        ids = snapshot.ids[selected].tolist()
+        if not ids:
+            return []
+        found = {row['id']: row for row in db.q(
+            f'SELECT {", ".join(fields)} FROM products WHERE id IN ({", ".join("?" * len(ids))})', ids)}
+        return [found[product_id] for product_id in ids if product_id in found]
+
+    def stats(self) -> dict[str, int]:
+        snapshot = self.snapshot
+        return {
+            'version': snapshot.version if snapshot is not None else 0,
+            'products': len(snapshot) if snapshot is not None else 0,
+            'builds': self.builds,
+            'refreshes': self.refreshes,
+            'loads': self.loads,
+        }
+
+catalog = Catalog.from_env()
@@ -0,0 +1,103 @@
+import json
+import signal
+import click
+import metrics
+from bulk import DEFAULT_BATCH_SIZE, iter_records, upsert_products
+from jobs import JOB_WORKER_CONCURRENCY, JobWorker, drain, requeue
+from migrations import MIGRATIONS, MigrationError, applied_versions, migrate
+from models import bootstrap, db, migrate_shards
+from reservations import release_expired
+from rollups import rebuild
+from sharding import RESHARD_BATCH_SIZE, reshard
+
+@click.command('bootstrap')
+def bootstrap_database() -> None:
+    """Migrate the schema and create the admin user and sample catalog if missing.
+
+    Run once per deploy, so that workers started with AUTO_BOOTSTRAP=false
+    do no schema work at all.
+    """
+    click.echo(json.dumps(bootstrap(db.current())))
+
+@click.command('import-products')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Rows upserted per transaction.')
+def import_products(file, fmt: str | None, batch_size: int) -> None:
+    """Stream an NDJSON or CSV file (or - for stdin) into the products table."""
+    if fmt is None:
+        fmt = 'csv' if file.name.endswith('.csv') else 'ndjson'
+    report = upsert_products(iter_records(file, fmt), batch_size)
+    for error in report.pop('errors'):
+        click.echo('row {row}: {error}'.format(**error), err=True)
+    click.echo(json.dumps(report))
+
+@click.command('migrate')
+@click.option('--target', type=int, help='Stop after this version.')
+@click.option('--status', is_flag=True, help='List migrations without applying them.')
+def migrate_database(target: int | None, status: bool) -> None:
+    """Apply pending schema migrations."""
+    database = db.current()
+    if status:
+        applied = applied_versions(database)
+        for version, (name, _) in sorted(MIGRATIONS.items()):
+            click.echo('{} {:>4} {}'.format('x' if version in applied else ' ', version, name))
+        return
+    try:
+        done = migrate(database, target)
+    except MigrationError as e:
+        raise click.ClickException(str(e))
+    click.echo('Applied migrations: {}'.format(', '.join(map(str, done)) if done else 'none'))
+    for path, done in zip([shard.pool.path for shard in db.shards], migrate_shards()):
+        click.echo('Applied shard migrations to {}: {}'.format(path, ', '.join(map(str, done)) if done else 'none'))
+
+@click.command('release-holds')
+def release_holds() -> None:
+    """Delete expired stock holds, e.g. from cron when the sweeper thread is off."""
+    click.echo('Released {} expired holds'.format(release_expired()))
+
+@click.command('reshard')
+@click.argument('shards', nargs=-1, required=True)
+@click.option('--batch-size', default=RESHARD_BATCH_SIZE, show_default=True, help='Users moved per transaction.')
+def reshard_database(shards: tuple[str], batch_size: int) -> None:
+    """Move users, carts and orders onto the SHARDS files.
+
+    They come from the shards in SHARD_URLS, or from DATABASE_URL when it is
+    unset. Stop the application first, then start it with SHARD_URLS set to
+    SHARDS, in the same order. If interrupted, run it again.
+    """
+    click.echo(json.dumps(reshard(list(shards), batch_size)))
+
+@click.command('worker')
+@click.option('--concurrency', default=JOB_WORKER_CONCURRENCY, show_default=True, help='Jobs run at once.')
+@click.option('--burst', is_flag=True, help='Run the jobs that are due, then exit.')
+@click.option('--metrics-port', type=int, help='Serve the metrics of the worker on this port.')
+def run_worker(concurrency: int, burst: bool, metrics_port: int | None) -> None:
+    """Run queued jobs, such as the processing of placed orders, until stopped."""
+    if burst:
+        click.echo(json.dumps(drain()))
+        return
+    if metrics_port:
+        metrics.serve(metrics_port)
+    worker = JobWorker(concurrency)
+    # On SIGTERM or Ctrl-C, finish the jobs being run and exit
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.start()
+    try:
+        worker.wait()
+    except KeyboardInterrupt:
+        worker.stop()
+    worker.join()
+
+@click.command('requeue-jobs')
+@click.option('--kind', help='Only jobs of this kind.')
+def requeue_jobs(kind: str | None) -> None:
+    """Move dead jobs back to their queues, e.g. once the cause of their failure is fixed."""
+    click.echo('Requeued {} jobs'.format(requeue(kind)))
+
+@click.command('rebuild-reports')
+def rebuild_reports() -> None:
+    """Recompute the sales and low-stock rollups from the orders and products."""
+    click.echo(json.dumps(rebuild()))
@@ -0,0 +1,252 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+from fastlite import Database
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    """A bounded pool of fastlite databases, each with its own SQLite connection.
+
+    Connections are opened lazily, configured for concurrent use (WAL,
+    busy_timeout, synchronous, mmap and page cache sizes) and reused in LIFO
+    order so the most recently used, warmest connection is handed out first.
+    """
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 30.0,
+                 busy_timeout: int = 5000, synchronous: str = 'NORMAL',
+                 mmap_size: int = 256 * 1024 * 1024, cache_size: int = -64000,
+                 on_connect: Callable[[Database], None] | None = None, uri: bool = False) -> None:
+        self.path = path
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = {
+            'journal_mode': 'WAL',
+            'busy_timeout': busy_timeout,
+            'synchronous': synchronous,
+            'mmap_size': mmap_size,
+            'cache_size': cache_size,
+        }
+        self.on_connect = on_connect
+        self._idle = queue.LifoQueue()
+        # Not bounded, so that grow can add slots while connections are out
+        self._slots = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self._connections = []
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'ConnectionPool':
+        # Keyword arguments take precedence over the environment
+        settings = dict(
+            path=os.getenv('DATABASE_URL', 'data/ecommerce.db'),
+            size=int(os.getenv('DB_POOL_SIZE', 8)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            busy_timeout=int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+            synchronous=os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+            mmap_size=int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+            cache_size=int(os.getenv('SQLITE_CACHE_SIZE', -64000)),
+        )
+        settings.update(kwargs)
+        return cls(**settings)
+
+    def _connect(self) -> Database:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode, as fastlite expects; transactions are explicit.
+        # uri lets ATTACH open file: URIs, e.g. a read-only catalog
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, uri=self.uri)
+        database = Database(conn)
+        for pragma, value in self.pragmas.items():
+            database.execute(f'PRAGMA {pragma} = {value}')
+        if self.on_connect:
+            self.on_connect(database)
+        with self._lock:
+            self._connections.append(database)
+        return database
+
+    def acquire(self) -> Database:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def grow(self, size: int) -> None:
+        """Raise the pool to at least ``size`` connections, e.g. to one per thread that uses it."""
+        with self._lock:
+            for _ in range(size - self.size):
+                self.size += 1
+                self._slots.release()
+
+    def release(self, database: Database) -> None:
+        # Never hand out a connection with a transaction left open
+        if database.conn.in_transaction:
+            database.execute('ROLLBACK')
+        self._idle.put(database)
+        self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for database in self._connections:
+                database.conn.close()
+            self._connections.clear()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(self.size)
+
+class ThreadLocalDatabase:
+    """Proxy that gives each thread its own pooled connection.
+
+    Attribute access (``q``, ``execute``, ``t``, ``conn``...) is forwarded to
+    the database checked out by the current thread, acquiring one on first
+    use. ``release`` hands it back to the pool, e.g. on request teardown.
+    ``q``, ``execute`` and ``executemany`` are timed and reported to
+    ``on_query``, if set.
+    """
+
+    def __init__(self, pool: ConnectionPool,
+                 on_query: Callable[[str, float], None] | None = None) -> None:
+        self.pool = pool
+        self.on_query = on_query
+        self._local = threading.local()
+
+    def current(self) -> Database:
+        database = getattr(self._local, 'database', None)
+        if database is None:
+            database = self._local.database = self.pool.acquire()
+        return database
+
+    def release(self) -> None:
+        database = getattr(self._local, 'database', None)
+        if database is not None:
+            self._local.database = None
+            self.pool.release(database)
+
+    def _timed(self, method: Callable, sql: str, params):
+        if self.on_query is None:
+            return method(sql, params)
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            self.on_query(sql, time.perf_counter() - start)
+
+    def q(self, sql: str, params=None) -> list:
+        return self._timed(self.current().q, sql, params)
+
+    def execute(self, sql: str, params=None) -> sqlite3.Cursor:
+        return self._timed(self.current().execute, sql, params)
+
+    def executemany(self, sql: str, params) -> sqlite3.Cursor:
+        return self._timed(self.current().conn.executemany, sql, params)
+
+    def __getattr__(self, name: str):
+        return getattr(self.current(), name)
+
+def shard_of(user_id: int, shards: int) -> int:
+    """Shard of ``user_id`` among ``shards``, by jump consistent hashing.
+
+    Going from N to N + 1 shards moves only the users that land on the new
+    shard, about 1 / (N + 1) of them, so a reshard copies as little as it can.
+    """
+    key, bucket, jump = user_id & 0xFFFFFFFFFFFFFFFF, -1, 0
+    while jump < shards:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+class ShardedDatabase:
+    """Proxy over the catalog database and, optionally, the user shards.
+
+    Forwards to the catalog unless the current thread is bound to a shard,
+    with ``bind`` (for a request) or ``using``; without shards the catalog
+    holds every table and binding does nothing. ``fan_out`` runs a read on
+    every shard in turn, the catalog being the only one when unsharded.
+    """
+
+    def __init__(self, catalog: ThreadLocalDatabase, shards: list[ThreadLocalDatabase] | None = None) -> None:
+        self.catalog = catalog
+        self.shards = shards or []
+        self._local = threading.local()
+
+    @property
+    def sharded(self) -> bool:
+        return bool(self.shards)
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return self.catalog.pool
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.shards) or 1
+
+    @property
+    def bound_shard(self) -> int | None:
+        return getattr(self._local, 'shard', None) if self.shards else 0
+
+    def shard_for(self, user_id: int) -> int:
+        return shard_of(user_id, len(self.shards)) if self.shards else 0
+
+    def shard(self, index: int) -> ThreadLocalDatabase:
+        return self.shards[index] if self.shards else self.catalog
+
+    def target(self) -> ThreadLocalDatabase:
+        index = self.bound_shard
+        return self.catalog if index is None else self.shard(index)
+
+    def bind(self, user_id: int) -> None:
+        self._local.shard = self.shard_for(user_id)
+
+    def unbind(self) -> None:
+        self._local.shard = None
+
+    @contextmanager
+    def using(self, user_id: int | None = None, shard: int | None = None):
+        """Bind to the shard of ``user_id`` (or to shard number ``shard``) for the block."""
+        previous = getattr(self._local, 'shard', None)
+        self._local.shard = self.shard_for(user_id) if shard is None else shard
+        try:
+            yield self
+        finally:
+            self._local.shard = previous
+
+    def fan_out(self, sql: str, params=None, skip_bound: bool = False) -> dict[int, list]:
+        # One shard after the other: a thread keeps the connection it checked
+        # out of each pool, so no extra threads (and connections) are needed
+        bound = self.bound_shard
+        return {index: self.shard(index).q(sql, params) for index in range(self.shard_count)
+                if not (skip_bound and index == bound)}
+
+    def current(self) -> Database:
+        return self.target().current()
+
+    def release(self) -> None:
+        self.unbind()
+        self.catalog.release()
+        for shard in self.shards:
+            shard.release()
+
+    def q(self, sql: str, params=None) -> list:
+        return self.target().q(sql, params)
+
+    def execute(self, sql: str, params=None) -> sqlite3.Cursor:
+        return self.target().execute(sql, params)
+
+    def executemany(self, sql: str, params) -> sqlite3.Cursor:
+        return self.target().executemany(sql, params)
+
+    def __getattr__(self, name: str):
+        return getattr(self.target(), name)
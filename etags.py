@@ -0,0 +1,44 @@
+import hashlib
+import os
+from flask import Response, request
+from models import db
+
+CATALOG_CACHE_CONTROL = 'public, max-age={}, must-revalidate'.format(os.getenv('CATALOG_MAX_AGE', 0))
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+
+# The counters live in the catalog, also when a request is bound to a shard
+
+def get_versions(*keys: str) -> list[int]:
+    rows = db.catalog.q(f'SELECT key, version FROM versions WHERE key IN ({", ".join("?" * len(keys))})', keys)
+    versions = {row['key']: row['version'] for row in rows}
+    return [versions.get(key, 0) for key in keys]
+
+def bump_versions(*keys: str) -> None:
+    # Call inside the transaction of the write, so readers never see new rows with an old version.
+    # A checkout on a shard bumps them after taking the stock, in a catalog write of their own.
+    db.catalog.executemany('''
+        INSERT INTO versions (key, version) VALUES (?, 1)
+        ON CONFLICT (key) DO UPDATE SET version = version + 1
+    ''', [(key,) for key in keys])
+
+def make_etag(*parts: object) -> str:
+    # Query parameters are hashed so different pages of a listing get different tags
+    return '-'.join(str(part) for part in parts) + '-' + hashlib.sha1(
+        request.query_string).hexdigest()[:16]
+
+def not_modified(etag: str, cache_control: str) -> Response | None:
+    """Return a 304 response if the client already has this version.
+
+    Called before the body is queried, so a match costs one version lookup.
+    Compressed responses carry the tag as weak, so the weak comparison that
+    If-None-Match calls for is used.
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    return tag(response, etag, cache_control)
+
+def tag(response: Response, etag: str, cache_control: str) -> Response:
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,90 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or too slow; the client should retry later."""
+
+def normalize_method(method: str) -> str:
+    # Expand the defaults the way Werkzeug writes them into the stored hash
+    name, *params = method.split(':')
+    if name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    elif name == 'scrypt':
+        defaults = [str(2 ** 15), '8', '1']
+    else:
+        return method
+    return ':'.join([name] + params + defaults[len(params):])
+
+class PasswordHasher:
+    """Runs password hashing and verification on a bounded process pool.
+
+    Key derivation is deliberately slow and CPU-bound; doing it on request
+    threads holds the GIL and starves every other request of the worker. At
+    most ``workers + queue_size`` operations are admitted at a time, beyond
+    which ``HashingBusy`` is raised instead of queueing without bound.
+    """
+
+    def __init__(self, method: str = 'pbkdf2', workers: int = 2, queue_size: int = 32,
+                 timeout: float = 10.0) -> None:
+        self.method = normalize_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def from_env(cls) -> 'PasswordHasher':
+        return cls(
+            method=os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2'),
+            workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+            queue_size=int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 32)),
+            timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', 10)),
+        )
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Created on first use, and again in a forked worker, which cannot
+        # reuse its parent's pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the task has run (or was cancelled while
+        # queued), not just while a request waits for it, so tasks left behind
+        # by timed-out requests still count against the bound
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingBusy()
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+password_hasher = PasswordHasher.from_env()
@@ -0,0 +1,274 @@
+"""A durable job queue in SQLite, for the work a request need not wait for.
+
+``enqueue`` inserts a job in the transaction of the change it follows up on,
+so that an order's job commits with the order or not at all. Each database
+has its own queue: when sharded, a user's jobs are on the user's shard, next
+to their orders.
+
+``flask worker`` runs threads that claim one job at a time with a lease of
+``JOB_LEASE`` seconds. If the worker running a job dies, the job can be
+claimed again once its lease has run out, so handlers must be idempotent. A
+failed job is retried with exponential backoff; after ``max_attempts`` it
+moves to ``dead_jobs``, and ``flask requeue-jobs`` puts it back.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+from metrics import REGISTRY, Collected, Counter, Histogram
+from migrations import UTC_NOW
+from models import db, transaction
+
+JOB_LEASE = float(os.getenv('JOB_LEASE', 60))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BASE = float(os.getenv('JOB_RETRY_BASE', 2))
+JOB_RETRY_MAX = float(os.getenv('JOB_RETRY_MAX', 600))
+JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', 4))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+UTC_IN = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)"
+AGE_SECONDS = "(julianday('now') - julianday(run_at)) * 86400"
+
+log = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class JobKind:
+    """How jobs of one kind run; ``concurrency`` caps those running at once
+    on one queue, counted over every worker."""
+    handler: Callable[[dict], None]
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    concurrency: int | None = None
+
+JOB_KINDS: dict[str, JobKind] = {}
+
+def job(kind: str, max_attempts: int = JOB_MAX_ATTEMPTS, concurrency: int | None = None):
+    def register(fn: Callable[[dict], None]) -> Callable[[dict], None]:
+        assert kind not in JOB_KINDS, f'Duplicate job kind {kind}'
+        JOB_KINDS[kind] = JobKind(fn, max_attempts, concurrency)
+        return fn
+    return register
+
+def _placeholders(values) -> str:
+    return ', '.join('?' * len(values))
+
+def _seconds(seconds: float) -> str:
+    return f'+{seconds} seconds'
+
+def enqueue(kind: str, payload: dict, user_id: int | None = None, delay: float = 0) -> int:
+    """Queue a job on the database ``db`` is bound to, in its current transaction.
+
+    When sharded, that must be a shard: the workers serve the shards' queues.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f'Unknown job kind {kind}')
+    return db.execute(f'INSERT INTO jobs (kind, payload, user_id, run_at) VALUES (?, ?, ?, {UTC_IN})',
+                      (kind, json.dumps(payload), user_id, _seconds(delay))).lastrowid
+
+def claim(lease: float = JOB_LEASE) -> dict | None:
+    """Lease the job that has been due the longest, skipping kinds at their concurrency limit.
+
+    ``attempts`` of the returned job identifies the lease: the job is only
+    completed or failed if no other worker has claimed it since.
+    """
+    with transaction():
+        full = []
+        if any(kind.concurrency is not None for kind in JOB_KINDS.values()):
+            running = {row['kind']: row['running'] for row in db.q(f'''
+                SELECT kind, COUNT(*) AS running FROM jobs
+                WHERE status = 'running' AND run_at > {UTC_NOW}
+                GROUP BY kind
+            ''')}
+            full = [name for name, kind in JOB_KINDS.items()
+                    if kind.concurrency is not None and running.get(name, 0) >= kind.concurrency]
+        rows = db.q(f'''
+            SELECT id, kind, payload, user_id, attempts + 1 AS attempts, {AGE_SECONDS} AS waited
+            FROM jobs
+            WHERE run_at <= {UTC_NOW} {f'AND kind NOT IN ({_placeholders(full)})' if full else ''}
+            ORDER BY run_at
+            LIMIT 1
+        ''', full)
+        if not rows:
+            return None
+        db.execute(f"UPDATE jobs SET status = 'running', attempts = attempts + 1, run_at = {UTC_IN} WHERE id = ?",
+                   (_seconds(lease), rows[0]['id']))
+    return rows[0]
+
+def complete(job: dict) -> bool:
+    with transaction():
+        return db.execute('DELETE FROM jobs WHERE id = ? AND attempts = ?', (job['id'], job['attempts'])).rowcount > 0
+
+def fail(job: dict, error: str) -> str:
+    """Schedule the retry of a failed job, or move it to the dead letters after its last attempt."""
+    kind = JOB_KINDS.get(job['kind'])
+    # Jobs of a kind that is no longer handled are not retried
+    max_attempts = kind.max_attempts if kind else 1
+    with transaction():
+        if job['attempts'] >= max_attempts:
+            moved = db.execute(f'''
+                INSERT INTO dead_jobs (id, kind, payload, user_id, attempts, last_error, created_at, failed_at)
+                SELECT id, kind, payload, user_id, attempts, ?, created_at, {UTC_NOW}
+                FROM jobs WHERE id = ? AND attempts = ?
+            ''', (error, job['id'], job['attempts'])).rowcount
+            db.execute('DELETE FROM jobs WHERE id = ? AND attempts = ?', (job['id'], job['attempts']))
+            return 'dead' if moved else 'lost'
+        delay = min(JOB_RETRY_MAX, JOB_RETRY_BASE * 2 ** (job['attempts'] - 1))
+        retried = db.execute(f'''
+            UPDATE jobs SET status = 'queued', run_at = {UTC_IN}, last_error = ?
+            WHERE id = ? AND attempts = ?
+        ''', (_seconds(delay), error, job['id'], job['attempts'])).rowcount
+        return 'retried' if retried else 'lost'
+
+job_latency = Histogram('job_latency_seconds', 'Time from a job being due to being claimed.',
+                        ('kind',), JOB_LATENCY_BUCKETS)
+job_duration = Histogram('job_duration_seconds', 'Time spent running a job.', ('kind',), JOB_LATENCY_BUCKETS)
+jobs_processed = Counter('jobs_processed_total',
+                         'Jobs run, by outcome: done, retried, dead or lost (taken over by another worker).',
+                         ('kind', 'outcome'))
+
+def work(shard: int, lease: float = JOB_LEASE) -> str | None:
+    """Claim and run one job of the queue of ``shard``; returns its outcome, or None if no job was due."""
+    with db.using(shard=shard):
+        job = claim(lease)
+        if job is None:
+            return None
+        job_latency.observe(max(0.0, job['waited']), job['kind'])
+        start = time.perf_counter()
+        try:
+            kind = JOB_KINDS.get(job['kind'])
+            if kind is None:
+                raise LookupError(f"No handler for job kind {job['kind']}")
+            kind.handler(json.loads(job['payload']))
+        except Exception as e:
+            log.exception('Job %d (%s) failed on attempt %d', job['id'], job['kind'], job['attempts'])
+            outcome = fail(job, f'{type(e).__name__}: {e}')
+        else:
+            # Lost if the lease ran out and another worker took the job over
+            outcome = 'done' if complete(job) else 'lost'
+        job_duration.observe(time.perf_counter() - start, job['kind'])
+        jobs_processed.inc(job['kind'], outcome)
+        return outcome
+
+def drain() -> dict[str, int]:
+    """Run the jobs due on every shard until none is left; returns the count of each outcome."""
+    outcomes = {}
+    for shard in range(db.shard_count):
+        while (outcome := work(shard)) is not None:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return outcomes
+
+def requeue(kind: str | None = None) -> int:
+    """Move dead jobs, of ``kind`` or of every kind, back to their queues with fresh attempts."""
+    where, params = ('WHERE kind = ?', (kind,)) if kind else ('', ())
+    requeued = 0
+    for shard in range(db.shard_count):
+        with db.using(shard=shard), transaction():
+            requeued += db.execute(f'''
+                INSERT INTO jobs (id, kind, payload, user_id, run_at, last_error, created_at)
+                SELECT id, kind, payload, user_id, {UTC_NOW}, last_error, created_at FROM dead_jobs {where}
+            ''', params).rowcount
+            db.execute(f'DELETE FROM dead_jobs {where}', params)
+    return requeued
+
+def queue_stats() -> dict[int, list]:
+    """Jobs per shard and kind by state (ready, running or scheduled), with the age of the oldest ready one."""
+    # A running job whose lease has run out is ready again
+    return db.fan_out(f'''
+        SELECT kind,
+               CASE WHEN run_at <= {UTC_NOW} THEN 'ready' WHEN status = 'running' THEN 'running'
+                    ELSE 'scheduled' END AS state,
+               COUNT(*) AS jobs, MAX({AGE_SECONDS}) AS oldest
+        FROM jobs
+        GROUP BY 1, 2
+    ''')
+
+def dead_stats() -> dict[int, list]:
+    return db.fan_out('SELECT kind, COUNT(*) AS jobs FROM dead_jobs GROUP BY kind')
+
+def _queued() -> dict[tuple, int]:
+    values = {}
+    for rows in queue_stats().values():
+        for row in rows:
+            key = (row['kind'], row['state'])
+            values[key] = values.get(key, 0) + row['jobs']
+    return values
+
+def _oldest_ready() -> dict[tuple, float]:
+    values = {}
+    for rows in queue_stats().values():
+        for row in rows:
+            if row['state'] == 'ready':
+                values[(row['kind'],)] = max(values.get((row['kind'],), 0), round(row['oldest'], 3))
+    return values
+
+def _dead() -> dict[tuple, int]:
+    values = {}
+    for rows in dead_stats().values():
+        for row in rows:
+            values[(row['kind'],)] = values.get((row['kind'],), 0) + row['jobs']
+    return values
+
+REGISTRY.extend([
+    job_latency, job_duration, jobs_processed,
+    Collected('jobs_queued', 'Jobs in the queues, by state.', ('kind', 'state'), _queued),
+    Collected('jobs_oldest_ready_seconds', 'How long the oldest due job has been waiting.', ('kind',), _oldest_ready),
+    Collected('jobs_dead', 'Jobs in the dead letters.', ('kind',), _dead),
+])
+
+class JobWorker:
+    """``concurrency`` threads working through the queues of every shard until stopped.
+
+    Each thread needs a connection of each pool, so keep ``concurrency``
+    within DB_POOL_SIZE.
+    """
+
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL,
+                 lease: float = JOB_LEASE) -> None:
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(index,), name=f'job-worker-{index}', daemon=True)
+                         for index in range(concurrency)]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        # Jobs being run are finished, so their leases do not have to run out
+        self._stopped.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._stopped.wait(timeout)
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, index: int) -> None:
+        while not self._stopped.is_set():
+            worked = False
+            # Threads start at different shards, so that every queue is served
+            for offset in range(db.shard_count):
+                if self._stopped.is_set():
+                    break
+                try:
+                    worked |= work((index + offset) % db.shard_count, self.lease) is not None
+                except Exception:
+                    log.exception('Working the job queue failed')
+                    db.release()
+            if not worked:
+                db.release()
+                self._stopped.wait(self.poll_interval)
+
+# Jobs
+
+@job('order.placed')
+def confirm_order(payload: dict) -> None:
+    # The order stays Pending until its follow-up work is done; a second run changes nothing
+    with transaction():
+        db.execute("UPDATE orders SET status = 'Confirmed' WHERE id = ? AND status = 'Pending'",
+                   (payload['order_id'],))
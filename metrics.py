@@ -0,0 +1,203 @@
+"""In-process request and SQL metrics, exposed in the Prometheus text format.
+
+Metrics are per process: with several workers, scrape each one (or sum them
+in Prometheus). Endpoints are labelled by URL rule, not path, so that
+``/v1/cart/<int:user_id>`` is one series instead of one per user.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# A single query slower than this, or a request issuing more queries than
+# this (the signature of an N+1 loop), is logged
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 50))
+
+slow_query_log = logging.getLogger('slow_query')
+log = logging.getLogger(__name__)
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.extend(self._render_series(values, value))
+        return lines
+
+    def _render_series(self, values: tuple, value) -> list[str]:
+        return [f'{self.name}{_format_labels(self.labels, values)} {value}']
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels) -> None:
+        self.inc(*labels, amount=-1)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, values: tuple, series: list) -> list[str]:
+        counts, total, count = series
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            le = _format_labels(self.labels, values, f'le="{bound}"')
+            lines.append(f'{self.name}_bucket{le} {cumulative}')
+        labels = _format_labels(self.labels, values)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Collected(Metric):
+    """A gauge read at scrape time: ``collect`` returns {label values: value}.
+
+    For state kept outside the process, such as the depth of the job queues.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple, collect: Callable[[], dict]) -> None:
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        try:
+            values = self.collect()
+        except Exception:
+            # A failing source leaves its series out rather than the whole scrape
+            log.exception('Collecting %s failed', self.name)
+            values = {}
+        with self._lock:
+            self._values = values
+        return super().render()
+
+request_duration = Histogram('http_request_duration_seconds', 'Request latency.',
+                             ('method', 'endpoint', 'status'))
+response_size = Histogram('http_response_size_bytes', 'Response body size.',
+                          ('method', 'endpoint'), SIZE_BUCKETS)
+requests_in_flight = Gauge('http_requests_in_flight', 'Requests being served.')
+request_queries = Histogram('db_queries_per_request', 'SQL queries issued per request.',
+                            ('endpoint',), QUERY_COUNT_BUCKETS)
+request_query_time = Histogram('db_query_seconds_per_request', 'Cumulative SQL time per request.',
+                               ('endpoint',))
+queries_total = Counter('db_queries_total', 'SQL queries issued.')
+query_seconds_total = Counter('db_query_seconds_total', 'Time spent in SQL queries.')
+slow_queries_total = Counter('db_slow_queries_total', 'SQL queries slower than SLOW_QUERY_MS.')
+
+REGISTRY = [request_duration, response_size, requests_in_flight, request_queries,
+            request_query_time, queries_total, query_seconds_total, slow_queries_total]
+
+# SQL counters of the request being served by the current thread
+_request = threading.local()
+
+def record_query(sql: str, seconds: float) -> None:
+    """``on_query`` hook of the database proxy."""
+    queries_total.inc()
+    query_seconds_total.inc(amount=seconds)
+    if getattr(_request, 'active', False):
+        _request.queries += 1
+        _request.sql_time += seconds
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        slow_queries_total.inc()
+        slow_query_log.warning('%.1f ms: %s', seconds * 1000, ' '.join(sql.split()))
+
+def _endpoint() -> str:
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def start_request() -> None:
+    g.metrics_start = time.perf_counter()
+    _request.active, _request.queries, _request.sql_time = True, 0, 0.0
+    requests_in_flight.inc()
+
+def record_response(response: Response) -> Response:
+    g.metrics_status = response.status_code
+    # Streamed responses have no length up front and are left out
+    if response.content_length is not None:
+        response_size.observe(response.content_length, request.method, _endpoint())
+    return response
+
+def finish_request(exception: BaseException | None = None) -> None:
+    if 'metrics_start' not in g:
+        return
+    endpoint = _endpoint()
+    status = g.get('metrics_status', 500)
+    request_duration.observe(time.perf_counter() - g.pop('metrics_start'), request.method, endpoint, str(status))
+    request_queries.observe(_request.queries, endpoint)
+    request_query_time.observe(_request.sql_time, endpoint)
+    if _request.queries > SLOW_REQUEST_QUERIES:
+        slow_query_log.warning('%s %s issued %d queries (%.1f ms)', request.method, endpoint,
+                               _request.queries, _request.sql_time * 1000)
+    _request.active = False
+    requests_in_flight.dec()
+
+def render() -> str:
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+def metrics_endpoint() -> Response:
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+def serve(port: int) -> HTTPServer:
+    """Serve the metrics of a process without the web app, e.g. a job worker, on ``port``.
+
+    One thread answers every scrape, so collectors that query SQLite keep a
+    single connection of each pool checked out.
+    """
+    server = HTTPServer(('', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
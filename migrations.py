@@ -0,0 +1,597 @@
+from datetime import datetime
+from typing import Callable
+from fastlite import Database
+
+UTC_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+class MigrationError(Exception):
+    """A migration cannot be applied to the data as it stands."""
+
+MIGRATIONS: dict[int, tuple[str, Callable[[Database], None]]] = {}
+# The schema of the user shards, which has versions of its own (see sharding.py)
+SHARD_MIGRATIONS: dict[int, tuple[str, Callable[[Database], None]]] = {}
+
+def migration(version: int, name: str, registry: dict = MIGRATIONS):
+    def register(fn: Callable[[Database], None]) -> Callable[[Database], None]:
+        assert version not in registry, f'Duplicate migration version {version}'
+        registry[version] = (name, fn)
+        return fn
+    return register
+
+def applied_versions(database: Database) -> set[int]:
+    database.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL
+        )
+    ''')
+    return {row['version'] for row in database.q('SELECT version FROM schema_migrations')}
+
+def migrate(database: Database, target: int | None = None, migrations: dict = MIGRATIONS) -> list[int]:
+    """Apply the pending migrations up to ``target`` and return their versions.
+
+    Each migration runs in its own IMMEDIATE transaction together with its
+    bookkeeping row, so a failed migration leaves no trace and workers that
+    start at the same time apply every migration exactly once.
+    """
+    applied = applied_versions(database)
+    done = []
+    for version, (name, fn) in sorted(migrations.items()):
+        if version in applied or (target is not None and version > target):
+            continue
+        database.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have applied it while we waited for the lock
+            if not database.q('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)):
+                fn(database)
+                database.execute('INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                                 (version, name, datetime.now().isoformat()))
+                done.append(version)
+        except BaseException:
+            database.execute('ROLLBACK')
+            raise
+        database.execute('COMMIT')
+    return done
+
+# Migrations 1 to 6 describe the schema as it existed before versioning was
+# introduced; they use IF NOT EXISTS so databases created back then upgrade
+# cleanly.
+
+@migration(1, 'create_tables')
+def create_tables(database: Database) -> None:
+    database.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY, username TEXT, password TEXT, email TEXT, role TEXT
+        )
+    ''')
+    database.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY, name TEXT, description TEXT, price FLOAT, stock INTEGER
+        )
+    ''')
+    database.execute('''
+        CREATE TABLE IF NOT EXISTS carts (
+            id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER, quantity INTEGER
+        )
+    ''')
+    database.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY, user_id INTEGER, items TEXT, order_date TEXT, status TEXT
+        )
+    ''')
+
+@migration(2, 'product_listing_indexes')
+def product_listing_indexes(database: Database) -> None:
+    database.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)')
+    database.execute('CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)')
+    database.execute('CREATE INDEX IF NOT EXISTS idx_products_in_stock ON products (id) WHERE stock > 0')
+
+@migration(3, 'products_fts')
+def products_fts(database: Database) -> None:
+    database.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, content='products', content_rowid='id', prefix='2 3'
+        )
+    ''')
+    database.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    database.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    ''')
+    database.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    # Index the rows that existed before the table was created
+    database.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+@migration(4, 'versions')
+def versions(database: Database) -> None:
+    # Version counters bumped by every write, from which the HTTP ETags are derived
+    database.execute('CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID')
+
+@migration(5, 'products_updated_at')
+def products_updated_at(database: Database) -> None:
+    # Last modification time of each product, for incremental catalog exports.
+    # Writes that do not set it explicitly get it from the triggers; the WHEN
+    # and WHERE clauses stop the trigger's own UPDATE from firing it again.
+    if 'updated_at' not in database.t.products.columns_dict:
+        database.execute('ALTER TABLE products ADD COLUMN updated_at TEXT')
+        database.execute(f'UPDATE products SET updated_at = {UTC_NOW}')
+    database.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_touch_insert AFTER INSERT ON products
+        WHEN new.updated_at IS NULL BEGIN
+            UPDATE products SET updated_at = {UTC_NOW} WHERE id = new.id;
+        END
+    ''')
+    database.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_touch_update AFTER UPDATE ON products
+        WHEN new.updated_at IS old.updated_at BEGIN
+            UPDATE products SET updated_at = {UTC_NOW} WHERE id = new.id AND updated_at IS NOT {UTC_NOW};
+        END
+    ''')
+    database.execute('CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products (updated_at)')
+
+@migration(6, 'carts_unique_user_product')
+def carts_unique_user_product(database: Database) -> None:
+    # One row per product in a cart, so cart writes can be upserts. Duplicates
+    # left by the old read-then-insert code are merged first. The index also
+    # serves every cart lookup by user_id.
+    database.execute('''
+        UPDATE carts SET quantity = (
+            SELECT SUM(quantity) FROM carts c WHERE c.user_id = carts.user_id AND c.product_id = carts.product_id
+        )
+        WHERE id IN (SELECT MIN(id) FROM carts GROUP BY user_id, product_id HAVING COUNT(*) > 1)
+    ''')
+    database.execute('DELETE FROM carts WHERE id NOT IN (SELECT MIN(id) FROM carts GROUP BY user_id, product_id)')
+    database.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_carts_user_product ON carts (user_id, product_id)')
+
+@migration(7, 'users_unique_username_email')
+def users_unique_username_email(database: Database) -> None:
+    # login looks users up by username and register by username OR email
+    conflicts = [
+        f"{column} {row['value']!r} (user ids {row['ids']})"
+        for column in ('username', 'email')
+        for row in database.q(f'''
+            SELECT {column} AS value, group_concat(id, ', ') AS ids FROM users
+            WHERE {column} IS NOT NULL GROUP BY {column} HAVING COUNT(*) > 1 ORDER BY {column}
+        ''')
+    ]
+    if conflicts:
+        # Which account to keep is not ours to decide
+        raise MigrationError('Duplicate users must be merged or renamed before migration 7: '
+                             + '; '.join(conflicts))
+    database.execute('CREATE UNIQUE INDEX idx_users_username ON users (username)')
+    database.execute('CREATE UNIQUE INDEX idx_users_email ON users (email)')
+
+@migration(8, 'orders_user_date_index')
+def orders_user_date_index(database: Database) -> None:
+    database.execute('CREATE INDEX idx_orders_user_date ON orders (user_id, order_date)')
+
+@migration(9, 'order_items')
+def order_items(database: Database) -> None:
+    # Orders used to keep their lines as a JSON blob in orders.items; they
+    # move to their own table so history and sales queries are index scans
+    database.execute('''
+        CREATE TABLE order_items (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT,
+            quantity INTEGER NOT NULL,
+            price FLOAT NOT NULL
+        )
+    ''')
+    database.execute('''
+        INSERT INTO order_items (order_id, product_id, product_name, quantity, price)
+        SELECT o.id, json_extract(item.value, '$.product_id'), json_extract(item.value, '$.product_name'),
+               json_extract(item.value, '$.quantity'), json_extract(item.value, '$.price')
+        FROM orders o, json_each(o.items) item
+        WHERE json_valid(o.items)
+    ''')
+    database.execute('ALTER TABLE orders ADD COLUMN total_price FLOAT')
+    database.execute('''
+        UPDATE orders SET total_price = (
+            SELECT COALESCE(SUM(quantity * price), 0) FROM order_items WHERE order_id = orders.id
+        )
+    ''')
+    database.execute('ALTER TABLE orders DROP COLUMN items')
+    database.execute('CREATE INDEX idx_order_items_order ON order_items (order_id)')
+    database.execute('CREATE INDEX idx_order_items_product ON order_items (product_id)')
+    database.execute('CREATE INDEX idx_orders_order_date ON orders (order_date)')
+
+# The cart lines of one user as shown by GET /v1/cart, as a JSON array
+CART_ITEMS_JSON = '''(
+    SELECT COALESCE(json_group_array(json(line)), '[]') FROM (
+        SELECT json_object('id', c.id, 'product_id', c.product_id, 'product_name', p.name,
+                           'quantity', c.quantity, 'price', p.price, 'subtotal', p.price * c.quantity) AS line
+        FROM carts c JOIN products p ON p.id = c.product_id
+        WHERE c.user_id = {user_id}
+        ORDER BY c.id
+    )
+)'''
+
+# The total of one user's cart, rounded to cents like the triggers keep it
+CART_TOTAL = '''(
+    SELECT ROUND(COALESCE(SUM(c.quantity * p.price), 0), 2)
+    FROM carts c JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = {user_id}
+)'''
+
+def cart_summary_triggers(temp: bool = False) -> list[str]:
+    """The triggers that apply each change of a cart line to its cart's summary row.
+
+    Shards create them as TEMP triggers on every connection: only those may
+    read the products table of the catalog the shard has attached.
+    """
+    def apply_delta(user_id: str, quantity: str, price: str) -> str:
+        # Rounded to cents after every delta, so float residue never builds
+        # up; an emptied cart gets an exact zero total
+        return f'''
+            INSERT INTO cart_summaries (user_id) VALUES ({user_id}) ON CONFLICT (user_id) DO NOTHING;
+            UPDATE cart_summaries SET
+                item_count = item_count + ({quantity}),
+                total_price = CASE WHEN item_count + ({quantity}) = 0 THEN 0
+                                   ELSE ROUND(total_price + ({quantity}) * ({price}), 2) END,
+                items = {CART_ITEMS_JSON.format(user_id=user_id)},
+                version = version + 1
+            WHERE user_id = {user_id};
+        '''
+
+    create = 'CREATE TEMP TRIGGER IF NOT EXISTS' if temp else 'CREATE TRIGGER'
+    price_of = '(SELECT price FROM products WHERE id = {}.product_id)'
+    return [
+        f'''
+            {create} cart_summaries_insert AFTER INSERT ON carts BEGIN
+                {apply_delta('new.user_id', 'new.quantity', price_of.format('new'))}
+            END
+        ''',
+        f'''
+            {create} cart_summaries_update AFTER UPDATE OF quantity ON carts
+            WHEN new.quantity IS NOT old.quantity BEGIN
+                {apply_delta('new.user_id', 'new.quantity - old.quantity', price_of.format('new'))}
+            END
+        ''',
+        f'''
+            {create} cart_summaries_delete AFTER DELETE ON carts BEGIN
+                {apply_delta('old.user_id', '-old.quantity', price_of.format('old'))}
+            END
+        ''',
+    ]
+
+@migration(10, 'cart_summaries')
+def cart_summaries(database: Database) -> None:
+    # One row per cart with its item count, total and rendered lines, so a
+    # cart read is a primary key lookup. Triggers apply each change to the
+    # count and total as a delta, re-render the lines of that cart only and
+    # bump the version, which is the cart's ETag and never goes back.
+    database.execute('''
+        CREATE TABLE cart_summaries (
+            user_id INTEGER PRIMARY KEY,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            total_price FLOAT NOT NULL DEFAULT 0,
+            items TEXT NOT NULL DEFAULT '[]',
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    database.execute('CREATE INDEX idx_carts_product ON carts (product_id)')
+    # Lines of deleted products were hidden by the join; drop them for good
+    database.execute('DELETE FROM carts WHERE product_id NOT IN (SELECT id FROM products)')
+    database.execute(f'''
+        INSERT INTO cart_summaries (user_id, item_count, total_price, items, version)
+        SELECT c.user_id, SUM(c.quantity), SUM(c.quantity * p.price), {CART_ITEMS_JSON.format(user_id='c.user_id')}, 1
+        FROM carts c JOIN products p ON p.id = c.product_id
+        GROUP BY c.user_id
+    ''')
+
+    for statement in cart_summary_triggers():
+        database.execute(statement)
+    database.execute(f'''
+        CREATE TRIGGER cart_summaries_product_update AFTER UPDATE OF name, price ON products
+        WHEN new.name IS NOT old.name OR new.price IS NOT old.price BEGIN
+            UPDATE cart_summaries SET
+                total_price = total_price + c.quantity * (new.price - old.price),
+                items = {CART_ITEMS_JSON.format(user_id='c.user_id')},
+                version = version + 1
+            FROM carts c
+            WHERE c.product_id = new.id AND cart_summaries.user_id = c.user_id;
+        END
+    ''')
+    # Before the delete, so the cart triggers still see the product's price
+    database.execute('''
+        CREATE TRIGGER cart_summaries_product_delete BEFORE DELETE ON products BEGIN
+            DELETE FROM carts WHERE product_id = old.id;
+        END
+    ''')
+
+@migration(11, 'reservations')
+def reservations(database: Database) -> None:
+    # Time-limited stock holds, one per cart line; see reservations.py
+    database.execute('''
+        CREATE TABLE reservations (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, product_id)
+        )
+    ''')
+    # Covers the sum of a product's active holds
+    database.execute('CREATE INDEX idx_reservations_product ON reservations (product_id, expires_at, quantity)')
+    database.execute('CREATE INDEX idx_reservations_expires ON reservations (expires_at)')
+
+def job_tables(database: Database) -> None:
+    # The job queue and its dead letters; see jobs.py. run_at is when a job
+    # can next be claimed: when it is due, when its retry is due or when the
+    # lease of the worker running it runs out
+    database.execute(f'''
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            user_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at TEXT NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL DEFAULT ({UTC_NOW})
+        )
+    ''')
+    database.execute('CREATE INDEX idx_jobs_run_at ON jobs (run_at)')
+    database.execute('CREATE INDEX idx_jobs_user ON jobs (user_id)')
+    database.execute('''
+        CREATE TABLE dead_jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            user_id INTEGER,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            failed_at TEXT NOT NULL
+        )
+    ''')
+    database.execute('CREATE INDEX idx_dead_jobs_user ON dead_jobs (user_id)')
+
+@migration(12, 'jobs')
+def jobs(database: Database) -> None:
+    job_tables(database)
+
+# Sales totals kept up to date by place_order (see rollups.py), so reports
+# read a row per day, product or user instead of the order history; revenue
+# is rounded the way record_sale rounds it
+SALES_ROLLUPS_REBUILD = (
+    'DELETE FROM sales_daily',
+    '''
+        INSERT INTO sales_daily (day, orders, units, revenue)
+        SELECT substr(o.order_date, 1, 10), COUNT(*), SUM(i.units), ROUND(SUM(ROUND(o.total_price, 2)), 2)
+        FROM orders o
+        JOIN (SELECT order_id, SUM(quantity) AS units FROM order_items GROUP BY order_id) i ON i.order_id = o.id
+        GROUP BY 1
+    ''',
+    'DELETE FROM product_sales_daily',
+    '''
+        INSERT INTO product_sales_daily (product_id, day, units, revenue)
+        SELECT i.product_id, substr(o.order_date, 1, 10), SUM(i.quantity), ROUND(SUM(ROUND(i.quantity * i.price, 2)), 2)
+        FROM order_items i JOIN orders o ON o.id = i.order_id
+        GROUP BY 1, 2
+    ''',
+    'DELETE FROM user_sales',
+    '''
+        INSERT INTO user_sales (user_id, orders, units, revenue, first_order_at, last_order_at)
+        SELECT o.user_id, COUNT(*), SUM(i.units), ROUND(SUM(ROUND(o.total_price, 2)), 2), MIN(o.order_date), MAX(o.order_date)
+        FROM orders o
+        JOIN (SELECT order_id, SUM(quantity) AS units FROM order_items GROUP BY order_id) i ON i.order_id = o.id
+        GROUP BY 1
+    ''',
+)
+
+# Products at or below this stock are listed in low_stock by triggers
+LOW_STOCK_THRESHOLD = 10
+
+LOW_STOCK_REBUILD = (
+    'DELETE FROM low_stock',
+    f'INSERT INTO low_stock (product_id, stock) SELECT id, stock FROM products WHERE stock <= {LOW_STOCK_THRESHOLD}',
+)
+
+def sales_rollup_tables(database: Database) -> None:
+    database.execute('''
+        CREATE TABLE sales_daily (
+            day TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue FLOAT NOT NULL DEFAULT 0
+        )
+    ''')
+    database.execute('''
+        CREATE TABLE product_sales_daily (
+            product_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_id, day)
+        ) WITHOUT ROWID
+    ''')
+    # Covers the totals of every product over a range of days
+    database.execute('''
+        CREATE INDEX idx_product_sales_daily_day ON product_sales_daily (day, product_id, units, revenue)
+    ''')
+    database.execute('''
+        CREATE TABLE user_sales (
+            user_id INTEGER PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue FLOAT NOT NULL DEFAULT 0,
+            first_order_at TEXT,
+            last_order_at TEXT
+        )
+    ''')
+    database.execute('CREATE INDEX idx_user_sales_revenue ON user_sales (revenue)')
+    for statement in SALES_ROLLUPS_REBUILD:
+        database.execute(statement)
+
+@migration(13, 'sales_rollups')
+def sales_rollups(database: Database) -> None:
+    sales_rollup_tables(database)
+    # Stock changes come from checkouts, product updates and bulk imports
+    # alike, so the triggers keep the list in their transaction
+    database.execute('CREATE TABLE low_stock (product_id INTEGER PRIMARY KEY, stock INTEGER NOT NULL)')
+    database.execute('CREATE INDEX idx_low_stock_stock ON low_stock (stock)')
+    database.execute(f'''
+        CREATE TRIGGER low_stock_insert AFTER INSERT ON products
+        WHEN new.stock <= {LOW_STOCK_THRESHOLD} BEGIN
+            INSERT OR REPLACE INTO low_stock (product_id, stock) VALUES (new.id, new.stock);
+        END
+    ''')
+    database.execute(f'''
+        CREATE TRIGGER low_stock_update AFTER UPDATE OF stock ON products
+        WHEN new.stock <= {LOW_STOCK_THRESHOLD} OR old.stock <= {LOW_STOCK_THRESHOLD} BEGIN
+            DELETE FROM low_stock WHERE product_id = old.id;
+            INSERT INTO low_stock (product_id, stock) SELECT new.id, new.stock WHERE new.stock <= {LOW_STOCK_THRESHOLD};
+        END
+    ''')
+    database.execute('''
+        CREATE TRIGGER low_stock_delete AFTER DELETE ON products BEGIN
+            DELETE FROM low_stock WHERE product_id = old.id;
+        END
+    ''')
+    for statement in LOW_STOCK_REBUILD:
+        database.execute(statement)
+
+def round_cart_totals(database: Database) -> None:
+    # Totals kept by the unrounded triggers carry float residue; the drift is
+    # far below a cent, so rounding them needs no products (which a shard
+    # being created by reshard cannot read)
+    database.execute('''
+        UPDATE cart_summaries SET total_price = ROUND(total_price, 2), version = version + 1
+        WHERE total_price IS NOT ROUND(total_price, 2)
+    ''')
+
+@migration(14, 'cart_summary_rounding')
+def cart_summary_rounding(database: Database) -> None:
+    for name in ('insert', 'update', 'delete', 'product_update'):
+        database.execute(f'DROP TRIGGER cart_summaries_{name}')
+    for statement in cart_summary_triggers():
+        database.execute(statement)
+    database.execute(f'''
+        CREATE TRIGGER cart_summaries_product_update AFTER UPDATE OF name, price ON products
+        WHEN new.name IS NOT old.name OR new.price IS NOT old.price BEGIN
+            UPDATE cart_summaries SET
+                total_price = ROUND(total_price + c.quantity * (new.price - old.price), 2),
+                items = {CART_ITEMS_JSON.format(user_id='c.user_id')},
+                version = version + 1
+            FROM carts c
+            WHERE c.product_id = new.id AND cart_summaries.user_id = c.user_id;
+        END
+    ''')
+    round_cart_totals(database)
+
+# Shards start from the tables of the users as they stand after migration 11.
+# Their ids use AUTOINCREMENT, so that reserve_id_blocks can give each shard a
+# range of its own.
+
+@migration(1, 'shard_tables', SHARD_MIGRATIONS)
+def shard_tables(database: Database) -> None:
+    database.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, password TEXT, email TEXT, role TEXT)')
+    database.execute('CREATE UNIQUE INDEX idx_users_username ON users (username)')
+    database.execute('CREATE UNIQUE INDEX idx_users_email ON users (email)')
+    database.execute('''
+        CREATE TABLE carts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, product_id INTEGER, quantity INTEGER
+        )
+    ''')
+    database.execute('CREATE UNIQUE INDEX idx_carts_user_product ON carts (user_id, product_id)')
+    database.execute('CREATE INDEX idx_carts_product ON carts (product_id)')
+    database.execute('''
+        CREATE TABLE cart_summaries (
+            user_id INTEGER PRIMARY KEY,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            total_price FLOAT NOT NULL DEFAULT 0,
+            items TEXT NOT NULL DEFAULT '[]',
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    database.execute('''
+        CREATE TABLE reservations (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, product_id)
+        )
+    ''')
+    database.execute('CREATE INDEX idx_reservations_product ON reservations (product_id, expires_at, quantity)')
+    database.execute('CREATE INDEX idx_reservations_expires ON reservations (expires_at)')
+    database.execute('''
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, order_date TEXT, status TEXT, total_price FLOAT
+        )
+    ''')
+    database.execute('CREATE INDEX idx_orders_user_date ON orders (user_id, order_date)')
+    database.execute('CREATE INDEX idx_orders_order_date ON orders (order_date)')
+    database.execute('''
+        CREATE TABLE order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT,
+            quantity INTEGER NOT NULL,
+            price FLOAT NOT NULL
+        )
+    ''')
+    database.execute('CREATE INDEX idx_order_items_order ON order_items (order_id)')
+    database.execute('CREATE INDEX idx_order_items_product ON order_items (product_id)')
+
+@migration(2, 'jobs', SHARD_MIGRATIONS)
+def shard_jobs(database: Database) -> None:
+    job_tables(database)
+    # Job ids continue in the block of the shard's orders, if it has one yet
+    database.execute('''
+        INSERT INTO main.sqlite_sequence (name, seq)
+        SELECT 'jobs', seq FROM main.sqlite_sequence
+        WHERE name = 'orders' AND NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = 'jobs')
+    ''')
+
+@migration(3, 'sales_rollups', SHARD_MIGRATIONS)
+def shard_sales_rollups(database: Database) -> None:
+    # Per shard; reports add up the rollups of every shard
+    sales_rollup_tables(database)
+
+@migration(4, 'cart_summary_rounding', SHARD_MIGRATIONS)
+def shard_cart_summary_rounding(database: Database) -> None:
+    # The cart triggers of shards are TEMP ones, created rounded on connect
+    round_cart_totals(database)
+
+ID_BLOCK = 1 << 40
+ID_TABLES = ('carts', 'orders', 'order_items', 'jobs')
+
+def reserve_id_blocks(databases: list[Database]) -> int:
+    """Make shard ``i`` of ``databases`` allocate ids from ``base + i * ID_BLOCK`` on.
+
+    ``base`` is above every id in use on any of them, and AUTOINCREMENT never
+    goes below its sqlite_sequence entry, so ids stay unique across shards even
+    after a reshard has moved rows (with their ids) from one to another.
+    """
+    top = max(database.q('SELECT COALESCE(MAX(seq), 0) AS seq FROM main.sqlite_sequence')[0]['seq']
+              for database in databases)
+    base = (top // ID_BLOCK + 1) * ID_BLOCK
+    for index, database in enumerate(databases):
+        database.execute('BEGIN IMMEDIATE')
+        try:
+            for table in ID_TABLES:
+                database.execute('DELETE FROM main.sqlite_sequence WHERE name = ?', (table,))
+                database.execute('INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)',
+                                 (table, base + index * ID_BLOCK))
+        except BaseException:
+            database.execute('ROLLBACK')
+            raise
+        database.execute('COMMIT')
+    return base
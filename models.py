@@ -1,13 +1,20 @@
+import json
 import os
-from dataclasses import dataclass
-from fastlite import database
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from urllib.parse import quote
+from fastlite import Database, flexiclass
 from enum import Enum
-from werkzeug.security import generate_password_hash
 from dotenv import load_dotenv
 
-load_dotenv()
+from connection import ConnectionPool, ShardedDatabase, ThreadLocalDatabase
+from migrations import SHARD_MIGRATIONS, cart_summary_triggers, migrate, reserve_id_blocks
+from hashing import password_hasher
+from metrics import record_query
 
-db = database('data/ecommerce.db')
+load_dotenv()
 
 @dataclass
 class User:
@@ -24,6 +31,7 @@ class Product:
     description: str
     price: float
     stock: int
+    updated_at: str
 
 @dataclass
 class Cart:
@@ -36,37 +44,191 @@ class Cart:
 class Order:
     id: int
     user_id: int
-    items: list
     order_date: str
     status: str
+    total_price: float
+
+@dataclass
+class OrderItem:
+    id: int
+    order_id: int
+    product_id: int
+    product_name: str
+    quantity: int
+    price: float
 
-# Create tables
-db.create(cls=User, name='users', pk='id', if_not_exists=True)
-db.create(cls=Product, name='products', pk='id', if_not_exists=True)
-db.create(cls=Cart, name='carts', pk='id', if_not_exists=True)
-db.create(cls=Order, name='orders', pk='id', if_not_exists=True)
+TABLES = {'users': User, 'products': Product, 'carts': Cart, 'orders': Order, 'order_items': OrderItem}
 
-import json
+# Allow building rows without an id (or any other column), as db.create did
+for cls in TABLES.values():
+    flexiclass(cls)
+
+def register_tables(database: Database) -> None:
+    # Let inserts on every pooled connection return dataclass instances
+    for name, cls in TABLES.items():
+        database.t[name].cls = cls
+
+def shard_setup(catalog_path: str):
+    """``on_connect`` of shard connections: attach the catalog and add the cart triggers."""
+    catalog_uri = 'file:{}?mode=ro'.format(quote(str(Path(catalog_path).resolve())))
+
+    def on_connect(database: Database) -> None:
+        register_tables(database)
+        # Read-only, so BEGIN IMMEDIATE on a shard does not also lock the
+        # catalog; unqualified names fall through to it, e.g. products
+        database.execute('ATTACH DATABASE ? AS catalog', (catalog_uri,))
+        # Connections opened before the shard was migrated get them from bootstrap
+        if database.q("SELECT 1 FROM main.sqlite_master WHERE name = 'carts'"):
+            for statement in cart_summary_triggers(temp=True):
+                database.execute(statement)
+    return on_connect
+
+def _shard_databases(catalog_path: str, shard_paths: list[str]) -> list[ThreadLocalDatabase]:
+    return [ThreadLocalDatabase(ConnectionPool.from_env(path=path, uri=True, on_connect=shard_setup(catalog_path)),
+                                on_query=record_query)
+            for path in shard_paths]
 
-def load_sample_products() -> None:
+def _shard_paths_from_env() -> list[str]:
+    return [path.strip() for path in os.getenv('SHARD_URLS', '').split(',') if path.strip()]
+
+# No connection is opened until the first query, so importing this module
+# (or forking a worker after importing it) holds no SQLite handle
+db = ShardedDatabase(ThreadLocalDatabase(ConnectionPool.from_env(on_connect=register_tables), on_query=record_query),
+                     _shard_databases(os.getenv('DATABASE_URL', 'data/ecommerce.db'), _shard_paths_from_env()))
+
+def configure_database(path: str, shard_paths: list[str] | None = None) -> None:
+    """Point ``db`` at other database files, before any connection is opened."""
+    shard_paths = _shard_paths_from_env() if shard_paths is None else list(shard_paths)
+    catalog_moved = path != db.catalog.pool.path
+    if catalog_moved:
+        db.catalog.pool.close()
+        db.catalog.pool = ConnectionPool.from_env(path=path, on_connect=register_tables)
+    # Shard connections attach the catalog, so they follow it
+    if catalog_moved or shard_paths != [shard.pool.path for shard in db.shards]:
+        for shard in db.shards:
+            shard.pool.close()
+        db.shards = _shard_databases(path, shard_paths)
+
+_undo = threading.local()
+
+@contextmanager
+def transaction(mode: str = 'IMMEDIATE', database: Database | None = None):
+    # The connection runs in autocommit mode, so transactions are explicit.
+    # IMMEDIATE takes the write lock up front, so concurrent writers wait on
+    # busy_timeout instead of failing half way through with SQLITE_BUSY.
+    database = db if database is None else database
+    database.execute(f'BEGIN {mode}')
+    stack = _undo.__dict__.setdefault('stack', [])
+    stack.append([])
+    try:
+        yield database
+        database.execute('COMMIT')
+    except BaseException:
+        if database.conn.in_transaction:
+            database.execute('ROLLBACK')
+        for callback in reversed(stack[-1]):
+            callback()
+        raise
+    finally:
+        stack.pop()
+
+def on_rollback(callback) -> None:
+    """Call ``callback`` if the innermost transaction of this thread rolls back.
+
+    For writes that cannot be part of it, such as the catalog's stock taken
+    by a checkout that runs in a shard's transaction.
+    """
+    _undo.stack[-1].append(callback)
+
+def load_sample_products(database: Database | None = None) -> None:
+    database = db.current() if database is None else database
     with open('data/sample_products.json') as f:
         products = json.load(f)
-        for product in products:
-            db.t.products.insert(Product(**product))
+    # One transaction and one executemany instead of a commit per row
+    with transaction(database=database):
+        database.conn.executemany(
+            'INSERT INTO products (id, name, description, price, stock) VALUES (:id, :name, :description, :price, :stock)',
+            products)
 
-def create_admin_user() -> None:
+def create_user(user: User, database: Database | None = None) -> User:
+    """Insert a user; when sharded, the id comes from the users directory.
+
+    The catalog's users table is the directory: it keeps the id, username,
+    email and role of every user, without the password, so uniqueness checks
+    and lookups by name need no fan-out. The full row goes to the user's shard.
+    """
+    database = db.catalog if database is None else database
+    if not db.sharded:
+        return database.t.users.insert(user)
+    entry = database.t.users.insert(User(**{**asdict(user), 'password': None}))
+    try:
+        with db.using(entry.id):
+            return db.t.users.insert(User(**{**asdict(user), 'id': entry.id}))
+    except BaseException:
+        database.execute('DELETE FROM users WHERE id = ?', (entry.id,))
+        raise
+
+def remove_user(username: str) -> bool:
+    """Delete a user by name, from its shard and from the directory."""
+    if not db.sharded:
+        return db.catalog.execute('DELETE FROM users WHERE username = ?', (username,)).rowcount > 0
+    entry = db.catalog.q('SELECT id FROM users WHERE username = ?', (username,))
+    if not entry:
+        return False
+    with db.using(entry[0]['id']):
+        db.execute('DELETE FROM users WHERE id = ?', (entry[0]['id'],))
+    db.catalog.execute('DELETE FROM users WHERE id = ?', (entry[0]['id'],))
+    return True
+
+def create_admin_user(database: Database | None = None) -> None:
     admin_user = User(
         id=None,  
         username=os.getenv('ADMIN_USERNAME', 'admin'),
-        password=generate_password_hash(os.getenv('ADMIN_PASSWORD', 'admin_password')),  
+        password=password_hasher.hash(os.getenv('ADMIN_PASSWORD', 'admin_password')),  
         email=os.getenv('ADMIN_EMAIL', 'admin@example.com'),
         role='admin'
     )
-    db.t.users.insert(admin_user)
+    create_user(admin_user, database)
+
+def migrate_shards(target: int | None = None) -> list[list[int]]:
+    """Apply the pending shard migrations to every shard; returns the versions applied to each."""
+    shards = [shard.current() for shard in db.shards]
+    done = [migrate(shard, target, SHARD_MIGRATIONS) for shard in shards]
+    for shard in shards:
+        for statement in cart_summary_triggers(temp=True):
+            shard.execute(statement)
+    # A new shard has no ids yet: start every shard in a new block of its own
+    if any(not shard.q("SELECT 1 FROM main.sqlite_sequence WHERE name = 'orders'") for shard in shards):
+        reserve_id_blocks(shards)
+    return done
+
+def bootstrap(database: Database | None = None) -> dict[str, list | bool]:
+    """Bring the schema of the catalog and shards up to date, then create the admin user and the sample catalog if missing."""
+    database = db.catalog.current() if database is None else database
+    report = {'migrations': migrate(database), 'admin_created': False, 'samples_loaded': False}
+    if db.sharded:
+        report['shard_migrations'] = migrate_shards()
+    if not database.q('SELECT 1 FROM users WHERE role = ? LIMIT 1', ('admin',)):
+        create_admin_user(database)
+        report['admin_created'] = True
+    if not database.q('SELECT 1 FROM products LIMIT 1'):
+        load_sample_products(database)
+        report['samples_loaded'] = True
+    return report
+
+_bootstrap_lock = threading.Lock()
+# The (catalog, shards) configurations already bootstrapped by this process
+_bootstrapped: set[tuple[str, tuple[str, ...]]] = set()
 
-# Call this function to create an admin user if it doesn't exist
-if not db.q('SELECT * FROM users WHERE role = ?', ('admin',)):
-    create_admin_user()
+def ensure_bootstrapped() -> None:
+    """Run ``bootstrap`` once per process and database configuration, on first use rather than at import."""
+    configuration = (db.catalog.pool.path, tuple(shard.pool.path for shard in db.shards))
+    if configuration in _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if configuration not in _bootstrapped:
+            bootstrap()
+            _bootstrapped.add(configuration)
 
 if __name__ == '__main__':
     print(db.t.users.columns)
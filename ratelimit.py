@@ -0,0 +1,141 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Protocol
+from flask import current_app, g, jsonify, request
+from tokens import current_user
+
+@dataclass(frozen=True)
+class RateLimit:
+    """``rate`` requests per second on average, with bursts of up to ``burst``.
+
+    ``by`` is 'ip' or 'user'; anonymous requests to a per-user limit are
+    keyed by IP instead.
+    """
+    rate: float
+    burst: int
+    by: str = 'ip'
+
+class BucketStore(Protocol):
+    def take(self, key: str, limit: RateLimit) -> float: ...
+
+class MemoryBucketStore:
+    """Token buckets in process memory, for a single worker.
+
+    ``take`` returns 0 when a token was available, else the seconds until one
+    will be. Buckets idle the longest are dropped beyond ``maxsize``; a
+    dropped bucket simply starts over full.
+    """
+
+    def __init__(self, maxsize: int = 100_000) -> None:
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: RateLimit) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through a Redis-compatible server.
+
+    The refill and take run as one Lua script, so concurrent workers cannot
+    both spend the last token.
+    """
+
+    SCRIPT = '''
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    '''
+
+    def __init__(self, client: Any, prefix: str = 'ecommerce:ratelimit:') -> None:
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key: str, limit: RateLimit) -> float:
+        return float(self.client.eval(self.SCRIPT, 1, self.prefix + key, limit.rate, limit.burst, time.time()))
+
+class RateLimiter:
+    """before_request hook applying per-endpoint token-bucket limits.
+
+    ``limits`` maps Flask endpoint names (the view function names) to their
+    limit; other endpoints get ``default``, or no limit if it is None. Limits
+    are skipped when testing unless ``RATELIMIT_ENABLED`` is set.
+    """
+
+    def __init__(self, store: BucketStore, limits: dict[str, RateLimit],
+                 default: RateLimit | None = None) -> None:
+        self.store = store
+        self.limits = limits
+        self.default = default
+
+    def _key(self, endpoint: str, limit: RateLimit) -> str:
+        if limit.by == 'user':
+            user = current_user()
+            if user is not None:
+                return f'{endpoint}:user:{user["id"]}'
+        return f'{endpoint}:ip:{request.remote_addr}'
+
+    def check(self):
+        if not current_app.config.get('RATELIMIT_ENABLED', not current_app.testing):
+            return None
+        limit = self.limits.get(request.endpoint, self.default)
+        if limit is None or request.endpoint is None:
+            return None
+        wait = self.store.take(self._key(request.endpoint, limit), limit)
+        if wait:
+            return jsonify({'error': 'Too Many Requests: rate limit exceeded'}), 429, \
+                {'Retry-After': str(math.ceil(wait))}
+        return None
+
+class ConcurrencyLimiter:
+    """Admission control: at most ``max_in_flight`` requests are served at once.
+
+    A request waits up to ``queue_timeout`` seconds for a slot, then gets a
+    503, so excess load is shed quickly instead of piling up in the server's
+    queues until every request times out.
+    """
+
+    def __init__(self, max_in_flight: int = 64, queue_timeout: float = 0.5) -> None:
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    @classmethod
+    def from_env(cls) -> 'ConcurrencyLimiter':
+        return cls(
+            max_in_flight=int(os.getenv('MAX_IN_FLIGHT', 64)),
+            queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.5)),
+        )
+
+    def admit(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            return jsonify({'error': 'Service Unavailable: server overloaded'}), 503, {'Retry-After': '1'}
+        g.admitted = True
+        return None
+
+    def release(self, exception: BaseException | None = None) -> None:
+        if g.pop('admitted', False):
+            self._slots.release()
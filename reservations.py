@@ -0,0 +1,167 @@
+"""Time-limited stock holds taken when products are put in a cart.
+
+A hold reserves the quantity of a cart line for ``RESERVATION_TTL`` seconds,
+and is refreshed whenever that line changes. Available stock is the stock
+minus the active holds of other carts, so an addition that cannot be served
+fails at once instead of at checkout. Holds live in their own table: taking
+one never writes the product row, which only changes when checkout converts
+the holds into a sale. Expired holds no longer count as soon as they expire;
+the sweeper just deletes them in batches.
+"""
+import logging
+import os
+import threading
+from models import db, on_rollback, transaction
+from migrations import UTC_NOW
+
+RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', 900))
+SWEEP_BATCH_SIZE = 1000
+
+log = logging.getLogger(__name__)
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id: int) -> None:
+        super().__init__(product_id)
+        self.product_id = product_id
+
+def _placeholders(values) -> str:
+    return ', '.join('?' * len(values))
+
+def hold(user_id: int, product_ids: list[int] | None = None) -> None:
+    """Make the user's holds match their cart lines, for ``product_ids`` or the whole cart.
+
+    Must run in the transaction that changed the cart; raises
+    ``InsufficientStock`` so that the change is rolled back.
+    """
+    def in_scope(column: str) -> str:
+        return f'AND {column} IN ({_placeholders(product_ids)})' if product_ids is not None else ''
+
+    if product_ids is not None:
+        product_ids = sorted(set(product_ids))
+    params = product_ids or []
+    db.execute(f'''
+        INSERT INTO reservations (user_id, product_id, quantity, expires_at)
+        SELECT user_id, product_id, quantity, strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)
+        FROM carts WHERE user_id = ? {in_scope('product_id')}
+        ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at
+    ''', [f'+{RESERVATION_TTL} seconds', user_id, *params])
+    db.execute(f'''
+        DELETE FROM reservations
+        WHERE user_id = ? {in_scope('product_id')} AND product_id NOT IN (SELECT product_id FROM carts WHERE user_id = ?)
+    ''', [user_id, *params, user_id])
+    rows = db.q(f'''
+        SELECT r.product_id, p.stock, (SELECT COALESCE(SUM(quantity), 0) FROM reservations
+                                       WHERE product_id = r.product_id AND expires_at > {UTC_NOW}) AS held
+        FROM reservations r JOIN products p ON p.id = r.product_id
+        WHERE r.user_id = ? {in_scope('r.product_id')}
+        ORDER BY r.product_id
+    ''', [user_id, *params])
+    # Users on other shards hold stock too; their holds are read, not locked
+    elsewhere = _held([row['product_id'] for row in rows], skip_bound=True)
+    for row in rows:
+        if row['stock'] < row['held'] + elsewhere.get(row['product_id'], 0):
+            raise InsufficientStock(row['product_id'])
+
+def _held(product_ids: list[int], skip_bound: bool = False) -> dict[int, int]:
+    """Active holds per product, summed over the shards (but the bound one with ``skip_bound``)."""
+    if not product_ids:
+        return {}
+    held = {}
+    results = db.fan_out(f'''
+        SELECT product_id, SUM(quantity) AS quantity FROM reservations
+        WHERE product_id IN ({_placeholders(product_ids)}) AND expires_at > {UTC_NOW}
+        GROUP BY product_id
+    ''', product_ids, skip_bound=skip_bound)
+    for rows in results.values():
+        for row in rows:
+            held[row['product_id']] = held.get(row['product_id'], 0) + row['quantity']
+    return held
+
+def release(user_id: int) -> None:
+    db.execute('DELETE FROM reservations WHERE user_id = ?', (user_id,))
+
+def convert(user_id: int) -> None:
+    """Turn the user's holds into a sale: one stock decrement for the whole cart.
+
+    Holds that expired in the meantime are taken again first, so checkout
+    only fails if the stock is really gone. The decrement is still guarded,
+    so no hold, however it was taken, can drive the stock negative.
+    """
+    hold(user_id)
+    lines = db.q('SELECT product_id, quantity FROM reservations WHERE user_id = ? ORDER BY product_id', (user_id,))
+    if db.sharded:
+        _take_stock(lines)
+    else:
+        taken = db.q('''
+            UPDATE products SET stock = stock - r.quantity
+            FROM reservations r
+            WHERE r.user_id = ? AND r.product_id = products.id AND products.stock >= r.quantity
+            RETURNING products.id
+        ''', (user_id,))
+        if len(taken) < len(lines):
+            taken = {row['id'] for row in taken}
+            raise InsufficientStock(next(line['product_id'] for line in lines if line['product_id'] not in taken))
+    release(user_id)
+
+def _take_stock(lines: list[dict]) -> None:
+    # A shard only reads the catalog, so the stock is taken by a catalog
+    # transaction of its own, given back if the shard's transaction rolls
+    # back. The guard keeps concurrent checkouts from other shards from
+    # overselling, whatever their holds said.
+    with transaction(database=db.catalog):
+        for line in lines:
+            taken = db.catalog.execute('UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?',
+                                       (line['quantity'], line['product_id'], line['quantity'])).rowcount
+            if not taken:
+                raise InsufficientStock(line['product_id'])
+    on_rollback(lambda: _give_back_stock(lines))
+
+def _give_back_stock(lines: list[dict]) -> None:
+    with transaction(database=db.catalog):
+        db.catalog.executemany('UPDATE products SET stock = stock + :quantity WHERE id = :product_id', lines)
+
+def available_stock(product_id: int) -> dict[str, int] | None:
+    rows = db.q('SELECT stock FROM products WHERE id = ?', (product_id,))
+    if not rows:
+        return None
+    reserved = _held([product_id]).get(product_id, 0)
+    return {'stock': rows[0]['stock'], 'reserved': reserved, 'available': max(0, rows[0]['stock'] - reserved)}
+
+def release_expired(batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Delete expired holds on every shard, one short write transaction per batch."""
+    released = 0
+    for shard in range(db.shard_count):
+        with db.using(shard=shard):
+            while True:
+                with transaction():
+                    deleted = db.execute(f'''
+                        DELETE FROM reservations WHERE rowid IN (
+                            SELECT rowid FROM reservations WHERE expires_at <= {UTC_NOW} LIMIT ?
+                        )
+                    ''', (batch_size,)).rowcount
+                released += deleted
+                if deleted < batch_size:
+                    break
+    return released
+
+class ReservationSweeper(threading.Thread):
+    """Daemon thread running ``release_expired`` every ``interval`` seconds."""
+
+    def __init__(self, interval: float) -> None:
+        super().__init__(name='reservation-sweeper', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                released = release_expired()
+                if released:
+                    log.info('Released %d expired stock holds', released)
+            except Exception:
+                log.exception('Releasing expired stock holds failed')
+            finally:
+                db.release()
+
+    def stop(self) -> None:
+        self._stopped.set()
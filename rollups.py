@@ -0,0 +1,56 @@
+"""Sales and inventory totals for reporting, maintained as orders are placed.
+
+``record_sale`` adds an order to the per-day, per-product-and-day and
+per-user totals in the transaction that places it, so a report reads a row
+per day, product or user and never the order history. When sharded, each
+shard keeps the totals of its own users' orders and reports add them up.
+Low stock is kept by triggers on products in the catalog (see migration 13),
+whichever write changed the stock. ``rebuild`` (``flask rebuild-reports``)
+recomputes everything from the orders and products. Revenue is rounded to
+cents by SQLite, per order or line and again after every addition, in both
+paths, so the running totals and a rebuild agree to the last digit.
+"""
+from fastlite import Database
+from migrations import LOW_STOCK_REBUILD, SALES_ROLLUPS_REBUILD
+from models import db, transaction
+
+def record_sale(user_id: int, order_date: str, total_price: float, items: list[dict]) -> None:
+    """Add an order to the totals; must run in the transaction that creates it."""
+    day, units = order_date[:10], sum(item['quantity'] for item in items)
+    db.execute('''
+        INSERT INTO sales_daily (day, orders, units, revenue) VALUES (?, 1, ?, ROUND(?, 2))
+        ON CONFLICT (day) DO UPDATE SET
+            orders = orders + 1, units = units + excluded.units, revenue = ROUND(revenue + excluded.revenue, 2)
+    ''', (day, units, total_price))
+    db.executemany('''
+        INSERT INTO product_sales_daily (product_id, day, units, revenue) VALUES (?, ?, ?, ROUND(?, 2))
+        ON CONFLICT (product_id, day) DO UPDATE SET
+            units = units + excluded.units, revenue = ROUND(revenue + excluded.revenue, 2)
+    ''', [(item['product_id'], day, item['quantity'], item['quantity'] * item['price']) for item in items])
+    db.execute('''
+        INSERT INTO user_sales (user_id, orders, units, revenue, first_order_at, last_order_at)
+        VALUES (?, 1, ?, ROUND(?, 2), ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            orders = orders + 1, units = units + excluded.units, revenue = ROUND(revenue + excluded.revenue, 2),
+            last_order_at = excluded.last_order_at
+    ''', (user_id, units, total_price, order_date, order_date))
+
+def rebuild_sales(database: Database) -> None:
+    """Recompute the sales totals of one database from its orders, in one transaction."""
+    with transaction(database=database):
+        for statement in SALES_ROLLUPS_REBUILD:
+            database.execute(statement)
+
+def rebuild() -> dict[str, int]:
+    """Recompute every rollup from scratch, e.g. after orders were changed by hand."""
+    for shard in range(db.shard_count):
+        rebuild_sales(db.shard(shard))
+    with transaction(database=db.catalog):
+        for statement in LOW_STOCK_REBUILD:
+            db.catalog.execute(statement)
+    days = set()
+    for rows in db.fan_out('SELECT day FROM sales_daily').values():
+        days.update(row['day'] for row in rows)
+    users = sum(rows[0]['n'] for rows in db.fan_out('SELECT COUNT(*) AS n FROM user_sales').values())
+    low_stock = db.catalog.q('SELECT COUNT(*) AS n FROM low_stock')[0]['n']
+    return {'days': len(days), 'users': users, 'low_stock': low_stock}
@@ -1 +1 @@
-from . import auth, products, cart
+from . import auth, products, cart, orders
@@ -0,0 +1,83 @@
+from itertools import groupby, islice
+from operator import itemgetter
+from urllib.parse import urlencode
+from flask import jsonify, request
+from jobs import dead_stats, queue_stats
+from models import db
+from routes.orders import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, _attach_items
+from sharding import merge_sorted
+from tokens import is_admin
+
+def list_orders() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        before = int(request.args['before']) if 'before' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Bad Request: limit and before must be numeric'}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'Bad Request: limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+    before_date = request.args.get('before_date')
+    if before is not None and before_date is None:
+        return jsonify({'error': 'Bad Request: before_date is required with before'}), 400
+
+    # Newest first across all users. The cursor carries the (order_date, id)
+    # key itself, as the order it names is on one shard only
+    where, values = [], []
+    if before is not None:
+        where.append('(order_date, id) < (?, ?)')
+        values.extend([before_date, before])
+    if 'status' in request.args:
+        where.append('status = ?')
+        values.append(request.args['status'])
+    # Each shard returns its own first page; the merge keeps the newest of all
+    results = db.fan_out(f'''
+        SELECT id, user_id, order_date, status, total_price FROM orders
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY order_date DESC, id DESC
+        LIMIT ?
+    ''', (*values, limit + 1))
+    page = list(islice(merge_sorted(results, key=itemgetter('order_date', 'id'), reverse=True), limit + 1))
+
+    # The items of each order are on the shard of its order
+    for shard, orders in groupby(sorted(page[:limit], key=itemgetter(0)), key=itemgetter(0)):
+        with db.using(shard=shard):
+            _attach_items([order for _, order in orders])
+    orders = [order for _, order in page]
+
+    response = jsonify(orders[:limit])
+    if len(orders) > limit:
+        last = orders[limit - 1]
+        response.headers['X-Next-Cursor'] = str(last['id'])
+        args = {**request.args.to_dict(), 'before': last['id'], 'before_date': last['order_date']}
+        response.headers['Link'] = '<{}>; rel="next"'.format(request.base_url + '?' + urlencode(args))
+    return response, 200
+
+def get_shard_stats() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    # Row counts per shard, e.g. to check the balance after a reshard
+    results = db.fan_out('''
+        SELECT (SELECT COUNT(*) FROM users) AS users, (SELECT COUNT(*) FROM carts) AS cart_lines,
+               (SELECT COUNT(*) FROM orders) AS orders
+    ''')
+    shards = [{'shard': index, 'path': db.shard(index).pool.path, **rows[0]} for index, rows in results.items()]
+    return jsonify({'sharded': db.sharded, 'shards': shards}), 200
+
+RECENT_DEAD_JOBS = 20
+
+def get_job_stats() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    # Depth of each shard's queue, and the latest dead letters of all of them
+    queued, dead = queue_stats(), dead_stats()
+    queues = [{'shard': index, 'jobs': queued[index], 'dead': dead[index]} for index in range(db.shard_count)]
+    results = db.fan_out('''
+        SELECT id, kind, payload, user_id, attempts, last_error, created_at, failed_at FROM dead_jobs
+        ORDER BY failed_at DESC, id DESC
+        LIMIT ?
+    ''', (RECENT_DEAD_JOBS,))
+    recent = [job for _, job in islice(merge_sorted(results, key=itemgetter('failed_at', 'id'), reverse=True),
+                                       RECENT_DEAD_JOBS)]
+    return jsonify({'queues': queues, 'recent_dead': recent}), 200
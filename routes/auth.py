@@ -1,6 +1,7 @@
-from flask import request, jsonify, session
-from models import db, User
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import g, request, jsonify, session
+from models import create_user, db, remove_user, User
+from hashing import password_hasher
+from tokens import current_user, token_signer
 
 def register() -> dict[str, str]:
     data = request.json
@@ -11,53 +12,64 @@ def register() -> dict[str, str]:
     if existing_user:
         return jsonify({'error': 'Conflict: username or email already exists'}), 409
     
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = password_hasher.hash(data['password'])
     role = 'admin' if data.get('is_admin') else 'user'
     user = User(username=data['username'], password=hashed_password, email=data['email'], role=role)
-    db.t.users.insert(user)
+    create_user(user)
     return jsonify({'message': 'User registered successfully'}), 201
 
 def login() -> dict[str, str]:
     data = request.json
     user = db.q('SELECT * FROM users WHERE username = ?', (data['username'],))
-    if user and check_password_hash(user[0]['password'], data['password']):
+    if user and password_hasher.verify(user[0]['password'], data['password']):
+        # Upgrade hashes made with older parameters while the password is at hand
+        if password_hasher.needs_rehash(user[0]['password']):
+            db.execute('UPDATE users SET password = ? WHERE id = ?',
+                       (password_hasher.hash(data['password']), user[0]['id']))
         session['username'] = user[0]['username']
         session['role'] = user[0]['role'] 
-        return jsonify({'message': 'Login successful', 'role': user[0]['role'], 'id': user[0]['id']}), 200
+        session['user_id'] = user[0]['id']
+        # Stateless alternative to the cookie for API clients
+        token = token_signer.issue(user[0]['id'], user[0]['username'], user[0]['role'])
+        return jsonify({'message': 'Login successful', 'role': user[0]['role'], 'id': user[0]['id'],
+                        'token': token, 'expires_in': token_signer.ttl}), 200
     return jsonify({'error': 'Unauthorized'}), 401
 
 def logout() -> dict[str, str]:
+    if g.get('token_claims'):
+        token_signer.revoke(g.token_claims)
+        return jsonify({'message': 'Logged out successfully'}), 200
     if 'username' in session:
         session.pop('username', None)
         session.pop('role', None)  # Clear role from session
+        session.pop('user_id', None)
         return jsonify({'message': 'Logged out successfully'}), 200
     else:
         return jsonify({'message': 'No user is currently logged in'}), 400
 
 def delete_user(username: str) -> dict[str, str]:
-    if 'username' not in session:
+    user = current_user()
+    if user is None:
         return jsonify({'error': 'Unauthorized: User not logged in'}), 401
 
-    if username == session['username']:
-        delete_own_account()
-        return jsonify({'message': 'User account deleted successfully'}), 200
+    if username == user['username']:
+        return delete_own_account()
 
-    elif 'role' in session and session['role'] == 'admin':
-        result = db.execute('DELETE FROM users WHERE username = ?', (username,))
-        if result.rowcount > 0:
+    elif user['role'] == 'admin':
+        if remove_user(username):
             return jsonify({'message': 'User deleted successfully'}), 200
         else:
             return jsonify({'error': 'User not found'}), 404
     return jsonify({'error': 'Unauthorized: Admins only'}), 403
 
 def delete_own_account() -> dict[str, str]:
-    if 'username' not in session:
+    user = current_user()
+    if user is None:
         return jsonify({'error': 'Unauthorized: User not logged in'}), 401
 
-    username = session['username']
-    result = db.execute('DELETE FROM users WHERE username = ?', (username,))
-    
-    if result.rowcount > 0:
+    if remove_user(user['username']):
+        if g.get('token_claims'):
+            token_signer.revoke(g.token_claims)
         session.pop('username', None)  # Clear session
         return jsonify({'message': 'User account deleted successfully'}), 200
     else:
@@ -1,60 +1,168 @@
+import json
+from itertools import groupby
+from operator import itemgetter
 from flask import request, jsonify
-from models import db, Cart, Product, Order
+from models import db, transaction
+from etags import PRIVATE_CACHE_CONTROL, bump_versions, make_etag, not_modified, tag
+from responses import raw_json
+from tokens import require_user
+from reservations import InsufficientStock, convert, hold, release
+from jobs import enqueue
+from rollups import record_sale
 from werkzeug.exceptions import BadRequest
 from datetime import datetime
 
 def add_to_cart() -> dict[str, str | dict[str, str | int]]:
     data = request.json
-    existing_item = db.q('SELECT * FROM carts WHERE user_id = ? AND product_id = ?', 
-                         (data['user_id'], data['product_id']))
-    
-    if existing_item:
-        new_quantity = existing_item[0]['quantity'] + data['quantity']
-        db.execute('UPDATE carts SET quantity = ? WHERE user_id = ? AND product_id = ?', 
-                   (new_quantity, data['user_id'], data['product_id']))
-        return jsonify({'message': 'Item quantity updated in cart'}), 200
-    else:
-        cart_item = Cart(user_id=data['user_id'], product_id=data['product_id'], quantity=data['quantity'])
-        added_cart_item = db.t.carts.insert(cart_item)
-        return jsonify({'message': 'Item added to cart', 'item': added_cart_item}), 201
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Bad Request: body must be an object'}), 400
+    # bool is a subclass of int, but true is not an id or a quantity
+    if not all(isinstance(data.get(key), int) and not isinstance(data[key], bool)
+               for key in ('user_id', 'product_id', 'quantity')):
+        return jsonify({'error': 'Bad Request: user_id, product_id and quantity must be integers'}), 400
+    if data['quantity'] <= 0:
+        return jsonify({'error': 'Bad Request: quantity must be positive'}), 400
+    denied = require_user(data['user_id'])
+    if denied:
+        return denied
+    try:
+        with transaction():
+            if not db.q('SELECT 1 FROM products WHERE id = ?', (data['product_id'],)):
+                return jsonify({'error': 'Product not found: {}'.format(data['product_id'])}), 404
+            # The unique (user_id, product_id) index decides between insert and update
+            added_cart_item = db.q('''
+                INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, product_id) DO NOTHING
+                RETURNING id, user_id, product_id, quantity
+            ''', (data['user_id'], data['product_id'], data['quantity']))
+            if not added_cart_item:
+                db.execute('UPDATE carts SET quantity = quantity + ? WHERE user_id = ? AND product_id = ?',
+                           (data['quantity'], data['user_id'], data['product_id']))
+            # Hold the stock now, so an unavailable product fails here and not at checkout
+            hold(data['user_id'], [data['product_id']])
+    except InsufficientStock as e:
+        return jsonify({'error': 'Conflict: insufficient stock for product ID: {}'.format(e.product_id)}), 409
+
+    if added_cart_item:
+        return jsonify({'message': 'Item added to cart', 'item': added_cart_item[0]}), 201
+    return jsonify({'message': 'Item quantity updated in cart'}), 200
+
+CART_OPERATIONS = {
+    'add': '''
+        INSERT INTO carts (user_id, product_id, quantity) VALUES (:user_id, :product_id, :quantity)
+        ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    ''',
+    'set': '''
+        INSERT INTO carts (user_id, product_id, quantity) VALUES (:user_id, :product_id, :quantity)
+        ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = excluded.quantity
+    ''',
+    'remove': 'DELETE FROM carts WHERE user_id = :user_id AND product_id = :product_id',
+}
+
+def _parse_cart_operations(data: dict) -> tuple[list[dict], str | None]:
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return [], 'Bad Request: items must be a non-empty list'
+    operations = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            return [], f'Bad Request: item {index}: must be an object'
+        op = item.get('op', 'add')
+        product_id, quantity = item.get('product_id'), item.get('quantity', 0)
+        if op not in CART_OPERATIONS:
+            return [], f'Bad Request: item {index}: op must be one of add, set, remove'
+        # bool is a subclass of int, but true is not a product id
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in (product_id, quantity)):
+            return [], f'Bad Request: item {index}: product_id and quantity must be integers'
+        if quantity < 0 or (op == 'add' and quantity == 0):
+            return [], f'Bad Request: item {index}: invalid quantity'
+        # Setting a quantity of zero removes the item
+        if op == 'set' and quantity == 0:
+            op = 'remove'
+        operations.append({'op': op, 'user_id': data['user_id'], 'product_id': product_id, 'quantity': quantity})
+    return operations, None
+
+def batch_update_cart() -> dict[str, list | float]:
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Bad Request: body must be an object'}), 400
+    if not isinstance(data.get('user_id'), int) or isinstance(data['user_id'], bool):
+        return jsonify({'error': 'Bad Request: user_id must be an integer'}), 400
+    denied = require_user(data['user_id'])
+    if denied:
+        return denied
+    operations, error = _parse_cart_operations(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    product_ids = {operation['product_id'] for operation in operations}
+    try:
+        with transaction():
+            existing = db.q(f'SELECT id FROM products WHERE id IN ({", ".join("?" * len(product_ids))})',
+                            list(product_ids))
+            missing = product_ids - {row['id'] for row in existing}
+            if missing:
+                return jsonify({'error': 'Product not found: {}'.format(', '.join(map(str, sorted(missing))))}), 404
+
+            # Consecutive operations of the same kind share one executemany; the
+            # order of the request is preserved
+            for op, group in groupby(operations, key=itemgetter('op')):
+                db.executemany(CART_OPERATIONS[op], list(group))
+            hold(data['user_id'], list(product_ids))
+            cart = load_cart(data['user_id'])
+            cart.pop('version')
+    except InsufficientStock as e:
+        return jsonify({'error': 'Conflict: insufficient stock for product ID: {}'.format(e.product_id)}), 409
+
+    return jsonify(cart), 200
+
+CART_ITEMS_QUERY = '''
+    SELECT c.id, c.user_id, c.product_id, c.quantity, p.name AS product_name, p.price
+    FROM carts c
+    JOIN products p ON c.product_id = p.id
+    WHERE c.user_id = ?
+'''
+
+def load_cart(user_id: int) -> dict[str, list | int | float]:
+    """The user's cart as native data, read from its precomputed summary row.
+
+    The row is kept current by triggers on carts and products (see the
+    cart_summaries migration); ``version`` changes with every change to it.
+    """
+    summary = db.q('SELECT item_count, total_price, items, version FROM cart_summaries WHERE user_id = ?',
+                   (user_id,))
+    if not summary:
+        return {'items': [], 'item_count': 0, 'total_price': 0, 'version': 0}
+    return {**summary[0], 'items': json.loads(summary[0]['items'])}
 
 def get_cart(user_id: int) -> dict[str, list | float]:
-    # Fetch cart items for the user
-    cart_items = db.q('''
-        SELECT c.id, c.user_id, c.product_id, c.quantity, p.name AS product_name, p.price
-        FROM carts c
-        JOIN products p ON c.product_id = p.id
-        WHERE c.user_id = ?
+    denied = require_user(user_id)
+    if denied:
+        return denied
+    # SQLite builds the body from the summary row, so the items JSON is sent
+    # as stored instead of being parsed and serialized again
+    summary = db.q('''
+        SELECT version, item_count, json_object('items', json(items), 'item_count', item_count,
+                                                'total_price', total_price) AS body
+        FROM cart_summaries WHERE user_id = ?
     ''', (user_id,))
-    if not cart_items:
-        return jsonify({'message': 'Cart is empty', 'items': []}), 200
-
-    # Calculate total price
-    total_price = sum(item['price'] * item['quantity'] for item in cart_items)
-
-    # Format the response
-    formatted_items = [
-        {
-            'id': item['id'],
-            'product_id': item['product_id'],
-            'product_name': item['product_name'],
-            'quantity': item['quantity'],
-            'price': item['price'],
-            'subtotal': item['price'] * item['quantity']
-        }
-        for item in cart_items
-    ]
-
-    response = {
-        'items': formatted_items,
-        'total_price': total_price
-    }
-
-    return jsonify(response), 200
+    etag = make_etag('cart', user_id, summary[0]['version'] if summary else 0)
+    cached = not_modified(etag, PRIVATE_CACHE_CONTROL)
+    if cached:
+        return cached
+
+    if not summary or not summary[0]['item_count']:
+        return tag(jsonify({'message': 'Cart is empty', 'items': []}), etag, PRIVATE_CACHE_CONTROL), 200
+    return tag(raw_json(summary[0]['body']), etag, PRIVATE_CACHE_CONTROL), 200
 
 def delete_cart(user_id: int) -> dict[str, str]:
+    denied = require_user(user_id)
+    if denied:
+        return denied
     # Delete all cart items for the user
-    result = db.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+    with transaction():
+        result = db.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+        release(user_id)
     
     if result.rowcount > 0:
         return jsonify({'message': 'Cart deleted successfully'}), 200
@@ -62,32 +170,41 @@ def delete_cart(user_id: int) -> dict[str, str]:
         return jsonify({'message': 'Cart is already empty'}), 200
 
 def place_order(user_id: int) -> dict[str, str | int]:
-    response = get_cart(user_id)
-    if response[0].status_code != 200:
-        return response
-    
-    # Check if the cart is empty
-    cart_items = response[0].get_json()['items']
-    if not cart_items:
-        return jsonify({'error': 'Cart is empty, cannot place order'}), 400
-
-    # Create an order for the user
-    total_price = response[0].get_json()['total_price']
-    for item in cart_items:
-        # Check stock before updating
-        check_stock = db.q("SELECT stock FROM products WHERE id = ?", (item['product_id'],))
-        if not check_stock or check_stock[0]['stock'] < item['quantity']:
-            return jsonify({'error': 'Insufficient stock for product ID: {}'.format(item['product_id'])}), 400
-        
-        # Update stock
-        db.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (item['quantity'], item['product_id']))
-        product_response = db.q("SELECT stock FROM products WHERE id = ?", (item['product_id'],))
-
-    order_date = datetime.now().isoformat()
-    order = Order(user_id=user_id, items=cart_items, order_date=order_date, status='Pending')
-    new_order = db.t.orders.insert(order)
-
-    # Clear the cart after placing the order
-    delete_cart(user_id)
-
-    return jsonify({'message': 'Order placed successfully', 'order_id': new_order.id}), 201
+    denied = require_user(user_id)
+    if denied:
+        return denied
+    # Reading the cart, converting its stock holds, creating the order and
+    # clearing the cart happen in one write transaction, so a shortfall on any
+    # item leaves every row untouched and concurrent checkouts cannot oversell
+    try:
+        with transaction():
+            cart_items = db.q(CART_ITEMS_QUERY, (user_id,))
+            if not cart_items:
+                return jsonify({'error': 'Cart is empty, cannot place order'}), 400
+
+            # Re-validates the holds under the write lock and decrements the
+            # stock of every line in one statement
+            convert(user_id)
+
+            total_price = sum(item['price'] * item['quantity'] for item in cart_items)
+            order_date = datetime.now().isoformat()
+            order_id = db.execute(
+                'INSERT INTO orders (user_id, order_date, status, total_price) VALUES (?, ?, ?, ?)',
+                (user_id, order_date, 'Pending', total_price)).lastrowid
+            db.executemany(
+                'INSERT INTO order_items (order_id, product_id, product_name, quantity, price) VALUES (?, ?, ?, ?, ?)',
+                [(order_id, item['product_id'], item['product_name'], item['quantity'], item['price'])
+                 for item in cart_items])
+            record_sale(user_id, order_date, total_price, cart_items)
+
+            # Clear the cart after placing the order
+            db.execute('DELETE FROM carts WHERE user_id = ?', (user_id,))
+            bump_versions('products',
+                          *(f"product:{item['product_id']}" for item in cart_items))
+            # The rest of the order's processing is done by the job worker;
+            # the job commits with the order or not at all
+            enqueue('order.placed', {'order_id': order_id}, user_id=user_id)
+    except InsufficientStock as e:
+        return jsonify({'error': 'Insufficient stock for product ID: {}'.format(e.product_id)}), 400
+
+    return jsonify({'message': 'Order placed successfully', 'order_id': order_id}), 201
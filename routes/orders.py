@@ -0,0 +1,69 @@
+from itertools import groupby
+from operator import itemgetter
+from flask import jsonify, request
+from models import db
+from tokens import require_user
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+ORDER_ITEMS_QUERY = '''
+    SELECT order_id, product_id, product_name, quantity, price, quantity * price AS subtotal
+    FROM order_items
+    WHERE order_id IN ({})
+    ORDER BY order_id, id
+'''
+
+def _attach_items(orders: list[dict]) -> list[dict]:
+    # One query for the items of the whole page instead of one per order
+    if not orders:
+        return orders
+    rows = db.q(ORDER_ITEMS_QUERY.format(', '.join('?' * len(orders))), [order['id'] for order in orders])
+    items = {order_id: list(group) for order_id, group in groupby(rows, key=itemgetter('order_id'))}
+    for order in orders:
+        order['items'] = [
+            {key: value for key, value in item.items() if key != 'order_id'}
+            for item in items.get(order['id'], [])
+        ]
+    return orders
+
+def get_orders(user_id: int) -> dict[str, list]:
+    denied = require_user(user_id)
+    if denied:
+        return denied
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        before = int(request.args['before']) if 'before' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Bad Request: limit and before must be numeric'}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'Bad Request: limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+    # Newest first. The cursor is the id of the last order of the previous
+    # page; its (order_date, id) is the key, so every page is a range scan of
+    # idx_orders_user_date
+    where, values = 'user_id = ?', [user_id]
+    if before is not None:
+        where += ' AND (order_date, id) < (SELECT order_date, id FROM orders WHERE id = ?)'
+        values.append(before)
+    orders = db.q(f'''
+        SELECT id, user_id, order_date, status, total_price FROM orders
+        WHERE {where}
+        ORDER BY order_date DESC, id DESC
+        LIMIT ?
+    ''', (*values, limit + 1))
+
+    response = jsonify(_attach_items(orders[:limit]))
+    if len(orders) > limit:
+        response.headers['X-Next-Cursor'] = str(orders[limit - 1]['id'])
+    return response, 200
+
+def get_order(user_id: int, order_id: int) -> dict[str, str | list]:
+    denied = require_user(user_id)
+    if denied:
+        return denied
+    order = db.q('SELECT id, user_id, order_date, status, total_price FROM orders WHERE id = ? AND user_id = ?',
+                 (order_id, user_id))
+    if not order:
+        return jsonify({'error': 'Order not found'}), 404
+    return jsonify(_attach_items(order)[0]), 200
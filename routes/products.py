@@ -1,19 +1,211 @@
-from flask import jsonify, request, session
-from models import db, Product
+import re
+import zlib
+from urllib.parse import urlencode
+from flask import Response, jsonify, request
+from models import db, transaction, Product
+from cache import product_cache
+from catalog import catalog, prefix_upper_bound
+from bulk import DEFAULT_BATCH_SIZE, iter_records, upsert_products
+from tokens import is_admin
+from reservations import available_stock
+from sharding import sync_product_carts
+from etags import CATALOG_CACHE_CONTROL, get_versions, bump_versions, make_etag, not_modified, tag
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'stock', 'updated_at')
+EXPORT_FETCH_SIZE = 1000
+SORT_ORDERS = {'id': 'id', 'price': 'price, id', '-price': 'price DESC, id'}
+
+def _parse_listing_args() -> tuple[dict, str | None]:
+    args = request.args
+    params = {}
+    try:
+        params['limit'] = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        params['after'] = int(args.get('after', 0))
+        params['after_price'] = float(args['after_price']) if 'after_price' in args else None
+        params['min_price'] = float(args['min_price']) if 'min_price' in args else None
+        params['max_price'] = float(args['max_price']) if 'max_price' in args else None
+    except ValueError:
+        return params, 'Bad Request: limit, after, after_price, min_price and max_price must be numeric'
+    if not 1 <= params['limit'] <= MAX_PAGE_SIZE:
+        return params, f'Bad Request: limit must be between 1 and {MAX_PAGE_SIZE}'
+
+    params['sort'] = args.get('sort', 'id')
+    if params['sort'] not in SORT_ORDERS:
+        return params, 'Bad Request: sort must be one of: {}'.format(', '.join(SORT_ORDERS))
+    if params['sort'] != 'id' and params['after'] and params['after_price'] is None:
+        return params, 'Bad Request: after_price is required to page a listing sorted by price'
+
+    params['in_stock'] = args.get('in_stock', '').lower() in ('1', 'true', 'yes')
+    params['name_prefix'] = args.get('name_prefix') or None
+
+    fields = [f for f in args.get('fields', '').split(',') if f]
+    unknown = set(fields) - set(PRODUCT_FIELDS)
+    if unknown:
+        return params, 'Bad Request: unknown fields: {}'.format(', '.join(sorted(unknown)))
+    # The cursor is built from the id (and the price, when sorted by it), so
+    # they are always part of the projection
+    cursor_fields = ['id'] if params['sort'] == 'id' else ['id', 'price']
+    params['fields'] = cursor_fields + [f for f in fields or PRODUCT_FIELDS if f not in cursor_fields]
+    return params, None
 
 def get_products() -> dict[str, str]:
-    products = db.q('SELECT * FROM products')
-    return jsonify(products), 200
+    params, error = _parse_listing_args()
+    if error:
+        return jsonify({'error': error}), 400
+
+    # The version is read before the body, so a tag can never claim newer data than it covers
+    version, = get_versions('products')
+    etag = make_etag('products', version)
+    cached = not_modified(etag, CATALOG_CACHE_CONTROL)
+    if cached:
+        return cached
+
+    # Fetch one extra row to know whether there is a next page
+    if catalog is not None:
+        loader = lambda: catalog.list_products(params, version)
+    else:
+        loader = lambda: _query_listing(params)
+    products = product_cache.get_listing(params, version, loader)
+
+    response = jsonify(products[:params['limit']])
+    if len(products) > params['limit']:
+        last = products[params['limit'] - 1]
+        response.headers['X-Next-Cursor'] = str(last['id'])
+        response.headers['Link'] = '<{}>; rel="next"'.format(_page_url(last, params['sort']))
+    return tag(response, etag, CATALOG_CACHE_CONTROL), 200
+
+def _query_listing(params: dict) -> list[dict]:
+    # Keyset pagination: every page is a range scan on the primary key (or on
+    # one of the products indexes when a filter is selective enough)
+    where, values = [], []
+    if params['sort'] == 'id':
+        where.append('id > ?')
+        values.append(params['after'])
+    elif params['after']:
+        # Past the last row of the previous page in (price, id) order
+        where.append('(price {} ? OR (price = ? AND id > ?))'.format('>' if params['sort'] == 'price' else '<'))
+        values.extend([params['after_price'], params['after_price'], params['after']])
+    if params['min_price'] is not None:
+        where.append('price >= ?')
+        values.append(params['min_price'])
+    if params['max_price'] is not None:
+        where.append('price <= ?')
+        values.append(params['max_price'])
+    if params['in_stock']:
+        # Must match the predicate of the partial index idx_products_in_stock
+        where.append('stock > 0')
+    if params['name_prefix']:
+        # A half-open range instead of LIKE so that idx_products_name is usable
+        upper = prefix_upper_bound(params['name_prefix'])
+        where.append('name >= ?' if upper is None else 'name >= ? AND name < ?')
+        values.extend([params['name_prefix']] if upper is None else [params['name_prefix'], upper])
+
+    return db.q(f'''
+        SELECT {', '.join(params['fields'])} FROM products
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY {SORT_ORDERS[params['sort']]}
+        LIMIT ?
+    ''', (*values, params['limit'] + 1))
+
+def _page_url(last: dict, sort: str) -> str:
+    args = request.args.to_dict()
+    args['after'] = last['id']
+    if sort != 'id':
+        args['after_price'] = last['price']
+    return request.base_url + '?' + urlencode(args)
+
+def search_products() -> dict[str, str]:
+    terms = re.findall(r'\w+', request.args.get('q', ''))
+    if not terms:
+        return jsonify({'error': 'Bad Request: missing search query'}), 400
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'Bad Request: limit and offset must be numeric'}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'Bad Request: limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+    if offset < 0:
+        return jsonify({'error': 'Bad Request: offset must be non-negative'}), 400
+
+    # Every term is quoted (so FTS5 operators in the input are inert) and
+    # prefix-matched; matches in the name weigh more than in the description
+    match = ' '.join(f'"{term}"*' for term in terms)
+    products = db.q('''
+        SELECT p.id, p.name, p.description, p.price, p.stock
+        FROM products_fts
+        JOIN products p ON p.id = products_fts.rowid
+        WHERE products_fts MATCH ?
+        ORDER BY bm25(products_fts, 10.0, 1.0)
+        LIMIT ? OFFSET ?
+    ''', (match, limit + 1, offset))
+
+    response = jsonify(products[:limit])
+    if len(products) > limit:
+        response.headers['X-Next-Offset'] = str(offset + limit)
+    return response, 200
+
+def export_products() -> Response:
+    # To resume, pass the last updated_at received as since: rows written in
+    # that same millisecond may have been committed after it was read, so
+    # they are sent again (>=) and the client upserts them by id
+    since = request.args.get('since')
+    where, values = ('WHERE updated_at >= ?', (since,)) if since else ('', ())
+    gzip = request.accept_encodings['gzip'] > 0
+
+    def generate():
+        # A connection of its own, held only while the body is streamed; the
+        # cursor steps through the rows in batches instead of loading them all
+        database = db.pool.acquire()
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+        try:
+            # SQLite serializes each row itself, so no per-row dict is built
+            cursor = database.execute(f'''
+                SELECT json_object('id', id, 'name', name, 'description', description, 'price', price,
+                                   'stock', stock, 'updated_at', updated_at)
+                FROM products
+                {where}
+                ORDER BY updated_at, id
+            ''', values)
+            while rows := cursor.fetchmany(EXPORT_FETCH_SIZE):
+                chunk = ''.join(row[0] + '\n' for row in rows).encode()
+                yield compressor.compress(chunk) if compressor else chunk
+            if compressor:
+                yield compressor.flush()
+        finally:
+            db.pool.release(database)
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 def get_product_by_id(product_id: int) -> dict[str, str | dict[str, str | int | float]]:
-    product = db.q('SELECT * FROM products WHERE id = ?', (product_id,))
+    version, = get_versions(f'product:{product_id}')
+    etag = make_etag('product', product_id, version)
+    cached = not_modified(etag, CATALOG_CACHE_CONTROL)
+    if cached:
+        return cached
+
+    product = product_cache.get_product(
+        product_id, version, lambda: db.q('SELECT * FROM products WHERE id = ?', (product_id,)))
     if product:
-        return jsonify(product), 200
+        return tag(jsonify(product), etag, CATALOG_CACHE_CONTROL), 200
     else:
         return jsonify({'error': 'Product not found'}), 404
 
+def get_product_availability(product_id: int) -> dict[str, int]:
+    # Never cached: holds come and go with every cart change
+    availability = available_stock(product_id)
+    if availability is None:
+        return jsonify({'error': 'Product not found'}), 404
+    return jsonify(availability), 200
+
 def add_product() -> dict[str, str]:
-    if 'role' not in session or session['role'] != 'admin':
+    if not is_admin():
         return jsonify({'error': 'Unauthorized: Admins only'}), 403
 
     data = request.json
@@ -23,30 +215,66 @@ def add_product() -> dict[str, str]:
         price=data['price'],
         stock=data['stock']
     )
-    new_row = db.t.products.insert(new_product)
+    with transaction():
+        new_row = db.t.products.insert(new_product)
+        bump_versions('products', f'product:{new_row.id}')
 
     return jsonify({'message': 'Product added successfully', 'product': new_row}), 201
 
+MAX_BATCH_SIZE = 50000
+
+def bulk_upsert_products() -> dict[str, int | list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+
+    try:
+        batch_size = int(request.args.get('batch_size', DEFAULT_BATCH_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Bad Request: batch_size must be numeric'}), 400
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        return jsonify({'error': f'Bad Request: batch_size must be between 1 and {MAX_BATCH_SIZE}'}), 400
+
+    # NDJSON unless the body is declared as CSV; the body is read as a stream
+    fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    report = upsert_products(iter_records(request.stream, fmt), batch_size)
+    return jsonify(report), 200
+
 def update_product(product_id: int) -> dict[str, str]:
-    if 'role' not in session or session['role'] != 'admin':
+    if not is_admin():
         return jsonify({'error': 'Unauthorized: Admins only'}), 403
 
     data = request.json
-    result = db.execute('UPDATE products SET name = ?, description = ?, price = ?, stock = ? WHERE id = ?',
-                        (data['name'], data['description'], data['price'], data['stock'], product_id))
+    with transaction():
+        result = db.execute('UPDATE products SET name = ?, description = ?, price = ?, stock = ? WHERE id = ?',
+                            (data['name'], data['description'], data['price'], data['stock'], product_id))
+        bump_versions('products', f'product:{product_id}')
     
     if result.rowcount > 0:
+        sync_product_carts([product_id])
         return jsonify({'message': 'Product updated successfully'}), 200
     else:
         return jsonify({'error': 'Product not found'}), 404
 
 def delete_product(product_id: int) -> dict[str, str]:
-    if 'role' not in session or session['role'] != 'admin':
+    if not is_admin():
         return jsonify({'error': 'Unauthorized: Admins only'}), 403
 
-    result = db.execute('DELETE FROM products WHERE id = ?', (product_id,))
+    # While the product still has its price, which the cart totals need
+    sync_product_carts([product_id], deleted=True)
+    with transaction():
+        result = db.execute('DELETE FROM products WHERE id = ?', (product_id,))
+        bump_versions('products', f'product:{product_id}')
     
     if result.rowcount > 0:
         return jsonify({'message': 'Product deleted successfully'}), 200
     else:
         return jsonify({'error': 'Product not found'}), 404
+
+def get_cache_stats() -> dict[str, int]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+
+    stats = product_cache.stats()
+    if catalog is not None:
+        stats['catalog'] = catalog.stats()
+    return jsonify(stats), 200
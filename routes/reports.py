@@ -0,0 +1,138 @@
+from datetime import date, timedelta
+from itertools import islice
+from operator import itemgetter
+from flask import jsonify, request
+from migrations import LOW_STOCK_THRESHOLD
+from models import db
+from sharding import merge_sorted
+from tokens import is_admin
+
+DEFAULT_REPORT_DAYS = 30
+MAX_REPORT_DAYS = 366
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+# Every report reads the rollups of rollups.py, summed over the shards
+
+def _parse_range() -> tuple[tuple[str, str] | None, str | None]:
+    try:
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else date.today()
+        start = (date.fromisoformat(request.args['from']) if 'from' in request.args
+                 else end - timedelta(days=DEFAULT_REPORT_DAYS - 1))
+    except ValueError:
+        return None, 'Bad Request: from and to must be dates (YYYY-MM-DD)'
+    if not 0 <= (end - start).days < MAX_REPORT_DAYS:
+        return None, f'Bad Request: from must be before to, at most {MAX_REPORT_DAYS} days apart'
+    return (start.isoformat(), end.isoformat()), None
+
+def _parse_limit(default: int, maximum: int) -> tuple[int | None, str | None]:
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        return None, 'Bad Request: limit must be numeric'
+    if not 1 <= limit <= maximum:
+        return None, f'Bad Request: limit must be between 1 and {maximum}'
+    return limit, None
+
+def _add_up(results: dict[int, list], key: str, fields: tuple) -> dict:
+    totals = {}
+    for rows in results.values():
+        for row in rows:
+            total = totals.setdefault(row[key], {key: row[key], **{field: 0 for field in fields}})
+            for field in fields:
+                total[field] += row[field]
+    return totals
+
+def _round(rows: list[dict]) -> list[dict]:
+    for row in rows:
+        row['revenue'] = round(row['revenue'], 2)
+    return rows
+
+def _product_names(product_ids: list[int]) -> dict[int, str]:
+    if not product_ids:
+        return {}
+    rows = db.catalog.q(f'SELECT id, name FROM products WHERE id IN ({", ".join("?" * len(product_ids))})',
+                        product_ids)
+    return {row['id']: row['name'] for row in rows}
+
+def sales_report() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    days, error = _parse_range()
+    if error:
+        return jsonify({'error': error}), 400
+    # One row per day with sales, by primary key range
+    results = db.fan_out('SELECT day, orders, units, revenue FROM sales_daily WHERE day BETWEEN ? AND ?', days)
+    rows = _round(sorted(_add_up(results, 'day', ('orders', 'units', 'revenue')).values(), key=itemgetter('day')))
+    totals = {field: sum(row[field] for row in rows) for field in ('orders', 'units', 'revenue')}
+    return jsonify({'from': days[0], 'to': days[1], 'days': rows, 'totals': _round([totals])[0]}), 200
+
+def top_products_report() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    days, error = _parse_range()
+    if not error:
+        limit, error = _parse_limit(DEFAULT_TOP, MAX_TOP)
+    if error:
+        return jsonify({'error': error}), 400
+    # A covering index scan of the (product, day) totals in the range
+    results = db.fan_out('''
+        SELECT product_id, SUM(units) AS units, SUM(revenue) AS revenue FROM product_sales_daily
+        WHERE day BETWEEN ? AND ?
+        GROUP BY product_id
+    ''', days)
+    ranked = sorted(_add_up(results, 'product_id', ('units', 'revenue')).values(),
+                    key=itemgetter('revenue'), reverse=True)[:limit]
+    names = _product_names([row['product_id'] for row in ranked])
+    products = [{**row, 'name': names.get(row['product_id'])} for row in _round(ranked)]
+    return jsonify({'from': days[0], 'to': days[1], 'products': products}), 200
+
+def product_sales_report(product_id: int) -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    days, error = _parse_range()
+    if error:
+        return jsonify({'error': error}), 400
+    results = db.fan_out('''
+        SELECT day, units, revenue FROM product_sales_daily WHERE product_id = ? AND day BETWEEN ? AND ?
+    ''', (product_id, *days))
+    rows = _round(sorted(_add_up(results, 'day', ('units', 'revenue')).values(), key=itemgetter('day')))
+    return jsonify({'product_id': product_id, 'from': days[0], 'to': days[1], 'days': rows}), 200
+
+def top_users_report() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    limit, error = _parse_limit(DEFAULT_TOP, MAX_TOP)
+    if error:
+        return jsonify({'error': error}), 400
+    # Each shard's best customers by lifetime revenue, from idx_user_sales_revenue
+    results = db.fan_out('SELECT * FROM user_sales ORDER BY revenue DESC LIMIT ?', (limit,))
+    users = [row for _, row in islice(merge_sorted(results, key=itemgetter('revenue'), reverse=True), limit)]
+    return jsonify(_round(users)), 200
+
+def user_sales_report(user_id: int) -> dict[str, int | float]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    # Runs on the user's shard
+    rows = db.q('SELECT * FROM user_sales WHERE user_id = ?', (user_id,))
+    if not rows:
+        return jsonify({'user_id': user_id, 'orders': 0, 'units': 0, 'revenue': 0,
+                        'first_order_at': None, 'last_order_at': None}), 200
+    return jsonify(_round(rows)[0]), 200
+
+def low_stock_report() -> dict[str, list]:
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized: Admins only'}), 403
+    try:
+        below = int(request.args.get('below', LOW_STOCK_THRESHOLD))
+    except ValueError:
+        return jsonify({'error': 'Bad Request: below must be numeric'}), 400
+    if below > LOW_STOCK_THRESHOLD:
+        return jsonify({'error': f'Bad Request: below must be at most {LOW_STOCK_THRESHOLD}'}), 400
+    # The list the triggers keep, lowest stock first
+    products = db.catalog.q('''
+        SELECT l.product_id, p.name, l.stock FROM low_stock l JOIN products p ON p.id = l.product_id
+        WHERE l.stock <= ?
+        ORDER BY l.stock, l.product_id
+    ''', (below,))
+    return jsonify({'threshold': LOW_STOCK_THRESHOLD, 'products': products}), 200
@@ -0,0 +1,176 @@
+"""Users, carts and orders spread over several SQLite files by user id.
+
+With ``SHARD_URLS`` set, the per-user tables (users, carts, cart_summaries,
+reservations, orders, order_items and the job queue) live in N shard files,
+a user's rows all on shard ``shard_of(user_id, N)``. Products, the version counters and
+the users directory stay in the catalog, ``DATABASE_URL``, which every shard
+connection attaches read-only: the SQL of the routes is unchanged, and cart
+and order writes of users on different shards take different write locks.
+
+Requests are bound to the shard of the user they are about by
+``route_request``; admin reads across users go to every shard with
+``db.fan_out`` and are merged with ``merge_sorted``. ``reshard`` (``flask
+reshard``) moves the users onto another list of shards, e.g. from the single
+database to the first shards, or to one more shard.
+
+What a shard cannot do in one transaction, because it only reads the catalog:
+
+- Checkout takes the stock in a catalog transaction of its own, undone if
+  the shard's transaction rolls back (see ``reservations.convert``). A crash
+  between the two commits can lose that stock, never oversell it.
+- Holds on other shards are read, not locked, when a hold is taken, so two
+  carts on different shards can both hold the last unit; the second of the
+  two checkouts then fails.
+- Cart summaries follow product changes through ``sync_product_carts`` right
+  after the catalog's commit, instead of the catalog's triggers.
+"""
+import heapq
+from itertools import repeat
+from pathlib import Path
+from typing import Callable, Iterator
+from flask import request
+from connection import ConnectionPool, shard_of
+from migrations import CART_ITEMS_JSON, CART_TOTAL, SHARD_MIGRATIONS, migrate, reserve_id_blocks
+from models import db, transaction
+from rollups import rebuild_sales
+
+RESHARD_BATCH_SIZE = 500
+
+# The rows of a set of users in each per-user table
+USER_ROWS = {
+    'users': 'id IN ({})',
+    'carts': 'user_id IN ({})',
+    'cart_summaries': 'user_id IN ({})',
+    'reservations': 'user_id IN ({})',
+    'orders': 'user_id IN ({})',
+    'order_items': 'order_id IN (SELECT id FROM orders WHERE user_id IN ({}))',
+    'jobs': 'user_id IN ({})',
+    'dead_jobs': 'user_id IN ({})',
+}
+# Items before their orders; carts before their summaries, which the
+# catalog's triggers would otherwise create again
+DELETE_ORDER = ('jobs', 'dead_jobs', 'order_items', 'orders', 'reservations', 'carts', 'cart_summaries', 'users')
+
+def _placeholders(values) -> str:
+    return ', '.join('?' * len(values))
+
+def find_user_id(username: str) -> int | None:
+    rows = db.catalog.q('SELECT id FROM users WHERE username = ?', (username,))
+    return rows[0]['id'] if rows else None
+
+def route_request() -> None:
+    """Bind ``db`` to the shard of the user a request is about, until teardown.
+
+    That is the user_id of the URL or of the JSON body, or else the user
+    named by the username of the URL or of the JSON body. Other requests,
+    e.g. for the catalog, stay on the catalog.
+    """
+    if not db.sharded:
+        return
+    args = request.view_args or {}
+    body = request.get_json(silent=True) if request.is_json else None
+    body = body if isinstance(body, dict) else {}
+    user_id = args.get('user_id', body.get('user_id'))
+    if not isinstance(user_id, int):
+        username = args.get('username', body.get('username'))
+        user_id = find_user_id(username) if isinstance(username, str) else None
+    if user_id is not None:
+        db.bind(user_id)
+
+def sync_product_carts(product_ids, deleted: bool = False) -> None:
+    """Apply changes of products to the carts and cart summaries on the shards.
+
+    Unsharded, the catalog's triggers do it in the transaction of the change.
+    With ``deleted``, call it before deleting the products: their lines leave
+    the cart totals at their price. Otherwise call it after the commit.
+    """
+    product_ids = list(product_ids)
+    if not db.sharded or not product_ids:
+        return
+    for index in range(db.shard_count):
+        with db.using(shard=index), transaction():
+            if deleted:
+                db.execute(f'DELETE FROM carts WHERE product_id IN ({_placeholders(product_ids)})', product_ids)
+                continue
+            db.execute(f'''
+                UPDATE cart_summaries SET
+                    total_price = {CART_TOTAL.format(user_id='cart_summaries.user_id')},
+                    items = {CART_ITEMS_JSON.format(user_id='cart_summaries.user_id')},
+                    version = version + 1
+                WHERE user_id IN (SELECT user_id FROM carts WHERE product_id IN ({_placeholders(product_ids)}))
+            ''', product_ids)
+
+def merge_sorted(results: dict[int, list], key: Callable, reverse: bool = False) -> Iterator[tuple[int, dict]]:
+    """Merge the rows of ``db.fan_out``, each shard's already in ``key`` order, into (shard, row) pairs."""
+    streams = [zip(repeat(index), rows) for index, rows in results.items()]
+    return heapq.merge(*streams, key=lambda item: key(item[1]), reverse=reverse)
+
+def reshard(targets: list[str], batch_size: int = RESHARD_BATCH_SIZE) -> dict:
+    """Move every user's rows onto its shard among the ``targets`` files.
+
+    The users come from the shards in use, or from the catalog when there
+    are none; the catalog keeps its users as the directory, without their
+    passwords. Each batch is copied, then deleted from where it was: run it
+    with the application stopped, and again if it was interrupted. Rows keep
+    their ids, and every target then starts a new block of ids.
+    """
+    pools, databases = [], {}
+
+    def open_database(path: str):
+        # One connection per file, even when a file is both source and target
+        key = str(Path(path).resolve())
+        if key not in databases:
+            pools.append(ConnectionPool.from_env(path=path, size=1))
+            databases[key] = pools[-1].acquire()
+        return key, databases[key]
+
+    report = {'moved': {}, 'shards': list(targets)}
+    try:
+        shards = [open_database(path) for path in targets]
+        for _, shard in shards:
+            migrate(shard, migrations=SHARD_MIGRATIONS)
+        from_catalog = not db.sharded
+        for path in ([db.catalog.pool.path] if from_catalog else [shard.pool.path for shard in db.shards]):
+            source_key, source = open_database(path)
+            # Moved users stay in the catalog as the directory, without password
+            users = 'SELECT id AS user_id FROM users' + (' WHERE password IS NOT NULL' if from_catalog else '')
+            user_ids = [row['user_id'] for row in source.q(f'''
+                {users} UNION SELECT user_id FROM carts UNION SELECT user_id FROM reservations
+                UNION SELECT user_id FROM orders ORDER BY 1
+            ''')]
+            moves = {}
+            for user_id in user_ids:
+                index = shard_of(user_id, len(shards))
+                if shards[index][0] != source_key:
+                    moves.setdefault(index, []).append(user_id)
+            for index, ids in sorted(moves.items()):
+                for start in range(0, len(ids), batch_size):
+                    _move_users(source, shards[index][1], ids[start:start + batch_size], from_catalog)
+                report['moved'][f'{path} -> {targets[index]}'] = len(ids)
+        report['id_base'] = reserve_id_blocks([shard for _, shard in shards])
+        # Sales totals are per shard: recompute those of every file users left or joined
+        for database in databases.values():
+            rebuild_sales(database)
+    finally:
+        for pool in pools:
+            pool.close()
+    return report
+
+def _move_users(source, target, user_ids: list[int], from_catalog: bool) -> None:
+    placeholders = _placeholders(user_ids)
+    with transaction(database=target):
+        for table, where in USER_ROWS.items():
+            columns = ', '.join(target.t[table].columns_dict)
+            if from_catalog and table == 'users':
+                where += ' AND password IS NOT NULL'
+            rows = source.execute(f'SELECT {columns} FROM {table} WHERE {where.format(placeholders)}',
+                                  user_ids).fetchall()
+            # Replacing makes a re-run after an interruption harmless
+            target.conn.executemany(
+                f'INSERT OR REPLACE INTO {table} ({columns}) VALUES ({_placeholders(columns.split(", "))})', rows)
+    with transaction(database=source):
+        for table in DELETE_ORDER:
+            if from_catalog and table == 'users':
+                source.execute(f'UPDATE users SET password = NULL WHERE id IN ({placeholders})', user_ids)
+            else:
+                source.execute(f'DELETE FROM {table} WHERE {USER_ROWS[table].format(placeholders)}', user_ids)
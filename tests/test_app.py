@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app
+from connection import PoolTimeout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestAppFactory(unittest.TestCase):
+
+    def test_import_opens_no_database(self) -> None:
+        # Workers forked from a process that imported the app inherit no SQLite handle
+        output = subprocess.run(
+            [sys.executable, '-c', 'import app, models; print(len(models.db.pool._connections))'],
+            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '0')
+
+    def test_bootstrap_command(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(os.environ, DATABASE_URL=os.path.join(tmpdir, 'app.db'), AUTO_BOOTSTRAP='false')
+            # The report is printed as JSON: migrations applied, admin and samples created
+            result = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'],
+                                    cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+            self.assertIn('"admin_created": true', result.stdout)
+            result = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'],
+                                    cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+            self.assertIn('"migrations": []', result.stdout)
+
+    def test_config(self) -> None:
+        app = create_app({'TESTING': True, 'RESERVATION_SWEEP_INTERVAL': 0})
+        self.assertTrue(app.testing)
+        self.assertEqual(app.test_client().get('/').status_code, 200)
+        self.assertNotIn('sweeper', app.extensions)
+
+        # The database is shared by every app of the process
+        with self.assertRaises(RuntimeError):
+            create_app({'DATABASE_URL': 'other.db'})
+
+    def test_pool_timeout_is_503(self) -> None:
+        app = create_app({'TESTING': True, 'RESERVATION_SWEEP_INTERVAL': 0})
+        with mock.patch('routes.products.get_versions', side_effect=PoolTimeout('busy')):
+            response = app.test_client().get('/v1/products/1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_config_chooses_the_database(self) -> None:
+        # Importing the module builds no app, so the first create_app picks the database
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'app.db')
+            output = subprocess.run(
+                [sys.executable, '-c', 'import app, models; app.create_app({"DATABASE_URL": %r}); '
+                 'print(models.db.catalog.pool.path)' % path],
+                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            self.assertEqual(output.strip(), path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import asyncio
+import io
+import json
+import os
+from dotenv import load_dotenv
+from asgi import _environ, app
+
+load_dotenv()
+
+def call_asgi(method: str, path: str, body: dict | None = None, headers: list | None = None,
+              messages: list | None = None) -> tuple[int, dict, bytes]:
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+        'headers': [(b'content-type', b'application/json')] + (headers or []),
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+    }
+    messages = messages or [{'type': 'http.request', 'body': json.dumps(body).encode() if body else b'', 'more_body': False}]
+    sent = []
+
+    async def receive() -> dict:
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = sent[0]
+    return (start['status'], {name.decode(): value.decode() for name, value in start['headers']},
+            b''.join(message.get('body', b'') for message in sent[1:]))
+
+class TestASGI(unittest.TestCase):
+
+    def test_get_products(self) -> None:
+        status, headers, body = call_asgi('GET', '/v1/products')
+        self.assertEqual(status, 200)
+        self.assertIn('etag', headers)
+        self.assertTrue(json.loads(body))
+
+    def test_login_and_logout(self) -> None:
+        status, headers, body = call_asgi('POST', '/v1/login', {
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['role'], 'admin')
+
+        # The session cookie works across requests
+        cookie = headers['set-cookie'].split(';', 1)[0].encode()
+        status, _, body = call_asgi('POST', '/v1/logout', headers=[(b'cookie', cookie)])
+        self.assertEqual(status, 200)
+        self.assertIn('Logged out successfully', json.loads(body)['message'])
+
+    def test_writes_use_the_writer_thread(self) -> None:
+        self.assertIs(app.executor_for({'method': 'POST', 'path': '/v1/cart'}), app.writer)
+        self.assertIs(app.executor_for({'method': 'POST', 'path': '/v1/login'}), app.readers)
+        self.assertIs(app.executor_for({'method': 'GET', 'path': '/v1/cart/1'}), app.readers)
+        # Streamed uploads never hold the writer thread
+        self.assertIs(app.executor_for({'method': 'POST', 'path': '/v1/products/bulk'}), app.streams)
+
+    def test_body_in_several_messages(self) -> None:
+        body = json.dumps({'username': os.getenv('ADMIN_USERNAME'), 'password': os.getenv('ADMIN_PASSWORD')}).encode()
+        messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True},
+                    {'type': 'http.request', 'body': body[10:], 'more_body': False}]
+        status, _, _ = call_asgi('POST', '/v1/login', messages=messages)
+        self.assertEqual(status, 200)
+
+    def test_repeated_cookie_headers(self) -> None:
+        environ = _environ({'method': 'GET', 'path': '/', 'query_string': b'',
+                            'headers': [(b'cookie', b'a=1'), (b'cookie', b'b=2'), (b'accept', b'text/html'),
+                                        (b'accept', b'application/json')]}, io.BytesIO())
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,application/json')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+from app import app
+from models import db
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_bulk_upsert_products(self) -> None:
+        # Only admins can import
+        response = self.client.post('/v1/products/bulk', data='', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+
+        # Login as admin
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+
+        # Import two valid rows and two invalid ones as NDJSON
+        ndjson = '\n'.join([
+            '{"name": "Bulkimported Alpha", "description": "First", "price": 1.5, "stock": 3}',
+            '{"name": "Bulkimported Beta", "price": 2.5, "stock": 4}',
+            '{"name": "Bulkimported Gamma", "price": "free", "stock": 4}',
+            'not json',
+        ])
+        response = self.client.post('/v1/products/bulk?batch_size=2', data=ndjson,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual(report['processed'], 4)
+        self.assertEqual(report['upserted'], 2)
+        self.assertEqual(report['failed'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4])
+
+        search_response = self.client.get('/v1/products/search?q=bulkimported')
+        imported = {p['name']: p for p in search_response.get_json()}
+        self.assertEqual(set(imported), {'Bulkimported Alpha', 'Bulkimported Beta'})
+
+        # Upsert the first product by id from CSV
+        alpha_id = imported['Bulkimported Alpha']['id']
+        csv_body = f'id,name,description,price,stock\n{alpha_id},Bulkimported Alpha,Updated,9.5,30\n'
+        response = self.client.post('/v1/products/bulk', data=csv_body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['upserted'], 1)
+        product = self.client.get(f'/v1/products/{alpha_id}').get_json()[0]
+        self.assertEqual((product['description'], product['price'], product['stock']), ('Updated', 9.5, 30))
+
+        # Undecodable and malformed rows, and non-finite prices, fail on their own
+        ndjson = b'\n'.join([
+            b'{"name": "Bulkimported \xff", "price": 1, "stock": 1}',
+            b'{"name": "Bulkimported NaN", "price": NaN, "stock": 1}',
+            b'{"name": "Bulkimported Inf", "price": Infinity, "stock": 1}',
+        ])
+        response = self.client.post('/v1/products/bulk', data=ndjson, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([error['error'] for error in response.get_json()['errors']],
+                         ['Invalid UTF-8', 'price must be finite', 'price must be finite'])
+        csv_body = (f'id,name,description,price,stock\n{alpha_id},Bulkimported \xff,,1,1\n'
+                    f'{alpha_id},Bulkimported\r,,1,1\n{alpha_id},Bulkimported Alpha,,inf,1\n'
+                    f'{alpha_id},Bulkimported Alpha,Again,9.5,30\n').encode('latin-1')
+        response = self.client.post('/v1/products/bulk', data=csv_body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual((report['processed'], report['upserted'], report['failed']), (4, 1, 3))
+        self.assertEqual([error['row'] for error in report['errors']], [1, 2, 3])
+
+        # Integers out of SQLite's 64-bit range fail on their own too
+        ndjson = '\n'.join([
+            f'{{"id": {2 ** 63}, "name": "Bulkimported Huge", "price": 1, "stock": 1}}',
+            f'{{"name": "Bulkimported Huge", "price": 1, "stock": {2 ** 64}}}',
+            f'{{"id": {alpha_id}, "name": "Bulkimported Alpha", "price": 9.5, "stock": 30}}',
+        ])
+        response = self.client.post('/v1/products/bulk', data=ndjson, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual((report['processed'], report['upserted'], report['failed']), (3, 1, 2))
+        self.assertEqual([error['row'] for error in report['errors']], [1, 2])
+
+        # Delete the imported products
+        for product in imported.values():
+            delete_product_response = self.client.delete(f"/v1/products/{product['id']}")
+            self.assertEqual(delete_product_response.status_code, 200)
+
+        # Logout as admin
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+    def test_bulk_insert_after_cached_miss(self) -> None:
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+
+        # A miss for the id the next insert gets is cached...
+        next_id = db.q('SELECT COALESCE(MAX(id), 0) + 1 AS id FROM products')[0]['id']
+        self.assertEqual(self.client.get(f'/v1/products/{next_id}').status_code, 404)
+
+        # ...and an import without ids moves it on to a new version
+        response = self.client.post('/v1/products/bulk', data='{"name": "Bulkimported Delta", "price": 1, "stock": 1}',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        product_response = self.client.get(f'/v1/products/{next_id}')
+        self.assertEqual(product_response.status_code, 200)
+        self.assertEqual(product_response.get_json()[0]['name'], 'Bulkimported Delta')
+
+        self.assertEqual(self.client.delete(f'/v1/products/{next_id}').status_code, 200)
+        self.assertEqual(self.client.post('/v1/logout').status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import time
+from app import app
+import os
+from dotenv import load_dotenv
+from cache import LRUCache, ProductCache, MISSING
+from etags import bump_versions
+from models import db, transaction
+
+load_dotenv()
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self) -> None:
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Touch 'a' so 'b' is the least recently used entry
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_ttl(self) -> None:
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set('a', [])
+        self.assertEqual(cache.get('a'), [])
+        time.sleep(0.02)
+        self.assertIs(cache.get('a'), MISSING)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_listing_versions(self) -> None:
+        product_cache = ProductCache(LRUCache(maxsize=10, ttl=60))
+        self.assertEqual(product_cache.get_listing({'limit': 1}, 1, lambda: ['old']), ['old'])
+        self.assertEqual(product_cache.get_listing({'limit': 1}, 1, lambda: ['new']), ['old'])
+        # A write by any worker bumps the shared version, so every worker reloads
+        self.assertEqual(product_cache.get_listing({'limit': 1}, 2, lambda: ['new']), ['new'])
+
+class TestProductCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_update_changes_cached_product(self) -> None:
+        # First, login as admin
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+
+        # Add a product and read it, which caches it
+        add_product_response = self.client.post('/v1/products', json={
+            'name': 'Cached Product',
+            'description': 'This product will be cached.',
+            'price': 29.99,
+            'stock': 50
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+        get_product_response = self.client.get(f'/v1/products/{product_id}')
+        self.assertEqual(get_product_response.get_json()[0]['price'], 29.99)
+
+        # A second read is served from the cache
+        hits = self.client.get('/v1/admin/cache').get_json()['hits']
+        self.client.get(f'/v1/products/{product_id}')
+        self.assertEqual(self.client.get('/v1/admin/cache').get_json()['hits'], hits + 1)
+
+        # Updating the product bumps its version, which the cached row is keyed by
+        update_product_response = self.client.put(f'/v1/products/{product_id}', json={
+            'name': 'Cached Product',
+            'description': 'This product was cached.',
+            'price': 39.99,
+            'stock': 50
+        })
+        self.assertEqual(update_product_response.status_code, 200)
+        get_product_response = self.client.get(f'/v1/products/{product_id}')
+        self.assertEqual(get_product_response.get_json()[0]['price'], 39.99)
+
+        # A write by another worker only bumps the shared version; this one's cache follows it
+        with transaction():
+            db.execute('UPDATE products SET price = 49.99 WHERE id = ?', (product_id,))
+            bump_versions('products', f'product:{product_id}')
+        self.assertEqual(self.client.get(f'/v1/products/{product_id}').get_json()[0]['price'], 49.99)
+
+        # Delete the product
+        delete_product_response = self.client.delete(f'/v1/products/{product_id}')
+        self.assertEqual(delete_product_response.status_code, 200)
+        self.assertEqual(self.client.get(f'/v1/products/{product_id}').status_code, 404)
+
+        # Logout as admin
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
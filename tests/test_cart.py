@@ -246,5 +246,219 @@ class TestCart(unittest.TestCase):
         logout_response = self.client.post('/v1/logout')
         self.assertEqual(logout_response.status_code, 200)
 
+    def test_batch_update_cart(self) -> None:
+        # Login as the test user
+        login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('TEST_USERNAME', 'testuser'),
+            'password': os.getenv('TEST_PASSWORD', 'testpass')
+        })
+        self.assertEqual(login_response.status_code, 200)
+        user_id = login_response.get_json()['id']
+        self.client.delete(f'/v1/cart/{user_id}')
+
+        # Get three products
+        products_response = self.client.get('/v1/products?limit=3')
+        self.assertEqual(products_response.status_code, 200)
+        first_id, second_id, third_id = [p['id'] for p in products_response.get_json()]
+
+        # Add, add again, set and remove in a single request
+        batch_response = self.client.post('/v1/cart/batch', json={
+            'user_id': user_id,
+            'items': [
+                {'product_id': first_id, 'quantity': 2},
+                {'product_id': first_id, 'quantity': 1},
+                {'product_id': second_id, 'quantity': 5, 'op': 'set'},
+                {'product_id': third_id, 'quantity': 1},
+                {'product_id': third_id, 'op': 'remove'},
+            ]
+        })
+        self.assertEqual(batch_response.status_code, 200)
+        quantities = {item['product_id']: item['quantity'] for item in batch_response.get_json()['items']}
+        self.assertEqual(quantities, {first_id: 3, second_id: 5})
+
+        # Unknown products reject the whole batch
+        batch_response = self.client.post('/v1/cart/batch', json={
+            'user_id': user_id,
+            'items': [{'product_id': first_id, 'quantity': 1}, {'product_id': 999999999, 'quantity': 1}]
+        })
+        self.assertEqual(batch_response.status_code, 404)
+        self.assertEqual(self.client.post('/v1/cart', json={
+            'user_id': user_id, 'product_id': 999999999, 'quantity': 1}).status_code, 404)
+        cart_response = self.client.get(f'/v1/cart/{user_id}')
+        quantities = {item['product_id']: item['quantity'] for item in cart_response.get_json()['items']}
+        self.assertEqual(quantities[first_id], 3)
+
+        # Invalid operations are rejected
+        for items in ([], [1], [{'product_id': True, 'quantity': 1}], [{'product_id': first_id, 'quantity': False}]):
+            batch_response = self.client.post('/v1/cart/batch', json={'user_id': user_id, 'items': items})
+            self.assertEqual(batch_response.status_code, 400, items)
+        batch_response = self.client.post('/v1/cart/batch', json={
+            'user_id': True, 'items': [{'product_id': first_id, 'quantity': 1}]})
+        self.assertEqual(batch_response.status_code, 400)
+        batch_response = self.client.post('/v1/cart/batch', json=[1, 2])
+        self.assertEqual(batch_response.status_code, 400)
+
+        # Clean up the cart
+        response = self.client.delete(f'/v1/cart/{user_id}')
+        self.assertEqual(response.status_code, 200)
+
+        # Logout as the test user
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+    def test_place_order_insufficient_stock(self) -> None:
+        # First, login as admin
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+
+        # Add two products with plenty of stock
+        product_ids = []
+        for stock in (100, 5):
+            add_product_response = self.client.post('/v1/products', json={
+                'name': 'Stock Test Product',
+                'description': 'This is a test product',
+                'price': 1.99,
+                'stock': stock
+            })
+            self.assertEqual(add_product_response.status_code, 201)
+            product_ids.append(add_product_response.get_json()['product']['id'])
+
+        # Logout as admin
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+        # Login as the test user and fill the cart
+        login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('TEST_USERNAME', 'testuser'),
+            'password': os.getenv('TEST_PASSWORD', 'testpass')
+        })
+        self.assertEqual(login_response.status_code, 200)
+        user_id = login_response.get_json()['id']
+        self.client.delete(f'/v1/cart/{user_id}')
+        for product_id in product_ids:
+            cart_response = self.client.post('/v1/cart', json={
+                'user_id': user_id,
+                'product_id': product_id,
+                'quantity': 2
+            })
+            self.assertEqual(cart_response.status_code, 201)
+
+        # More than the stock cannot even be put in the cart
+        cart_response = self.client.post('/v1/cart', json={
+            'user_id': user_id,
+            'product_id': product_ids[1],
+            'quantity': 4
+        })
+        self.assertEqual(cart_response.status_code, 409)
+
+        # The stock of the second product drops below the cart's hold
+        self.client.post('/v1/logout')
+        self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        update_response = self.client.put(f'/v1/products/{product_ids[1]}', json={
+            'name': 'Stock Test Product',
+            'description': 'This is a test product',
+            'price': 1.99,
+            'stock': 1
+        })
+        self.assertEqual(update_response.status_code, 200)
+        self.client.post('/v1/logout')
+        self.client.post('/v1/login', json={
+            'username': os.getenv('TEST_USERNAME', 'testuser'),
+            'password': os.getenv('TEST_PASSWORD', 'testpass')
+        })
+
+        # The order fails on the second product...
+        order_response = self.client.post(f'/v1/order/{user_id}')
+        self.assertEqual(order_response.status_code, 400)
+        self.assertIn(f'Insufficient stock for product ID: {product_ids[1]}', order_response.get_json()['error'])
+
+        # ...and nothing was changed, including the stock of the first product
+        product_response = self.client.get(f'/v1/products/{product_ids[0]}')
+        self.assertEqual(product_response.get_json()[0]['stock'], 100)
+        cart_response = self.client.get(f'/v1/cart/{user_id}')
+        self.assertEqual(len(cart_response.get_json()['items']), 2)
+
+        # Clean up the cart
+        response = self.client.delete(f'/v1/cart/{user_id}')
+        self.assertEqual(response.status_code, 200)
+
+        # Logout as the test user
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+    def test_cart_summary_follows_price_changes(self) -> None:
+        # Login as admin and add a product
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+        add_product_response = self.client.post('/v1/products', json={
+            'name': 'Summary Test Product',
+            'description': 'This is a test product',
+            'price': 2.5,
+            'stock': 100
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+        self.client.post('/v1/logout')
+
+        # Login as the test user and put three of it in the cart
+        login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('TEST_USERNAME', 'testuser'),
+            'password': os.getenv('TEST_PASSWORD', 'testpass')
+        })
+        self.assertEqual(login_response.status_code, 200)
+        user_id = login_response.get_json()['id']
+        self.client.delete(f'/v1/cart/{user_id}')
+        batch_response = self.client.post('/v1/cart/batch', json={
+            'user_id': user_id, 'items': [{'product_id': product_id, 'quantity': 3}]
+        })
+        self.assertEqual(batch_response.status_code, 200)
+        self.assertEqual(batch_response.get_json()['item_count'], 3)
+        self.assertAlmostEqual(batch_response.get_json()['total_price'], 7.5)
+        etag = self.client.get(f'/v1/cart/{user_id}').headers['ETag']
+        self.client.post('/v1/logout')
+
+        # A price change reaches the cart summary and its ETag
+        self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        update_response = self.client.put(f'/v1/products/{product_id}', json={
+            'name': 'Summary Test Product',
+            'description': 'This is a test product',
+            'price': 4.0,
+            'stock': 100
+        })
+        self.assertEqual(update_response.status_code, 200)
+        cart_response = self.client.get(f'/v1/cart/{user_id}', headers={'If-None-Match': etag})
+        self.assertEqual(cart_response.status_code, 200)
+        cart = cart_response.get_json()
+        self.assertAlmostEqual(cart['total_price'], 12.0)
+        self.assertEqual(cart['items'][0]['subtotal'], 12.0)
+
+        # The total is kept in cents, without float residue from the deltas
+        update_response = self.client.put(f'/v1/products/{product_id}', json={
+            'name': 'Summary Test Product',
+            'description': 'This is a test product',
+            'price': 0.1,
+            'stock': 100
+        })
+        self.assertEqual(update_response.status_code, 200)
+        self.assertEqual(self.client.get(f'/v1/cart/{user_id}').get_json()['total_price'], 0.3)
+
+        # Deleting the product takes it out of the cart
+        self.assertEqual(self.client.delete(f'/v1/products/{product_id}').status_code, 200)
+        cart_response = self.client.get(f'/v1/cart/{user_id}')
+        self.assertEqual(cart_response.get_json()['items'], [])
+        self.client.post('/v1/logout')
+
 if __name__ == '__main__':
     unittest.main()
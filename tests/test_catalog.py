@@ -0,0 +1,166 @@
+import itertools
+import os
+import random
+import tempfile
+import unittest
+from app import app
+from dotenv import load_dotenv
+from catalog import Catalog, CatalogSnapshot, np, prefix_upper_bound
+from etags import get_versions
+from models import db, ensure_bootstrapped
+from routes.products import PRODUCT_FIELDS, _query_listing
+
+load_dotenv()
+
+def listing_params(fields: list[str] | None = None, **overrides) -> dict:
+    # As _parse_listing_args builds them
+    params = {'limit': 5, 'after': 0, 'after_price': None, 'min_price': None, 'max_price': None,
+              'sort': 'id', 'in_stock': False, 'name_prefix': None, **overrides}
+    cursor_fields = ['id'] if params['sort'] == 'id' else ['id', 'price']
+    params['fields'] = cursor_fields + [f for f in fields or PRODUCT_FIELDS if f not in cursor_fields]
+    return params
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestCatalogSnapshot(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        ensure_bootstrapped()
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client(use_cookies=False)
+        response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'), 'password': os.getenv('ADMIN_PASSWORD')})
+        self.assertEqual(response.status_code, 200)
+        self.admin = {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    def assertSameListings(self, catalog: Catalog) -> None:
+        # Every combination of filters and orders, plus the second page of each
+        version, = get_versions('products')
+        for sort, in_stock, prices, prefix, fields in itertools.product(
+                ('id', 'price', '-price'), (False, True), ((None, None), (5.0, 500.0)),
+                (None, 'S', 'Snapshot', 'S\U0010ffff', '\U0010ffff'), (None, ['id', 'name', 'stock'])):
+            params = listing_params(fields, sort=sort, in_stock=in_stock, min_price=prices[0],
+                                    max_price=prices[1], name_prefix=prefix)
+            expected = _query_listing(params)
+            self.assertEqual(catalog.list_products(params, version), expected, params)
+            if len(expected) > params['limit']:
+                last = expected[params['limit'] - 1]
+                params.update(after=last['id'], after_price=last.get('price'))
+                self.assertEqual(catalog.list_products(params, version), _query_listing(params), params)
+
+    def test_updated_matches_build(self) -> None:
+        # Applying changed rows gives the same columns and name order as a full build
+        rng = random.Random(22)
+        row = lambda product_id: (product_id, rng.choice(['Lamp', 'Laptop', 'Mug', 'Ö', '']) + str(rng.random()),
+                                  rng.choice([1.0, 2.5, 9.99]), rng.randrange(3), '2024')
+        products = {product_id: row(product_id) for product_id in rng.sample(range(1, 500), 200)}
+        snapshot = CatalogSnapshot.build(1, [products[i] for i in sorted(products)])
+        for version in range(2, 12):
+            changed = sorted(rng.sample(range(1, 600), 30))
+            for product_id in changed:
+                products[product_id] = row(product_id)
+            snapshot = snapshot.updated(version, [products[i] for i in changed], len(products))
+            expected = CatalogSnapshot.build(version, [products[i] for i in sorted(products)])
+            for column in ('ids', 'prices', 'stocks', 'price_order', 'price_desc_order', 'sorted_prices'):
+                self.assertEqual(getattr(snapshot, column).tolist(), getattr(expected, column).tolist())
+            self.assertEqual([snapshot.name(i) for i in range(len(snapshot))],
+                             [expected.name(i) for i in range(len(expected))])
+            self.assertEqual([snapshot.name(i) for i in snapshot.name_order],
+                             [expected.name(i) for i in expected.name_order])
+
+    def test_select_matches_sort(self) -> None:
+        # Scans that cross many chunks, with many tied prices, against a plain sort
+        rng = random.Random(7)
+        rows = [(product_id, rng.choice(['Lamp', 'Mug']) + str(product_id), float(rng.randrange(20)),
+                 rng.randrange(3), '2024') for product_id in range(1, 20000, 3)]
+        snapshot = CatalogSnapshot.build(1, rows)
+        for sort, in_stock, band, prefix in itertools.product(
+                ('id', 'price', '-price'), (False, True), ((None, None), (3.0, 3.0), (2.0, 15.0)), (None, 'Mug1', 'Mug19')):
+            params = {'limit': 40, 'after': 0, 'after_price': None, 'min_price': band[0], 'max_price': band[1],
+                      'sort': sort, 'in_stock': in_stock, 'name_prefix': prefix}
+            expected = [row for row in rows
+                        if (band[0] is None or band[0] <= row[2] <= band[1]) and (row[3] or not in_stock)
+                        and (prefix is None or row[1].startswith(prefix))]
+            if sort != 'id':
+                expected.sort(key=lambda row: (row[2] if sort == 'price' else -row[2], row[0]))
+            # Follow the cursor through five pages
+            for page in range(5):
+                start = page * params['limit']
+                selected = snapshot.ids[snapshot.select(params)].tolist()
+                self.assertEqual(selected, [row[0] for row in expected[start:start + params['limit'] + 1]], params)
+                if len(selected) <= params['limit']:
+                    break
+                last = expected[start + params['limit'] - 1]
+                params.update(after=last[0], after_price=last[2])
+
+    def test_matches_sql(self) -> None:
+        for name, price in (('Snapshot A', 10.0), ('Snapshot B', 10.0), ('Snapshot C', 7.5)):
+            response = self.client.post('/v1/products', headers=self.admin, json={
+                'name': name, 'description': 'Catalog snapshot test', 'price': price, 'stock': 3})
+            self.assertEqual(response.status_code, 201)
+        product_id = response.get_json()['product']['id']
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            catalog = Catalog(tmpdir)
+            self.assertSameListings(catalog)
+            self.assertEqual(catalog.builds, 1)
+
+            # Updates and inserts are applied to the snapshot, not rebuilt
+            self.client.put(f'/v1/products/{product_id}', headers=self.admin, json={
+                'name': 'Snapshot Renamed', 'description': 'Catalog snapshot test', 'price': 250.0, 'stock': 0})
+            self.client.post('/v1/products', headers=self.admin, json={
+                'name': 'Snapshot D', 'description': 'Catalog snapshot test', 'price': 10.0, 'stock': 1})
+            self.assertSameListings(catalog)
+            self.assertEqual((catalog.builds, catalog.refreshes), (1, 1))
+
+            # Another worker maps the saved snapshot instead of building one
+            other = Catalog(tmpdir)
+            self.assertSameListings(other)
+            self.assertEqual((other.builds, other.loads), (0, 1))
+
+            # A delete cannot be seen in the changed rows, so it rebuilds
+            self.client.delete(f'/v1/products/{product_id}', headers=self.admin)
+            self.assertSameListings(catalog)
+            self.assertEqual(catalog.builds, 2)
+
+class TestListingSort(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_listing_sorted_by_price(self) -> None:
+        # Paging through the whole catalog by price visits every product once
+        seen, url = [], '/v1/products?sort=-price&limit=7&fields=name'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(response.get_json())
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        prices = [product['price'] for product in seen]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+        self.assertEqual(len({product['id'] for product in seen}), len(seen))
+        self.assertEqual(len(seen), db.q('SELECT count(*) AS n FROM products')[0]['n'])
+
+        response = self.client.get('/v1/products?sort=price&after=3')
+        self.assertEqual(response.status_code, 400)
+
+    def test_name_prefix_of_the_last_code_point(self) -> None:
+        self.assertEqual(prefix_upper_bound('Mug'), 'Muh')
+        self.assertEqual(prefix_upper_bound('M\U0010ffff\U0010ffff'), 'N')
+        self.assertIsNone(prefix_upper_bound('\U0010ffff'))
+        response = self.client.get('/v1/products?name_prefix=%F4%8F%BF%BF')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), [])
+
+    def test_name_prefix_before_the_surrogates(self) -> None:
+        self.assertEqual(prefix_upper_bound('M\ud7ff'), 'M\ue000')
+        response = self.client.get('/v1/products?name_prefix=%ED%9F%BF')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import tempfile
+import threading
+from connection import ConnectionPool, ThreadLocalDatabase, PoolTimeout
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(os.path.join(self.tmpdir.name, 'test.db'), size=2, timeout=0.1)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.tmpdir.cleanup()
+
+    def test_pragmas(self) -> None:
+        database = self.pool.acquire()
+        self.assertEqual(database.q('PRAGMA journal_mode')[0]['journal_mode'], 'wal')
+        self.assertEqual(database.q('PRAGMA busy_timeout')[0]['timeout'], 5000)
+        # NORMAL is 1
+        self.assertEqual(database.q('PRAGMA synchronous')[0]['synchronous'], 1)
+        self.pool.release(database)
+
+    def test_pool_is_bounded(self) -> None:
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.assertIsNot(first.conn, second.conn)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+
+        # Released connections are reused
+        self.pool.release(second)
+        self.assertIs(self.pool.acquire(), second)
+
+    def test_grow(self) -> None:
+        first, second = self.pool.acquire(), self.pool.acquire()
+        # Slots can be added while connections are checked out
+        self.pool.grow(3)
+        self.assertEqual(self.pool.size, 3)
+        third = self.pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        for database in (first, second, third):
+            self.pool.release(database)
+
+    def test_release_rolls_back_open_transaction(self) -> None:
+        database = self.pool.acquire()
+        database.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+        database.execute('BEGIN')
+        database.execute('INSERT INTO items (id) VALUES (1)')
+        self.pool.release(database)
+        self.assertEqual(self.pool.acquire().q('SELECT COUNT(*) AS n FROM items')[0]['n'], 0)
+
+    def test_one_connection_per_thread(self) -> None:
+        db = ThreadLocalDatabase(self.pool)
+        connections = []
+        # Hold the connections until both threads have one
+        barrier = threading.Barrier(2)
+
+        def worker() -> None:
+            connections.append(db.conn)
+            barrier.wait()
+            db.release()
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(connections), 2)
+        self.assertIsNot(connections[0], connections[1])
+
+    def test_executemany_is_timed(self) -> None:
+        queries = []
+        db = ThreadLocalDatabase(self.pool, on_query=lambda sql, seconds: queries.append(sql))
+        db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+        db.executemany('INSERT INTO items (id) VALUES (?)', [(1,), (2,)])
+        self.assertEqual(queries[-1], 'INSERT INTO items (id) VALUES (?)')
+        self.assertEqual(db.q('SELECT COUNT(*) AS n FROM items')[0]['n'], 2)
+        db.release()
+
+if __name__ == '__main__':
+    unittest.main()
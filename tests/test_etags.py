@@ -0,0 +1,103 @@
+import unittest
+from app import app
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class TestETags(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_product_conditional_get(self) -> None:
+        # First, login as admin
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+
+        # Add a product
+        add_product_response = self.client.post('/v1/products', json={
+            'name': 'ETag Product',
+            'description': 'This is a test product.',
+            'price': 19.99,
+            'stock': 100
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+
+        # The first read returns a tag, which makes the next read a 304
+        get_product_response = self.client.get(f'/v1/products/{product_id}')
+        self.assertEqual(get_product_response.status_code, 200)
+        etag = get_product_response.headers['ETag']
+        self.assertIn('must-revalidate', get_product_response.headers['Cache-Control'])
+        cached_response = self.client.get(f'/v1/products/{product_id}', headers={'If-None-Match': etag})
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(cached_response.data, b'')
+
+        # Same for the listing
+        list_response = self.client.get('/v1/products?limit=5')
+        list_etag = list_response.headers['ETag']
+        self.assertEqual(self.client.get('/v1/products?limit=5', headers={'If-None-Match': list_etag}).status_code, 304)
+        # A different page has a different tag
+        self.assertEqual(self.client.get('/v1/products?limit=6', headers={'If-None-Match': list_etag}).status_code, 200)
+
+        # Updating the product changes both tags
+        update_product_response = self.client.put(f'/v1/products/{product_id}', json={
+            'name': 'ETag Product',
+            'description': 'This product has been updated.',
+            'price': 29.99,
+            'stock': 100
+        })
+        self.assertEqual(update_product_response.status_code, 200)
+        get_product_response = self.client.get(f'/v1/products/{product_id}', headers={'If-None-Match': etag})
+        self.assertEqual(get_product_response.status_code, 200)
+        self.assertNotEqual(get_product_response.headers['ETag'], etag)
+        self.assertEqual(self.client.get('/v1/products?limit=5', headers={'If-None-Match': list_etag}).status_code, 200)
+
+        # Delete the product
+        delete_product_response = self.client.delete(f'/v1/products/{product_id}')
+        self.assertEqual(delete_product_response.status_code, 200)
+
+        # Logout as admin
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+    def test_cart_conditional_get(self) -> None:
+        # Login as the test user
+        login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('TEST_USERNAME', 'testuser'),
+            'password': os.getenv('TEST_PASSWORD', 'testpass')
+        })
+        self.assertEqual(login_response.status_code, 200)
+        user_id = login_response.get_json()['id']
+
+        cart_response = self.client.get(f'/v1/cart/{user_id}')
+        self.assertEqual(cart_response.status_code, 200)
+        etag = cart_response.headers['ETag']
+        self.assertEqual(cart_response.headers['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get(f'/v1/cart/{user_id}', headers={'If-None-Match': etag}).status_code, 304)
+
+        # Adding an item changes the tag
+        products_data = self.client.get('/v1/products').get_json()
+        cart_response = self.client.post('/v1/cart', json={
+            'user_id': user_id,
+            'product_id': products_data[0]['id'],
+            'quantity': 1
+        })
+        self.assertIn(cart_response.status_code, [200, 201])
+        self.assertEqual(self.client.get(f'/v1/cart/{user_id}', headers={'If-None-Match': etag}).status_code, 200)
+
+        # Clean up the cart
+        response = self.client.delete(f'/v1/cart/{user_id}')
+        self.assertEqual(response.status_code, 200)
+
+        # Logout as the test user
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from app import app
+from models import db
+from hashing import PasswordHasher, HashingBusy, password_hasher
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_size=0)
+
+    def tearDown(self) -> None:
+        self.hasher.shutdown()
+
+    def test_hash_and_verify(self) -> None:
+        password_hash = self.hasher.hash('secret')
+        self.assertTrue(password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(self.hasher.verify(password_hash, 'secret'))
+        self.assertFalse(self.hasher.verify(password_hash, 'wrong'))
+        self.assertFalse(self.hasher.needs_rehash(password_hash))
+        self.assertTrue(PasswordHasher('pbkdf2').needs_rehash(password_hash))
+
+    def test_back_pressure(self) -> None:
+        # Take the only slot, as a concurrent request would
+        self.hasher._slots.acquire()
+        with self.assertRaises(HashingBusy):
+            self.hasher.hash('secret')
+        self.hasher._slots.release()
+        self.hasher.hash('secret')
+
+    def test_timeout(self) -> None:
+        slow = PasswordHasher('pbkdf2:sha256:5000000', workers=1, queue_size=0, timeout=0.01)
+        try:
+            with self.assertRaises(HashingBusy):
+                slow.hash('secret')
+            # The abandoned task keeps its slot until it has run
+            self.assertFalse(slow._slots.acquire(blocking=False))
+        finally:
+            slow.shutdown()
+        self.assertTrue(slow._slots.acquire(blocking=False))
+
+class TestAuthHashing(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_rehash_on_login(self) -> None:
+        self.client.post('/v1/register', json={
+            'username': 'rehashuser', 'password': 'testpass', 'email': 'rehash@example.com'
+        })
+        method = password_hasher.method
+        try:
+            # Change the hashing parameters: the next login upgrades the hash
+            password_hasher.method = 'pbkdf2:sha256:1000'
+            login_response = self.client.post('/v1/login', json={'username': 'rehashuser', 'password': 'testpass'})
+            self.assertEqual(login_response.status_code, 200)
+            stored = db.q('SELECT password FROM users WHERE username = ?', ('rehashuser',))[0]['password']
+            self.assertTrue(stored.startswith('pbkdf2:sha256:1000$'))
+        finally:
+            password_hasher.method = method
+
+        # The upgraded hash still verifies
+        self.assertEqual(self.client.post('/v1/login', json={
+            'username': 'rehashuser', 'password': 'testpass'
+        }).status_code, 200)
+
+        delete_response = self.client.delete('/v1/user/rehashuser')
+        self.assertEqual(delete_response.status_code, 200)
+
+    def test_saturated_pool_returns_429(self) -> None:
+        slots = []
+        while password_hasher._slots.acquire(blocking=False):
+            slots.append(1)
+        try:
+            login_response = self.client.post('/v1/login', json={'username': 'admin', 'password': 'admin_password'})
+            self.assertEqual(login_response.status_code, 429)
+            self.assertEqual(login_response.headers['Retry-After'], '1')
+        finally:
+            for _ in slots:
+                password_hasher._slots.release()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import unittest
+from app import app
+from dotenv import load_dotenv
+from jobs import claim, complete, drain, enqueue, job, requeue, work
+from models import db, ensure_bootstrapped, transaction
+
+load_dotenv()
+
+calls = []
+
+@job('test.flaky', max_attempts=2)
+def flaky(payload: dict) -> None:
+    calls.append(payload)
+    raise RuntimeError('still broken')
+
+@job('test.limited', concurrency=1)
+def limited(payload: dict) -> None:
+    pass
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self) -> None:
+        ensure_bootstrapped()
+        app.config['TESTING'] = True
+        self.client = app.test_client(use_cookies=False)
+        # Start from empty queues
+        drain()
+        calls.clear()
+
+    def tearDown(self) -> None:
+        with transaction():
+            db.execute("DELETE FROM jobs WHERE kind LIKE 'test.%'")
+            db.execute("DELETE FROM dead_jobs WHERE kind LIKE 'test.%'")
+        db.release()
+
+    def enqueue(self, kind: str, payload: dict) -> int:
+        with transaction():
+            return enqueue(kind, payload)
+
+    def login(self, username: str, password: str) -> tuple[int, dict]:
+        response = self.client.post('/v1/login', json={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['id'], {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    def test_order_confirmed_by_worker(self) -> None:
+        _, admin = self.login(os.getenv('ADMIN_USERNAME'), os.getenv('ADMIN_PASSWORD'))
+        user_id, user = self.login(os.getenv('TEST_USERNAME', 'testuser'), os.getenv('TEST_PASSWORD', 'testpass'))
+        product = self.client.post('/v1/products', headers=admin, json={
+            'name': 'Job Test Product', 'description': 'This is a test product', 'price': 4.0, 'stock': 5
+        }).get_json()['product']
+        self.client.delete(f'/v1/cart/{user_id}', headers=user)
+        self.client.post('/v1/cart', headers=user, json={'user_id': user_id, 'product_id': product['id'], 'quantity': 1})
+        order_response = self.client.post(f'/v1/order/{user_id}', headers=user)
+        self.assertEqual(order_response.status_code, 201)
+        order_url = f"/v1/orders/{user_id}/{order_response.get_json()['order_id']}"
+
+        # Checkout returns before the order is processed
+        self.assertEqual(self.client.get(order_url, headers=user).get_json()['status'], 'Pending')
+        self.assertEqual(drain(), {'done': 1})
+        self.assertEqual(self.client.get(order_url, headers=user).get_json()['status'], 'Confirmed')
+
+    def test_retries_then_dead_letters(self) -> None:
+        job_id = self.enqueue('test.flaky', {'n': 1})
+        self.assertEqual(work(0), 'retried')
+        # Backing off: not due again yet
+        self.assertIsNone(work(0))
+        row = db.q('SELECT status, attempts, last_error FROM jobs WHERE id = ?', (job_id,))[0]
+        self.assertEqual(row, {'status': 'queued', 'attempts': 1, 'last_error': 'RuntimeError: still broken'})
+
+        db.execute("UPDATE jobs SET run_at = '2000-01-01T00:00:00.000Z' WHERE id = ?", (job_id,))
+        self.assertEqual(work(0), 'dead')
+        self.assertEqual(calls, [{'n': 1}, {'n': 1}])
+        self.assertFalse(db.q('SELECT 1 FROM jobs WHERE id = ?', (job_id,)))
+        self.assertEqual(db.q('SELECT attempts FROM dead_jobs WHERE id = ?', (job_id,)), [{'attempts': 2}])
+
+        metrics = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('jobs_dead{kind="test.flaky"} 1', metrics)
+        self.assertIn('jobs_processed_total{kind="test.flaky",outcome="dead"}', metrics)
+
+        # Requeued with fresh attempts
+        self.assertEqual(requeue('test.flaky'), 1)
+        self.assertEqual(db.q('SELECT attempts FROM jobs WHERE id = ?', (job_id,)), [{'attempts': 0}])
+        self.assertIn('jobs_queued{kind="test.flaky",state="ready"} 1',
+                      self.client.get('/metrics').get_data(as_text=True))
+
+    def test_expired_lease_is_taken_over(self) -> None:
+        job_id = self.enqueue('test.limited', {})
+        first = claim(lease=60)
+        self.assertEqual((first['id'], first['attempts']), (job_id, 1))
+        self.assertIsNone(claim())
+
+        # The first worker is presumed dead once its lease runs out
+        db.execute("UPDATE jobs SET run_at = '2000-01-01T00:00:00.000Z' WHERE id = ?", (job_id,))
+        second = claim()
+        self.assertEqual((second['id'], second['attempts']), (job_id, 2))
+        self.assertFalse(complete(first))
+        self.assertTrue(complete(second))
+
+    def test_concurrency_limit(self) -> None:
+        self.enqueue('test.limited', {'n': 1})
+        self.enqueue('test.limited', {'n': 2})
+        self.enqueue('test.flaky', {'n': 3})
+        self.assertEqual(claim()['kind'], 'test.limited')
+        # The second limited job waits for the first; other kinds do not
+        self.assertEqual(claim()['kind'], 'test.flaky')
+        self.assertIsNone(claim())
+
+    def test_admin_stats(self) -> None:
+        _, admin = self.login(os.getenv('ADMIN_USERNAME'), os.getenv('ADMIN_PASSWORD'))
+        self.enqueue('test.limited', {})
+        response = self.client.get('/v1/admin/jobs', headers=admin)
+        self.assertEqual(response.status_code, 200)
+        jobs = response.get_json()['queues'][0]['jobs']
+        self.assertIn({'kind': 'test.limited', 'state': 'ready'}, [{'kind': row['kind'], 'state': row['state']}
+                                                                  for row in jobs])
+        _, user = self.login(os.getenv('TEST_USERNAME', 'testuser'), os.getenv('TEST_PASSWORD', 'testpass'))
+        self.assertEqual(self.client.get('/v1/admin/jobs', headers=user).status_code, 403)
+
+if __name__ == '__main__':
+    unittest.main()
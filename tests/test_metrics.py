@@ -0,0 +1,41 @@
+import unittest
+from app import app
+from metrics import Histogram, record_query
+
+class TestHistogram(unittest.TestCase):
+
+    def test_render(self) -> None:
+        histogram = Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.5, '/a')
+        histogram.observe(5, '/a')
+        lines = histogram.render()
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="/a",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="/a",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_count{endpoint="/a"} 3', lines)
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_request_metrics(self) -> None:
+        self.assertEqual(self.client.get('/v1/products/1').status_code, 200)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        # Labelled by URL rule, with SQL counted per request
+        self.assertIn('http_request_duration_seconds_count{method="GET",endpoint="/v1/products/<int:product_id>",status="200"}', body)
+        self.assertIn('db_queries_per_request_count{endpoint="/v1/products/<int:product_id>"}', body)
+        self.assertIn('http_requests_in_flight 1', body)
+
+    def test_slow_query_log(self) -> None:
+        with self.assertLogs('slow_query', level='WARNING') as logs:
+            record_query('SELECT *\n  FROM products', 10.0)
+        self.assertIn('SELECT * FROM products', logs.output[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import tempfile
+from fastlite import database
+from migrations import MIGRATIONS, MigrationError, migrate
+from models import db, ensure_bootstrapped
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database = database(os.path.join(self.tmpdir.name, 'test.db'))
+
+    def tearDown(self) -> None:
+        self.database.conn.close()
+        self.tmpdir.cleanup()
+
+    def test_migrate(self) -> None:
+        # A fresh database gets every migration, in order, exactly once
+        self.assertEqual(migrate(self.database), sorted(MIGRATIONS))
+        self.assertEqual(migrate(self.database), [])
+        self.assertIn('updated_at', self.database.t.products.columns_dict)
+
+    def test_migrate_to_target(self) -> None:
+        self.assertEqual(migrate(self.database, target=2), [1, 2])
+        self.assertEqual(migrate(self.database), sorted(MIGRATIONS)[2:])
+
+    def test_failed_migration_is_rolled_back(self) -> None:
+        migrate(self.database, target=6)
+        # Duplicate usernames make the unique index of migration 7 fail
+        for _ in range(2):
+            self.database.execute("INSERT INTO users (username, email) VALUES ('twin', 'twin@example.com')")
+        with self.assertRaisesRegex(MigrationError, r"username 'twin' \(user ids 1, 2\); email 'twin@example.com'"):
+            migrate(self.database)
+        self.assertEqual(self.database.q('SELECT MAX(version) AS v FROM schema_migrations')[0]['v'], 6)
+        self.assertFalse(self.database.q("SELECT name FROM sqlite_master WHERE name = 'idx_users_username'"))
+
+class TestQueryPlans(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        # The schema is created on first use, not when models is imported
+        ensure_bootstrapped()
+
+    def assertUsesIndex(self, sql: str, params: tuple) -> None:
+        plan = ' '.join(row['detail'] for row in db.q(f'EXPLAIN QUERY PLAN {sql}', params))
+        self.assertNotRegex(plan, r'SCAN (users|carts|orders)\b', plan)
+
+    def test_hot_queries_use_indexes(self) -> None:
+        # login
+        self.assertUsesIndex('SELECT * FROM users WHERE username = ?', ('admin',))
+        # register
+        self.assertUsesIndex('SELECT COUNT(*) AS enum FROM users WHERE username = ? OR email = ?',
+                             ('admin', 'admin@example.com'))
+        # get_cart
+        self.assertUsesIndex('''
+            SELECT c.id, p.name FROM carts c JOIN products p ON c.product_id = p.id WHERE c.user_id = ?
+        ''', (1,))
+        # order history
+        self.assertUsesIndex('SELECT * FROM orders WHERE user_id = ? ORDER BY order_date DESC', (1,))
+
+if __name__ == '__main__':
+    unittest.main()
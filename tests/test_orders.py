@@ -0,0 +1,68 @@
+import unittest
+from app import app
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class TestOrders(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def place_order(self, user_id: int, product_ids: list[int]) -> int:
+        batch_response = self.client.post('/v1/cart/batch', json={
+            'user_id': user_id,
+            'items': [{'product_id': product_id, 'quantity': 1, 'op': 'set'} for product_id in product_ids]
+        })
+        self.assertEqual(batch_response.status_code, 200)
+        order_response = self.client.post(f'/v1/order/{user_id}')
+        self.assertEqual(order_response.status_code, 201)
+        return order_response.get_json()['order_id']
+
+    def test_order_history(self) -> None:
+        # Login as the test user
+        login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('TEST_USERNAME', 'testuser'),
+            'password': os.getenv('TEST_PASSWORD', 'testpass')
+        })
+        self.assertEqual(login_response.status_code, 200)
+        user_id = login_response.get_json()['id']
+        self.client.delete(f'/v1/cart/{user_id}')
+
+        # Place two orders
+        products_data = self.client.get('/v1/products?limit=2&in_stock=true').get_json()
+        product_ids = [product['id'] for product in products_data]
+        first_order_id = self.place_order(user_id, product_ids)
+        second_order_id = self.place_order(user_id, product_ids[:1])
+
+        # Newest first, one order per page
+        history_response = self.client.get(f'/v1/orders/{user_id}?limit=1')
+        self.assertEqual(history_response.status_code, 200)
+        [latest] = history_response.get_json()
+        self.assertEqual(latest['id'], second_order_id)
+        self.assertEqual([item['product_id'] for item in latest['items']], product_ids[:1])
+        next_cursor = history_response.headers['X-Next-Cursor']
+
+        history_response = self.client.get(f'/v1/orders/{user_id}?limit=1&before={next_cursor}')
+        [previous] = history_response.get_json()
+        self.assertEqual(previous['id'], first_order_id)
+        self.assertEqual(len(previous['items']), 2)
+        self.assertAlmostEqual(previous['total_price'], sum(item['subtotal'] for item in previous['items']))
+
+        # Single order
+        order_response = self.client.get(f'/v1/orders/{user_id}/{first_order_id}')
+        self.assertEqual(order_response.status_code, 200)
+        self.assertEqual(order_response.get_json()['status'], 'Pending')
+
+        # Orders are only visible to their own user
+        order_response = self.client.get(f'/v1/orders/{user_id + 1}/{first_order_id}')
+        self.assertEqual(order_response.status_code, 403)
+
+        # Logout as the test user
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 import unittest
+import gzip
+import json
 from app import app
 import os
 from dotenv import load_dotenv
@@ -70,6 +72,124 @@ class TestProduct(unittest.TestCase):
         logout_response = self.client.post('/v1/logout')        
         self.assertEqual(logout_response.status_code, 200)
 
+    def test_get_products_pagination(self) -> None:
+        # Get the first page with a single product
+        first_page_response = self.client.get('/v1/products?limit=1')
+        self.assertEqual(first_page_response.status_code, 200)
+        first_page = first_page_response.get_json()
+        self.assertEqual(len(first_page), 1)
+        next_cursor = first_page_response.headers['X-Next-Cursor']
+        self.assertEqual(next_cursor, str(first_page[0]['id']))
+
+        # The next page starts right after the cursor
+        second_page_response = self.client.get(f'/v1/products?limit=1&after={next_cursor}')
+        self.assertEqual(second_page_response.status_code, 200)
+        self.assertGreater(second_page_response.get_json()[0]['id'], first_page[0]['id'])
+
+        # Filters and projection
+        filtered_response = self.client.get('/v1/products?in_stock=true&min_price=100&fields=name,price')
+        self.assertEqual(filtered_response.status_code, 200)
+        for product in filtered_response.get_json():
+            self.assertEqual(set(product), {'id', 'name', 'price'})
+            self.assertGreaterEqual(product['price'], 100)
+
+        # Invalid page sizes and fields are rejected
+        self.assertEqual(self.client.get('/v1/products?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/v1/products?fields=password').status_code, 400)
+
+    def test_search_products(self) -> None:
+        # First, login as admin
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+
+        # Add a product to search for
+        add_product_response = self.client.post('/v1/products', json={
+            'name': 'Quokkaphone Search Product',
+            'description': 'A product with a distinctive zebrawood finish.',
+            'price': 5.99,
+            'stock': 10
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+
+        # Prefix match on the name and on the description
+        search_response = self.client.get('/v1/products/search?q=quokka')
+        self.assertEqual(search_response.status_code, 200)
+        self.assertIn(product_id, [p['id'] for p in search_response.get_json()])
+        search_response = self.client.get('/v1/products/search?q=zebraw')
+        self.assertIn(product_id, [p['id'] for p in search_response.get_json()])
+
+        # Renaming the product updates the index
+        update_product_response = self.client.put(f'/v1/products/{product_id}', json={
+            'name': 'Renamed Search Product',
+            'description': 'Plain description.',
+            'price': 5.99,
+            'stock': 10
+        })
+        self.assertEqual(update_product_response.status_code, 200)
+        search_response = self.client.get('/v1/products/search?q=quokka')
+        self.assertNotIn(product_id, [p['id'] for p in search_response.get_json()])
+
+        # Deleting the product removes it from the index
+        delete_product_response = self.client.delete(f'/v1/products/{product_id}')
+        self.assertEqual(delete_product_response.status_code, 200)
+        search_response = self.client.get('/v1/products/search?q=renamed')
+        self.assertNotIn(product_id, [p['id'] for p in search_response.get_json()])
+
+        # A query is required
+        self.assertEqual(self.client.get('/v1/products/search').status_code, 400)
+
+        # A negative offset is rejected with its own message
+        offset_response = self.client.get('/v1/products/search?q=quokka&offset=-1')
+        self.assertEqual(offset_response.status_code, 400)
+        self.assertEqual(offset_response.get_json()['error'], 'Bad Request: offset must be non-negative')
+
+    def test_export_products(self) -> None:
+        # Full export, one JSON document per line
+        export_response = self.client.get('/v1/products/export')
+        self.assertEqual(export_response.status_code, 200)
+        self.assertEqual(export_response.mimetype, 'application/x-ndjson')
+        exported = [json.loads(line) for line in export_response.data.decode().splitlines()]
+        self.assertTrue(exported)
+        self.assertIn('updated_at', exported[0])
+        last_updated_at = max(product['updated_at'] for product in exported)
+
+        # Login as admin and add a product
+        admin_login_response = self.client.post('/v1/login', json={
+            'username': os.getenv('ADMIN_USERNAME'),
+            'password': os.getenv('ADMIN_PASSWORD')
+        })
+        self.assertEqual(admin_login_response.status_code, 200)
+        add_product_response = self.client.post('/v1/products', json={
+            'name': 'Export Product',
+            'description': 'This is a test product.',
+            'price': 19.99,
+            'stock': 100
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+
+        # An incremental, gzip-compressed export contains the new product, after
+        # the rows of the millisecond it resumes from
+        export_response = self.client.get(f'/v1/products/export?since={last_updated_at}',
+                                          headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(export_response.status_code, 200)
+        self.assertEqual(export_response.headers['Content-Encoding'], 'gzip')
+        exported = [json.loads(line) for line in gzip.decompress(export_response.data).decode().splitlines()]
+        self.assertEqual(exported[-1]['id'], product_id)
+        self.assertTrue(all(product['updated_at'] == last_updated_at for product in exported[:-1]))
+
+        # Delete the product
+        delete_product_response = self.client.delete(f'/v1/products/{product_id}')
+        self.assertEqual(delete_product_response.status_code, 200)
+
+        # Logout as admin
+        logout_response = self.client.post('/v1/logout')
+        self.assertEqual(logout_response.status_code, 200)
+
     def test_add_product(self) -> None:
         # First, login as admin
         admin_login_response = self.client.post('/v1/login', json={
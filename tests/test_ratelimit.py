@@ -0,0 +1,86 @@
+import threading
+import unittest
+from app import app, admission, create_app
+from ratelimit import ConcurrencyLimiter, MemoryBucketStore, RateLimit
+
+class TestMemoryBucketStore(unittest.TestCase):
+
+    def test_burst_then_refill(self) -> None:
+        store = MemoryBucketStore()
+        limit = RateLimit(rate=10, burst=3)
+        self.assertEqual([store.take('k', limit) for _ in range(3)], [0, 0, 0])
+        wait = store.take('k', limit)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+        # Buckets are independent per key
+        self.assertEqual(store.take('other', limit), 0)
+
+    def test_eviction(self) -> None:
+        store = MemoryBucketStore(maxsize=2)
+        limit = RateLimit(rate=1, burst=1)
+        for key in ('a', 'b', 'c'):
+            store.take(key, limit)
+        self.assertEqual(len(store._buckets), 2)
+        self.assertEqual(store.take('a', limit), 0)
+
+class TestRateLimiting(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        app.config['RATELIMIT_ENABLED'] = True
+        self.client = app.test_client()
+
+    def tearDown(self) -> None:
+        app.config.pop('RATELIMIT_ENABLED')
+
+    def test_login_rate_limit(self) -> None:
+        statuses = [self.client.post('/v1/login', json={'username': 'nobody', 'password': 'wrong'},
+                                     environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code
+                    for _ in range(12)]
+        self.assertEqual(statuses[0], 401)
+        self.assertEqual(statuses[-1], 429)
+        response = self.client.post('/v1/login', json={'username': 'nobody', 'password': 'wrong'},
+                                    environ_base={'REMOTE_ADDR': '203.0.113.7'})
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+        # Other clients are unaffected
+        self.assertEqual(self.client.post('/v1/login', json={'username': 'nobody', 'password': 'wrong'},
+                                          environ_base={'REMOTE_ADDR': '203.0.113.8'}).status_code, 401)
+
+    def test_limits_from_config(self) -> None:
+        limits = {'login': RateLimit(rate=1, burst=1)}
+        limiter = create_app({'RATELIMITS': limits, 'RATELIMIT_DEFAULT': None}).extensions['rate_limiter']
+        self.assertEqual((limiter.limits, limiter.default), (limits, None))
+        self.assertEqual(app.extensions['rate_limiter'].limits['login'], RateLimit(rate=1, burst=10))
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_overload_returns_503(self) -> None:
+        slots = []
+        while admission._slots.acquire(blocking=False):
+            slots.append(1)
+        timeout, admission.queue_timeout = admission.queue_timeout, 0.01
+        try:
+            response = self.client.get('/v1/products/1')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+        finally:
+            admission.queue_timeout = timeout
+            for _ in slots:
+                admission._slots.release()
+        self.assertEqual(self.client.get('/v1/products/1').status_code, 200)
+
+    def test_waits_for_a_slot(self) -> None:
+        limiter = ConcurrencyLimiter(max_in_flight=1, queue_timeout=1)
+        limiter._slots.acquire()
+        threading.Timer(0.05, limiter._slots.release).start()
+        with app.test_request_context():
+            self.assertIsNone(limiter.admit())
+            limiter.release()
+
+if __name__ == '__main__':
+    unittest.main()
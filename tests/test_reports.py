@@ -0,0 +1,104 @@
+import os
+import unittest
+from datetime import date
+from app import app
+from dotenv import load_dotenv
+from models import db, ensure_bootstrapped
+from rollups import rebuild
+
+load_dotenv()
+
+class TestReports(unittest.TestCase):
+
+    def setUp(self) -> None:
+        ensure_bootstrapped()
+        app.config['TESTING'] = True
+        self.client = app.test_client(use_cookies=False)
+        self.user_id, self.user = self.login(os.getenv('TEST_USERNAME', 'testuser'), os.getenv('TEST_PASSWORD', 'testpass'))
+        _, self.admin = self.login(os.getenv('ADMIN_USERNAME'), os.getenv('ADMIN_PASSWORD'))
+
+    def login(self, username: str, password: str) -> tuple[int, dict]:
+        response = self.client.post('/v1/login', json={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['id'], {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    def report(self, path: str) -> dict:
+        response = self.client.get(f'/v1/admin/reports/{path}', headers=self.admin)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def snapshot(self, product_id: int) -> tuple:
+        return (self.report('sales')['totals'], self.report(f'products/{product_id}')['days'],
+                self.report(f'users/{self.user_id}'))
+
+    def test_rollups(self) -> None:
+        product_id = self.client.post('/v1/products', headers=self.admin, json={
+            'name': 'Report Test Product', 'description': 'This is a test product', 'price': 2.5, 'stock': 12
+        }).get_json()['product']['id']
+        self.assertNotIn(product_id, [row['product_id'] for row in self.report('low-stock')['products']])
+        before = self.report('sales')['totals']
+        # Ids of deleted products are reused, and so is their sales history
+        product_before = {row['day']: row for row in self.report(f'products/{product_id}')['days']}
+        user_before = self.report(f'users/{self.user_id}')
+
+        self.client.delete(f'/v1/cart/{self.user_id}', headers=self.user)
+        self.client.post('/v1/cart', headers=self.user, json={
+            'user_id': self.user_id, 'product_id': product_id, 'quantity': 4})
+        self.assertEqual(self.client.post(f'/v1/order/{self.user_id}', headers=self.user).status_code, 201)
+
+        # Updated by the checkout itself
+        totals = self.report('sales')['totals']
+        self.assertEqual(totals['orders'], before['orders'] + 1)
+        self.assertEqual(totals['units'], before['units'] + 4)
+        self.assertAlmostEqual(totals['revenue'], before['revenue'] + 10.0)
+        today = self.report(f'products/{product_id}')['days'][-1]
+        self.assertEqual(today['day'], date.today().isoformat())
+        self.assertEqual(today['units'], product_before.get(today['day'], {'units': 0})['units'] + 4)
+        self.assertEqual(self.report(f'users/{self.user_id}')['orders'], user_before['orders'] + 1)
+        top = self.report('products?limit=100')['products']
+        self.assertIn(product_id, [row['product_id'] for row in top])
+        self.assertIn(self.user_id, [row['user_id'] for row in self.report('users?limit=100')])
+
+        # Stock 12 - 4 is low
+        self.assertIn({'product_id': product_id, 'name': 'Report Test Product', 'stock': 8},
+                      self.report('low-stock')['products'])
+        self.assertNotIn(product_id, [row['product_id'] for row in self.report('low-stock?below=5')['products']])
+
+        # Rebuilding from the order history gives the same totals
+        incremental = self.snapshot(product_id)
+        rebuild()
+        self.assertEqual(self.snapshot(product_id), incremental)
+
+    def test_revenue_does_not_drift(self) -> None:
+        # 0.1 + 0.1 + 0.1 is not 0.3 in floating point; the stored totals are
+        # rounded to cents as they are added up, as a rebuild rounds them
+        product_id = self.client.post('/v1/products', headers=self.admin, json={
+            'name': 'Report Cents Product', 'description': 'This is a test product', 'price': 0.1, 'stock': 30
+        }).get_json()['product']['id']
+        rebuild()
+        for _ in range(3):
+            self.client.delete(f'/v1/cart/{self.user_id}', headers=self.user)
+            self.client.post('/v1/cart', headers=self.user, json={
+                'user_id': self.user_id, 'product_id': product_id, 'quantity': 1})
+            self.assertEqual(self.client.post(f'/v1/order/{self.user_id}', headers=self.user).status_code, 201)
+
+        def stored() -> list:
+            return sorted(tuple(row.values()) for rows in db.fan_out('''
+                SELECT 'day', day, revenue FROM sales_daily
+                UNION ALL SELECT 'product', product_id || '/' || day, revenue FROM product_sales_daily
+                UNION ALL SELECT 'user', user_id, revenue FROM user_sales
+            ''').values() for row in rows)
+        incremental = stored()
+        self.assertIn(('product', f'{product_id}/{date.today().isoformat()}', 0.3), incremental)
+        rebuild()
+        self.assertEqual(stored(), incremental)
+
+    def test_bad_requests(self) -> None:
+        for path in ('sales?from=yesterday', 'sales?from=2024-02-01&to=2024-01-01', 'products?limit=0',
+                     'low-stock?below=1000'):
+            response = self.client.get(f'/v1/admin/reports/{path}', headers=self.admin)
+            self.assertEqual(response.status_code, 400, path)
+        self.assertEqual(self.client.get('/v1/admin/reports/sales', headers=self.user).status_code, 403)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from app import app
+import os
+from dotenv import load_dotenv
+from models import db
+from reservations import release_expired
+
+load_dotenv()
+
+class TestReservations(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client(use_cookies=False)
+
+    def login(self, username: str, password: str) -> tuple[int, dict]:
+        response = self.client.post('/v1/login', json={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['id'], {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    def test_holds(self) -> None:
+        admin_id, admin = self.login(os.getenv('ADMIN_USERNAME'), os.getenv('ADMIN_PASSWORD'))
+        user_id, user = self.login(os.getenv('TEST_USERNAME', 'testuser'), os.getenv('TEST_PASSWORD', 'testpass'))
+        add_product_response = self.client.post('/v1/products', headers=admin, json={
+            'name': 'Reservation Test Product', 'description': 'This is a test product', 'price': 3.0, 'stock': 5
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+        self.client.delete(f'/v1/cart/{user_id}', headers=user)
+        self.client.delete(f'/v1/cart/{admin_id}', headers=admin)
+
+        # The user's cart holds 3 of the 5 units
+        cart_response = self.client.post('/v1/cart', headers=user, json={
+            'user_id': user_id, 'product_id': product_id, 'quantity': 3
+        })
+        self.assertEqual(cart_response.status_code, 201)
+        availability = self.client.get(f'/v1/products/{product_id}/availability').get_json()
+        self.assertEqual(availability, {'stock': 5, 'reserved': 3, 'available': 2})
+
+        # Another cart cannot take more than the rest
+        batch = {'user_id': admin_id, 'items': [{'product_id': product_id, 'quantity': 3, 'op': 'set'}]}
+        self.assertEqual(self.client.post('/v1/cart/batch', headers=admin, json=batch).status_code, 409)
+        self.assertEqual(self.client.get(f'/v1/cart/{admin_id}', headers=admin).get_json()['items'], [])
+
+        # Expired holds stop counting, and the sweeper deletes them
+        db.execute("UPDATE reservations SET expires_at = '2000-01-01T00:00:00.000Z' WHERE user_id = ?", (user_id,))
+        self.assertEqual(self.client.post('/v1/cart/batch', headers=admin, json=batch).status_code, 200)
+        self.assertGreaterEqual(release_expired(), 1)
+        self.assertEqual(self.client.get(f'/v1/products/{product_id}/availability').get_json()['reserved'], 3)
+
+        # Checkout takes the hold again: only 2 units are left for the user's 3
+        order_response = self.client.post(f'/v1/order/{user_id}', headers=user)
+        self.assertEqual(order_response.status_code, 400)
+
+        # The admin's checkout converts its hold into a sale
+        order_response = self.client.post(f'/v1/order/{admin_id}', headers=admin)
+        self.assertEqual(order_response.status_code, 201)
+        availability = self.client.get(f'/v1/products/{product_id}/availability').get_json()
+        self.assertEqual(availability, {'stock': 2, 'reserved': 0, 'available': 2})
+
+        # Clean up
+        self.client.delete(f'/v1/cart/{user_id}', headers=user)
+        self.assertEqual(self.client.delete(f'/v1/products/{product_id}', headers=admin).status_code, 200)
+
+    def test_holds_cannot_oversell(self) -> None:
+        admin_id, admin = self.login(os.getenv('ADMIN_USERNAME'), os.getenv('ADMIN_PASSWORD'))
+        user_id, user = self.login(os.getenv('TEST_USERNAME', 'testuser'), os.getenv('TEST_PASSWORD', 'testpass'))
+        add_product_response = self.client.post('/v1/products', headers=admin, json={
+            'name': 'Oversell Test Product', 'description': 'This is a test product', 'price': 3.0, 'stock': 5
+        })
+        self.assertEqual(add_product_response.status_code, 201)
+        product_id = add_product_response.get_json()['product']['id']
+        self.client.delete(f'/v1/cart/{user_id}', headers=user)
+        self.client.delete(f'/v1/cart/{admin_id}', headers=admin)
+
+        # A negative, fractional or missing quantity takes no hold
+        for quantity in (-10, 0, 1.5, True, None):
+            cart_response = self.client.post('/v1/cart', headers=admin, json={
+                'user_id': admin_id, 'product_id': product_id, 'quantity': quantity
+            })
+            self.assertEqual(cart_response.status_code, 400, quantity)
+        cart_response = self.client.post('/v1/cart', headers=admin, json={'user_id': admin_id, 'product_id': product_id})
+        self.assertEqual(cart_response.status_code, 400)
+        availability = self.client.get(f'/v1/products/{product_id}/availability').get_json()
+        self.assertEqual(availability, {'stock': 5, 'reserved': 0, 'available': 5})
+
+        # Even a negative hold slipped in behind the API cannot make checkout oversell
+        db.execute("INSERT INTO reservations (user_id, product_id, quantity, expires_at) "
+                   "VALUES (?, ?, -10, '2999-01-01T00:00:00.000Z')", (admin_id, product_id))
+        cart_response = self.client.post('/v1/cart', headers=user, json={
+            'user_id': user_id, 'product_id': product_id, 'quantity': 15
+        })
+        self.assertEqual(cart_response.status_code, 201)
+        order_response = self.client.post(f'/v1/order/{user_id}', headers=user)
+        self.assertEqual(order_response.status_code, 400)
+        self.assertEqual(self.client.get(f'/v1/products/{product_id}/availability').get_json()['stock'], 5)
+
+        # Clean up
+        db.execute('DELETE FROM reservations WHERE user_id = ? AND product_id = ?', (admin_id, product_id))
+        self.client.delete(f'/v1/cart/{user_id}', headers=user)
+        self.assertEqual(self.client.delete(f'/v1/products/{product_id}', headers=admin).status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import gzip
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from app import app
+import responses
+
+class TestResponses(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_provider_matches_stdlib(self) -> None:
+        # Whatever Flask's provider could serialize, ours serializes to the same data
+        data = {'id': 1, 'price': 9.99, 'name': 'Café', 'tags': ['a', None], 2: True,
+                'created_at': datetime(2024, 1, 2, 3, 4, 5), 'total': Decimal('1.50')}
+        with app.app_context():
+            body = app.json.response(data).get_data()
+        self.assertEqual(json.loads(body), {
+            'id': 1, 'price': 9.99, 'name': 'Café', 'tags': ['a', None], '2': True,
+            'created_at': 'Tue, 02 Jan 2024 03:04:05 GMT', 'total': '1.50'})
+
+    def test_large_listing_is_compressed(self) -> None:
+        plain = self.client.get('/v1/products?limit=50')
+        self.assertEqual(plain.status_code, 200)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        compressed = self.client.get('/v1/products?limit=50', headers={'Accept-Encoding': 'gzip'})
+        self.assertGreaterEqual(len(plain.data), responses.COMPRESS_MIN_SIZE)
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertLess(len(compressed.data), len(plain.data))
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+
+        # The compressed body gets a weak tag, which still revalidates
+        etag = compressed.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        cached = self.client.get('/v1/products?limit=50', headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_small_response_is_not_compressed(self) -> None:
+        response = self.client.get('/v1/products?limit=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+if __name__ == '__main__':
+    unittest.main()
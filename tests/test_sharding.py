@@ -0,0 +1,172 @@
+import os
+import tempfile
+import unittest
+from app import app
+from dotenv import load_dotenv
+from connection import shard_of
+from jobs import drain
+from migrations import ID_BLOCK
+from models import bootstrap, configure_database, db, ensure_bootstrapped
+from sharding import reshard
+
+load_dotenv()
+
+class TestShardOf(unittest.TestCase):
+
+    def test_spread(self) -> None:
+        counts = [0] * 4
+        for user_id in range(1, 4001):
+            counts[shard_of(user_id, 4)] += 1
+        self.assertTrue(all(800 < count < 1200 for count in counts), counts)
+
+    def test_new_shard_only_takes_users(self) -> None:
+        # Going from 4 to 5 shards moves users onto the new shard, never between the old ones
+        moved = 0
+        for user_id in range(1, 4001):
+            before, after = shard_of(user_id, 4), shard_of(user_id, 5)
+            self.assertIn(after, (before, 4))
+            moved += after != before
+        self.assertTrue(600 < moved < 1000, moved)
+
+class TestSharding(unittest.TestCase):
+    # The whole app on a catalog of its own: first unsharded, then resharded
+    # onto two shards, then onto three
+
+    def setUp(self) -> None:
+        ensure_bootstrapped()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (db.catalog.pool.path, [shard.pool.path for shard in db.shards])
+        db.release()
+        configure_database(self.path('catalog.db'), [])
+        bootstrap()
+        app.config['TESTING'] = True
+        self.client = app.test_client(use_cookies=False)
+
+    def tearDown(self) -> None:
+        db.release()
+        configure_database(*self.original)
+        self.tmpdir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmpdir.name, name)
+
+    def use_shards(self, *names: str) -> None:
+        db.release()
+        configure_database(self.path('catalog.db'), [self.path(name) for name in names])
+        bootstrap()
+
+    def login(self, username: str, password: str) -> tuple[int, dict]:
+        response = self.client.post('/v1/login', json={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        return body['id'], {'Authorization': f"Bearer {body['token']}"}
+
+    def add_product(self, stock: int, price: float = 10.0) -> int:
+        response = self.client.post('/v1/products', headers=self.admin, json={
+            'name': 'Sharded', 'description': 'Sharding test', 'price': price, 'stock': stock})
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['product']['id']
+
+    def checkout(self, user: str, product_id: int, quantity: int = 1) -> int:
+        user_id, headers = self.users[user]
+        response = self.client.post('/v1/cart', headers=headers, json={
+            'user_id': user_id, 'product_id': product_id, 'quantity': quantity})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(f'/v1/order/{user_id}', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['order_id']
+
+    def order_ids(self, user: str) -> list[int]:
+        user_id, headers = self.users[user]
+        response = self.client.get(f'/v1/orders/{user_id}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return [order['id'] for order in response.get_json()]
+
+    def test_reshard_and_routes(self) -> None:
+        _, self.admin = self.login(os.getenv('ADMIN_USERNAME'), os.getenv('ADMIN_PASSWORD'))
+        self.users = {}
+        for name in ('alice', 'bob', 'carol', 'dave'):
+            response = self.client.post('/v1/register', json={
+                'username': name, 'password': 'secret', 'email': f'{name}@example.com'})
+            self.assertEqual(response.status_code, 201)
+            self.users[name] = self.login(name, 'secret')
+        product_id = self.add_product(stock=100)
+        first_order = self.checkout('alice', product_id)
+
+        # From the single database onto two shards
+        report = reshard([self.path('shard0.db'), self.path('shard1.db')])
+        self.assertEqual(sum(report['moved'].values()), 5)
+        self.use_shards('shard0.db', 'shard1.db')
+        on_shard = lambda user: shard_of(self.users[user][0], 2)
+        self.assertEqual({on_shard(user) for user in self.users}, {0, 1})
+        for user, (user_id, _) in self.users.items():
+            with db.using(user_id):
+                self.assertEqual(db.q('SELECT username FROM users WHERE id = ?', (user_id,))[0]['username'], user)
+        # The catalog keeps the directory, without the passwords
+        self.assertEqual(db.catalog.q('SELECT COUNT(*) AS n FROM users WHERE password IS NOT NULL')[0]['n'], 0)
+        self.assertEqual(self.order_ids('alice'), [first_order])
+        self.users['alice'] = self.login('alice', 'secret')
+
+        # Holds are counted across shards
+        scarce = self.add_product(stock=3)
+        one, other = (next(user for user in self.users if on_shard(user) == shard) for shard in (0, 1))
+        response = self.client.post('/v1/cart', headers=self.users[one][1], json={
+            'user_id': self.users[one][0], 'product_id': scarce, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/v1/cart', headers=self.users[other][1], json={
+            'user_id': self.users[other][0], 'product_id': scarce, 'quantity': 2})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(f'/v1/products/{scarce}/availability').get_json(),
+                         {'stock': 3, 'reserved': 2, 'available': 1})
+
+        # Cart summaries on the shards follow price changes in the catalog
+        self.client.put(f'/v1/products/{scarce}', headers=self.admin, json={
+            'name': 'Sharded', 'description': 'Sharding test', 'price': 12.5, 'stock': 3})
+        cart = self.client.get(f'/v1/cart/{self.users[one][0]}', headers=self.users[one][1]).get_json()
+        self.assertEqual(cart['total_price'], 25.0)
+
+        # Checkouts on both shards take the catalog's stock; ids never collide
+        orders = [self.client.post(f'/v1/order/{self.users[one][0]}', headers=self.users[one][1]).get_json()['order_id'],
+                  self.checkout(other, scarce)]
+        self.assertEqual(self.client.get(f'/v1/products/{scarce}/availability').get_json()['stock'], 0)
+        self.assertEqual(self.client.post('/v1/cart', headers=self.users['dave'][1], json={
+            'user_id': self.users['dave'][0], 'product_id': scarce, 'quantity': 1}).status_code, 409)
+        self.assertEqual(len({order_id // ID_BLOCK for order_id in orders}), 2)
+        # Each order's job is on its shard, the first one moved there by the reshard
+        self.assertEqual(drain(), {'done': 3})
+        # Sales totals add up over the shards, the first order's rebuilt by the reshard
+        response = self.client.get('/v1/admin/reports/sales', headers=self.admin)
+        self.assertEqual(response.get_json()['totals'], {'orders': 3, 'units': 4, 'revenue': 47.5})
+
+        # Admins page through the orders of every shard, newest first
+        seen, url = [], '/v1/admin/orders?limit=1'
+        while url:
+            response = self.client.get(url, headers=self.admin)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(response.get_json())
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        self.assertEqual([order['id'] for order in seen], [*reversed(orders), first_order])
+        self.assertEqual(seen[0]['items'][0]['product_id'], scarce)
+        self.assertEqual({order['status'] for order in seen}, {'Confirmed'})
+
+        # A deleted user leaves the directory too, so the name is free again
+        self.assertEqual(self.client.delete('/v1/user/carol', headers=self.admin).status_code, 200)
+        response = self.client.post('/v1/register', json={
+            'username': 'carol', 'password': 'secret', 'email': 'carol@example.com'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.post('/v1/login', json={'username': 'carol', 'password': 'secret'}).status_code, 200)
+
+        # Onto a third shard: only the users placed on it move
+        history = {user: self.order_ids(user) for user in ('alice', one, other)}
+        report = reshard([self.path('shard0.db'), self.path('shard1.db'), self.path('shard2.db')])
+        self.assertTrue(all(move.endswith('shard2.db') for move in report['moved']), report)
+        self.use_shards('shard0.db', 'shard1.db', 'shard2.db')
+        self.assertEqual({user: self.order_ids(user) for user in history}, history)
+        stats = self.client.get('/v1/admin/shards', headers=self.admin).get_json()
+        self.assertEqual(sum(shard['users'] for shard in stats['shards']),
+                         db.catalog.q('SELECT COUNT(*) AS n FROM users')[0]['n'])
+        self.assertEqual(self.client.get('/v1/user/bob').get_json()['email'], 'bob@example.com')
+
+if __name__ == '__main__':
+    unittest.main()
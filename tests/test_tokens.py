@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+from app import app
+import os
+from dotenv import load_dotenv
+from tokens import InvalidToken, TokenSigner
+
+load_dotenv()
+
+class TestTokenSigner(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.signer = TokenSigner({'k1': b'first-secret'})
+
+    def test_issue_and_verify(self) -> None:
+        token = self.signer.issue(7, 'someone', 'user')
+        claims = self.signer.verify(token)
+        self.assertEqual((claims['sub'], claims['username'], claims['role']), (7, 'someone', 'user'))
+
+        kid, payload, signature = token.split('.')
+        with self.assertRaises(InvalidToken):
+            self.signer.verify(f'{kid}.{payload}.{signature[:-2]}xx')
+        with self.assertRaises(InvalidToken):
+            self.signer.verify('not-a-token')
+        with self.assertRaises(InvalidToken):
+            self.signer.verify(f'{kid}.{payload}.é')
+
+    def test_from_env_rejects_keys_without_secret(self) -> None:
+        with mock.patch.dict(os.environ, {'TOKEN_KEYS': 'k1'}):
+            with self.assertRaisesRegex(ValueError, 'kid:secret'):
+                TokenSigner.from_env()
+
+    def test_expiry_and_revocation(self) -> None:
+        expired = TokenSigner({'k1': b'first-secret'}, ttl=-1).issue(7, 'someone', 'user')
+        with self.assertRaises(InvalidToken):
+            self.signer.verify(expired)
+
+        token = self.signer.issue(7, 'someone', 'user')
+        self.signer.revoke(self.signer.verify(token))
+        with self.assertRaises(InvalidToken):
+            self.signer.verify(token)
+
+    def test_key_rotation(self) -> None:
+        old_token = self.signer.issue(7, 'someone', 'user')
+        rotated = TokenSigner({'k2': b'second-secret', 'k1': b'first-secret'})
+        # Old tokens stay valid while their key is listed; new ones use the new key
+        self.assertEqual(rotated.verify(old_token)['sub'], 7)
+        self.assertTrue(rotated.issue(7, 'someone', 'user').startswith('k2.'))
+        with self.assertRaises(InvalidToken):
+            TokenSigner({'k2': b'second-secret'}).verify(old_token)
+
+class TestBearerAuth(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app.config['TESTING'] = True
+        self.client = app.test_client(use_cookies=False)
+
+    def login(self, username: str, password: str) -> dict:
+        response = self.client.post('/v1/login', json={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_bearer_token(self) -> None:
+        user = self.login(os.getenv('TEST_USERNAME', 'testuser'), os.getenv('TEST_PASSWORD', 'testpass'))
+        headers = {'Authorization': f"Bearer {user['token']}"}
+
+        # Own cart only
+        self.assertEqual(self.client.get(f"/v1/cart/{user['id']}").status_code, 401)
+        self.assertEqual(self.client.get(f"/v1/cart/{user['id']}", headers=headers).status_code, 200)
+        self.assertEqual(self.client.get(f"/v1/cart/{user['id'] + 1}", headers=headers).status_code, 403)
+        self.assertEqual(self.client.delete('/v1/products/1', headers=headers).status_code, 403)
+
+        # A tampered token is rejected before reaching the route
+        bad_headers = {'Authorization': f"Bearer {user['token']}x"}
+        self.assertEqual(self.client.get('/v1/products', headers=bad_headers).status_code, 401)
+        bad_headers = {'Authorization': f"Bearer {user['token'].rsplit('.', 1)[0]}.é"}
+        self.assertEqual(self.client.get('/v1/products', headers=bad_headers).status_code, 401)
+
+        # Logout revokes the token
+        self.assertEqual(self.client.post('/v1/logout', headers=headers).status_code, 200)
+        self.assertEqual(self.client.get(f"/v1/cart/{user['id']}", headers=headers).status_code, 401)
+
+    def test_admin_bearer_token(self) -> None:
+        admin = self.login(os.getenv('ADMIN_USERNAME', 'admin'), os.getenv('ADMIN_PASSWORD', 'admin_password'))
+        headers = {'Authorization': f"Bearer {admin['token']}"}
+        response = self.client.post('/v1/products', headers=headers, json={
+            'name': 'Token Product', 'description': 'Created with a bearer token', 'price': 1.0, 'stock': 1
+        })
+        self.assertEqual(response.status_code, 201)
+        product_id = response.get_json()['product']['id']
+        self.assertEqual(self.client.delete(f'/v1/products/{product_id}', headers=headers).status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from flask import g, jsonify, request, session
+
+class InvalidToken(Exception):
+    pass
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+class TokenSigner:
+    """Stateless, expiring bearer tokens signed with HMAC-SHA256.
+
+    A token is ``<key id>.<payload>.<signature>``. New tokens are signed with
+    the first key; every listed key is accepted, so a key can be rotated by
+    putting a new one in front and dropping the old one once its tokens have
+    expired. Logout revokes a token by its ``jti`` in an in-memory list that
+    only needs to hold entries until they would have expired anyway.
+    """
+
+    def __init__(self, keys: dict[str, bytes], ttl: int = 3600) -> None:
+        if not keys:
+            raise ValueError('At least one signing key is required')
+        self.keys = keys
+        self.active_kid = next(iter(keys))
+        self.ttl = ttl
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'TokenSigner':
+        # TOKEN_KEYS=kid:secret,kid:secret with the signing key first
+        keys = {}
+        for item in filter(None, os.getenv('TOKEN_KEYS', '').split(',')):
+            kid, separator, secret = item.partition(':')
+            if not (kid and separator and secret):
+                raise ValueError(f'TOKEN_KEYS entries must be kid:secret, got {kid!r}')
+            keys[kid] = secret
+        if not keys:
+            keys = {'default': os.getenv('SECRET_KEY') or 'your-secret-key-here'}
+        return cls({kid: secret.encode() for kid, secret in keys.items()},
+                   ttl=int(os.getenv('TOKEN_TTL', 3600)))
+
+    def _sign(self, kid: str, payload: str) -> str:
+        return _b64encode(hmac.new(self.keys[kid], f'{kid}.{payload}'.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id: int, username: str, role: str) -> str:
+        claims = {'sub': user_id, 'username': username, 'role': role,
+                  'exp': int(time.time()) + self.ttl, 'jti': secrets.token_urlsafe(12)}
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+        return f'{self.active_kid}.{payload}.{self._sign(self.active_kid, payload)}'
+
+    def verify(self, token: str) -> dict:
+        try:
+            kid, payload, signature = token.split('.')
+        except ValueError:
+            raise InvalidToken('Malformed token')
+        if kid not in self.keys:
+            raise InvalidToken('Unknown signing key')
+        # As bytes: compare_digest refuses str with non-ASCII characters
+        if not hmac.compare_digest(signature.encode(), self._sign(kid, payload).encode()):
+            raise InvalidToken('Bad signature')
+        claims = json.loads(_b64decode(payload))
+        if claims['exp'] < time.time():
+            raise InvalidToken('Token expired')
+        if claims['jti'] in self._revoked:
+            raise InvalidToken('Token revoked')
+        return claims
+
+    def revoke(self, claims: dict) -> None:
+        now = time.time()
+        with self._lock:
+            # Forget revocations of tokens that have expired since
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp >= now}
+            self._revoked[claims['jti']] = claims['exp']
+
+token_signer = TokenSigner.from_env()
+
+def load_token_user():
+    """before_request hook: verify the bearer token, if any, without touching the DB."""
+    g.token_claims = None
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        g.token_claims = token_signer.verify(header[len('Bearer '):])
+    except InvalidToken as e:
+        return jsonify({'error': f'Unauthorized: {e}'}), 401
+    return None
+
+def current_user() -> dict | None:
+    # Bearer token first, then the cookie session of the browser flow
+    claims = g.get('token_claims')
+    if claims:
+        return {'id': claims['sub'], 'username': claims['username'], 'role': claims['role']}
+    if 'username' in session:
+        return {'id': session.get('user_id'), 'username': session['username'], 'role': session.get('role')}
+    return None
+
+def is_admin() -> bool:
+    user = current_user()
+    return user is not None and user['role'] == 'admin'
+
+def require_user(user_id: int) -> tuple | None:
+    """Return an error response unless the caller is ``user_id`` or an admin."""
+    user = current_user()
+    if user is None:
+        return jsonify({'error': 'Unauthorized: User not logged in'}), 401
+    if user['id'] != user_id and user['role'] != 'admin':
+        return jsonify({'error': 'Forbidden: not your account'}), 403
+    return None